@@ -1,11 +1,30 @@
 from datetime import datetime
+import argparse
+import cProfile
+import functools
+import fnmatch
+import hashlib
+import json
+import logging
+import math
+import mmap
 import os
+import multiprocessing
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+import numpy as np
 import bpy # type: ignore
 import bmesh # type: ignore
 import struct
 from mathutils import Quaternion, Matrix, Vector # type: ignore
 from bpy_extras.io_utils import ImportHelper, ExportHelper # type: ignore
-from bpy.props import StringProperty, EnumProperty, IntProperty, FloatProperty, FloatVectorProperty, BoolProperty # type: ignore
+from bpy.props import StringProperty, EnumProperty, IntProperty, FloatProperty, FloatVectorProperty, BoolProperty, CollectionProperty # type: ignore
 bl_info = {
     "name": "LS3D 4DS Importer/Exporter",
     "author": "Sev3n, Richard01_CZ, Grok 3 AI, Google Gemini 3 Pro Preview, ChatGPT 5.2",
@@ -15,6 +34,97 @@ bl_info = {
     "description": "Import and export LS3D .4ds files (Mafia)",
     "category": "Import-Export",
 }
+log = logging.getLogger("ls3d_4ds")
+
+def configure_logging(level="INFO"):
+    """Sets the addon log level, adding a console handler the first time."""
+    if not log.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter("4DS %(levelname)s: %(message)s"))
+        log.addHandler(handler)
+        log.propagate = False
+    log.setLevel(getattr(logging, level, logging.INFO))
+
+configure_logging()
+
+LOG_LEVEL_ITEMS = (
+    ("ERROR", "Errors", "Only report errors"),
+    ("WARNING", "Warnings", "Report errors and warnings"),
+    ("INFO", "Info", "Report import stages"),
+    ("DEBUG", "Debug", "Report every frame (slow for big files)"),
+)
+
+class Profiler:
+    """
+    Wall time and counters per phase. Phases may nest, times are inclusive.
+    A disabled profiler costs one attribute check per phase.
+    """
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.times = defaultdict(float)
+        self.calls = defaultdict(int)
+        self.counters = defaultdict(int)
+        self.started = time.perf_counter()
+
+    def phase(self, name):
+        return ProfilerPhase(self, name) if self.enabled else NULL_PHASE
+
+    def add(self, name, seconds):
+        if self.enabled:
+            self.times[name] += seconds
+            self.calls[name] += 1
+
+    def count(self, name, amount=1):
+        if self.enabled:
+            self.counters[name] += amount
+
+    def to_dict(self):
+        return {
+            "total_seconds": round(time.perf_counter() - self.started, 6),
+            "phases": {
+                name: {"seconds": round(seconds, 6), "calls": self.calls[name]}
+                for name, seconds in sorted(self.times.items(), key=lambda item: -item[1])
+            },
+            "counters": dict(self.counters),
+        }
+
+    def summary(self, limit=5):
+        """One line for operator reports: total, slowest phases and counters."""
+        data = self.to_dict()
+        phases = ", ".join(f"{name} {p['seconds']:.2f}s" for name, p in list(data["phases"].items())[:limit])
+        counters = ", ".join(f"{name} {value}" for name, value in sorted(data["counters"].items()))
+        return f"{data['total_seconds']:.2f}s total | {phases} | {counters}"
+
+    def write_json(self, path, **meta):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(dict(meta, **self.to_dict()), f, indent=1)
+
+class ProfilerPhase:
+    __slots__ = ("profiler", "name", "start")
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+    def __enter__(self):
+        self.start = time.perf_counter()
+    def __exit__(self, *exc):
+        self.profiler.add(self.name, time.perf_counter() - self.start)
+
+class NullPhase:
+    def __enter__(self): pass
+    def __exit__(self, *exc): pass
+
+NULL_PHASE = NullPhase()
+
+def profiled(phase):
+    """Method decorator timing the call under phase in self.profiler."""
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            with self.profiler.phase(phase):
+                return func(self, *args, **kwargs)
+        return wrapper
+    return decorate
+
 # FileVersion consts
 VERSION_MAFIA = 29
 VERSION_HD2 = 41
@@ -159,6 +269,9 @@ class The4DSPanel(bpy.types.Panel):
             box = layout.box()
             box.label(text="Level-Of-Detail Settings", icon='MESH_DATA')
             box.prop(obj, "ls3d_lod_dist")
+            box.prop(context.scene, "ls3d_lod_preview")
+            box.operator("object.ls3d_generate_lods", icon='MOD_DECIM')
+            box.operator("object.ls3d_generate_occluders", icon='MOD_WIREFRAME')
 
         # --- SPECIFIC TYPES ---
         if "plane" in obj.name.lower() or "portal" in obj.name.lower():
@@ -423,9 +536,523 @@ class LS3D_OT_AddNode(bpy.types.Operator):
         
         return {'FINISHED'}
 
+# --- VERTEX CACHE ---
+# The LS3D renderer draws every face group with one indexed call, so the triangle
+# order decides how often the post-transform cache has to re-run a vertex.
+
+# FIFO entries of the fixed function era hardware the engine targets
+VERTEX_CACHE_SIZE = 16
+
+def cache_misses(triangles, cache_size=VERTEX_CACHE_SIZE):
+    """Simulates a FIFO post-transform cache, returns the number of transformed vertices."""
+    cache = []
+    cached = set()
+    misses = 0
+    for tri in triangles:
+        for v in tri:
+            if v in cached:
+                continue
+            misses += 1
+            cache.append(v)
+            cached.add(v)
+            if len(cache) > cache_size:
+                cached.discard(cache.pop(0))
+    return misses
+
+def tipsify(triangles, cache_size=VERTEX_CACHE_SIZE):
+    """
+    Reorders triangles for the vertex cache (Sander et al., "Fast Triangle
+    Reordering for Vertex Locality and Reduced Overdraw"). Fans around one vertex
+    at a time and picks the next fanning vertex among the ones still in cache.
+    """
+    num_triangles = len(triangles)
+    if num_triangles < 2:
+        return list(triangles)
+    adjacency = defaultdict(list)
+    for t, tri in enumerate(triangles):
+        for v in tri:
+            adjacency[v].append(t)
+    live = {v: len(tris) for v, tris in adjacency.items()}
+    cache_time = dict.fromkeys(adjacency, 0)
+    emitted = [False] * num_triangles
+    dead_end = []
+    result = []
+    time_stamp = cache_size + 1
+    cursor = 0
+    fanning = triangles[0][0]
+    while fanning is not None:
+        candidates = []
+        for t in adjacency[fanning]:
+            if emitted[t]:
+                continue
+            tri = triangles[t]
+            result.append(tri)
+            emitted[t] = True
+            for v in tri:
+                dead_end.append(v)
+                candidates.append(v)
+                live[v] -= 1
+                if time_stamp - cache_time[v] > cache_size:
+                    cache_time[v] = time_stamp
+                    time_stamp += 1
+        
+        # Prefer the candidate that will still be cached after fanning around it
+        fanning = None
+        best = -1
+        for v in candidates:
+            if live[v] <= 0:
+                continue
+            age = time_stamp - cache_time[v]
+            priority = age if age + 2 * live[v] <= cache_size else 0
+            if priority > best:
+                best = priority
+                fanning = v
+        if fanning is None:
+            # Dead end: recently used vertices first, then the next untouched triangle
+            while dead_end:
+                v = dead_end.pop()
+                if live[v] > 0:
+                    fanning = v
+                    break
+            else:
+                while cursor < num_triangles and emitted[cursor]:
+                    cursor += 1
+                if cursor < num_triangles:
+                    fanning = triangles[cursor][0]
+    return result
+
+def optimize_vertex_cache(vertices, groups, renumber=True):
+    """
+    Reorders the triangles of every face group with tipsify and, when renumber is
+    set, renumbers the vertices in order of first use so they are fetched
+    sequentially. Returns (vertices, groups, remap, misses_before, misses_after)
+    with remap[old index] = new index.
+    """
+    misses_before = sum(cache_misses(faces) for faces in groups.values())
+    groups = {key: tipsify(faces) for key, faces in groups.items()}
+    misses_after = sum(cache_misses(faces) for faces in groups.values())
+    remap = list(range(len(vertices)))
+    if renumber:
+        order = {}
+        for faces in groups.values():
+            for tri in faces:
+                for v in tri:
+                    if v not in order:
+                        order[v] = len(order)
+        # Vertices no face uses keep their relative order at the end
+        for v in range(len(vertices)):
+            if v not in order:
+                order[v] = len(order)
+        remap = [order[v] for v in range(len(vertices))]
+        renumbered = [None] * len(vertices)
+        for v, new in enumerate(remap):
+            renumbered[new] = vertices[v]
+        vertices = renumbered
+        groups = {key: [[remap[v] for v in tri] for tri in faces] for key, faces in groups.items()}
+    return vertices, groups, remap, misses_before, misses_after
+
+# Vertex indices and face group sizes are written as 16 bit
+MAX_OBJECT_VERTICES = 0xFFFF
+
+def split_lod_meshes(meshes, limit=MAX_OBJECT_VERTICES):
+    """
+    Splits the extracted LOD meshes of one object into spatially coherent parts
+    of at most limit vertices per LOD. Every part is cut from all LODs with the
+    same median planes (by triangle centroid), so each part keeps the full LOD
+    chain. Returns a list of parts, each a list of meshes like the input.
+    """
+    lods = []
+    for mesh in meshes:
+        positions = np.array([v["pos"] for v in mesh["verts"]], dtype=np.float32).reshape(-1, 3)
+        keys = list(mesh["groups"])
+        triangles = np.array([tri for key in keys for tri in mesh["groups"][key]], dtype=np.int64).reshape(-1, 3)
+        group = np.repeat(np.arange(len(keys)), [len(mesh["groups"][key]) for key in keys])
+        lods.append((positions, triangles, group, keys))
+    centroids = [positions[triangles].mean(axis=1) for positions, triangles, _, _ in lods]
+    
+    regions = []
+    stack = [[np.arange(len(triangles)) for _, triangles, _, _ in lods]]
+    while stack:
+        region = stack.pop()
+        counts = [len(np.unique(lod[1][selected])) for lod, selected in zip(lods, region)]
+        worst = int(np.argmax(counts))
+        if counts[worst] <= limit:
+            regions.append(region)
+            continue
+        points = centroids[worst][region[worst]]
+        axis = int(np.argmax(points.max(axis=0) - points.min(axis=0)))
+        split = np.median(points[:, axis])
+        below = [centroid[selected, axis] < split for centroid, selected in zip(centroids, region)]
+        if below[worst].all() or not below[worst].any():
+            # Centroids on one plane, halve each LOD in order along the axis instead
+            below = []
+            for centroid, selected in zip(centroids, region):
+                side = np.zeros(len(selected), dtype=bool)
+                side[np.argsort(centroid[selected, axis], kind="stable")[:len(selected) // 2]] = True
+                below.append(side)
+        # Pushed last, so popped first: parts come out in order along the split axes
+        stack.append([selected[~side] for selected, side in zip(region, below)])
+        stack.append([selected[side] for selected, side in zip(region, below)])
+    
+    parts = []
+    for region in regions:
+        part = []
+        for mesh, (positions, triangles, group, keys), selected in zip(meshes, lods, region):
+            used, local = np.unique(triangles[selected], return_inverse=True)
+            local = local.reshape(-1, 3)
+            groups = {}
+            for key_idx, tri in zip(group[selected].tolist(), local.tolist()):
+                groups.setdefault(keys[key_idx], []).append(tri)
+            part.append({
+                **mesh,
+                "verts": [mesh["verts"][i] for i in used.tolist()],
+                "groups": groups,
+                "vert_map": {},
+            })
+        parts.append(part)
+    return parts
+
+# --- TEXTURE ATLAS ---
+# Materials that only differ in their diffuse texture can share one atlas texture,
+# which merges their face groups and saves a draw call per merged group.
+
+# Material settings that have to match for materials to share an atlas
+ATLAS_KEY_PROPS = (
+    "ls3d_diffuse_color", "ls3d_ambient_color", "ls3d_emission_color", "ls3d_diff_colored",
+    "ls3d_diff_mipmap", "ls3d_diff_2sided", "ls3d_alpha_addmix", "ls3d_misc_unlit", "ls3d_misc_zwrite",
+)
+# Pixels repeated around every texture so mipmaps don't bleed into the neighbours
+ATLAS_PADDING = 4
+# Tolerance for UVs that sit on the texture border
+ATLAS_UV_EPSILON = 1e-4
+
+def pack_atlas(sizes, max_size):
+    """
+    Shelf packs padded textures into as few atlases of at most max_size pixels as
+    possible. sizes maps key -> (width, height). Returns a list of
+    (width, height, {key: (x, y)}) with power of two dimensions, positions are
+    of the unpadded texture. Textures that can't fit are left out.
+    """
+    items = sorted(
+        ((key, w + 2 * ATLAS_PADDING, h + 2 * ATLAS_PADDING) for key, (w, h) in sizes.items()),
+        key=lambda item: (-item[2], -item[1], str(item[0])),
+    )
+    atlases = []
+    current = None
+    for key, w, h in items:
+        if w > max_size or h > max_size:
+            continue
+        if current is not None:
+            placements, shelf_x, shelf_y, shelf_h, used_w = current
+            if shelf_x + w > max_size:
+                shelf_x, shelf_y, shelf_h = 0, shelf_y + shelf_h, 0
+            if shelf_y + h > max_size:
+                atlases.append(current)
+                current = None
+        if current is None:
+            placements, shelf_x, shelf_y, shelf_h, used_w = {}, 0, 0, 0, 0
+        placements[key] = (shelf_x + ATLAS_PADDING, shelf_y + ATLAS_PADDING)
+        current = (placements, shelf_x + w, shelf_y, max(shelf_h, h), max(used_w, shelf_x + w))
+    if current is not None:
+        atlases.append(current)
+    
+    result = []
+    for placements, _, shelf_y, shelf_h, used_w in atlases:
+        width = 1 << max(used_w - 1, 1).bit_length()
+        height = 1 << max(shelf_y + shelf_h - 1, 1).bit_length()
+        result.append((width, height, placements))
+    return result
+
+def write_bmp(filepath, pixels):
+    """Writes a top-down (height, width, 3) uint8 RGB array as a 24-bit BMP."""
+    height, width, _ = pixels.shape
+    row_size = (width * 3 + 3) & ~3
+    rows = np.zeros((height, row_size), dtype=np.uint8)
+    rows[:, :width * 3] = pixels[::-1, :, ::-1].reshape(height, width * 3) # Bottom-up BGR
+    atomic_write(filepath, b"".join((
+        struct.pack("<2sIHHI", b"BM", 54 + rows.nbytes, 0, 0, 54),
+        struct.pack("<IiiHHIIiiII", 40, width, height, 1, 24, 0, rows.nbytes, 2835, 2835, 0, 0),
+        rows.tobytes(),
+    )))
+
+def image_pixels(image, alpha=False):
+    """Returns the image as a top-down (height, width, 3) uint8 array, (height, width, 4) with alpha."""
+    width, height = image.size
+    buffer = np.empty(width * height * image.channels, dtype=np.float32)
+    image.pixels.foreach_get(buffer)
+    pixels = buffer.reshape(height, width, image.channels)[::-1]
+    if image.channels < 3:
+        pixels = np.repeat(pixels[:, :, :1], 3, axis=2)
+    if alpha:
+        opacity = pixels[:, :, 3:4] if image.channels == 4 else np.ones((height, width, 1), dtype=np.float32)
+        pixels = np.concatenate([pixels[:, :, :3], opacity], axis=2)
+    else:
+        pixels = pixels[:, :, :3]
+    return (np.clip(pixels, 0.0, 1.0) * 255.0 + 0.5).astype(np.uint8)
+
+def atlas_face_groups(verts, groups, slot_ids, slot_rects):
+    """
+    Moves the UVs of atlased face groups into their atlas rectangle and merges the
+    groups sharing a material id. slot_rects maps a slot to (u0, v0, su, sv);
+    vertices of atlased faces are copied per rectangle, so vertices shared with
+    other groups keep their UVs. Returns (verts, groups keyed by material id).
+    """
+    new_verts = []
+    new_index = {}
+    merged = {}
+    for slot, faces in groups.items():
+        rect = slot_rects.get(slot)
+        out = merged.setdefault(slot_ids[slot], [])
+        for tri in faces:
+            new_tri = []
+            for v in tri:
+                key = (v, rect)
+                idx = new_index.get(key)
+                if idx is None:
+                    vert = verts[v]
+                    if rect is not None:
+                        u0, v0, su, sv = rect
+                        u, v_coord = vert['uv']
+                        vert = {**vert, 'uv': (
+                            u0 + min(max(u, 0.0), 1.0) * su,
+                            v0 + min(max(v_coord, 0.0), 1.0) * sv,
+                        )}
+                    idx = new_index[key] = len(new_verts)
+                    new_verts.append(vert)
+                new_tri.append(idx)
+            out.append(new_tri)
+    return new_verts, merged
+
+# --- TEXTURE PACKAGING ---
+# Game-ready copies of every texture a model references, written to its maps
+# folder. Conversion runs on plain arrays in the pool of create_worker_pool,
+# forked processes on Linux (median cut is mostly Python and holds the GIL);
+# Blender is only touched on the main thread to read pixels. A manifest in the
+# maps folder maps each output to the hash of its source so unchanged textures
+# are skipped.
+
+TEXTURE_MANIFEST = ".ls3d_textures.json"
+
+# Palette entries left for opaque colors, index 0 holds the color key
+KEYED_PALETTE_SIZE = 255
+
+def atomic_write(filepath, data):
+    """Writes data to a temporary file next to filepath and moves it into place."""
+    directory = os.path.dirname(os.path.abspath(filepath))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, filepath)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def bmp_bit_count(data):
+    """Bits per pixel of BMP file contents, 0 for anything else."""
+    if len(data) < 30 or data[:2] != b"BM":
+        return 0
+    return struct.unpack_from("<H", data, 28)[0]
+
+def write_bmp8(filepath, indices, palette):
+    """Writes a top-down (height, width) index array and a (n, 3) RGB palette as an 8-bit BMP."""
+    height, width = indices.shape
+    row_size = (width + 3) & ~3
+    rows = np.zeros((height, row_size), dtype=np.uint8)
+    rows[:, :width] = indices[::-1] # Bottom-up
+    table = np.zeros((256, 4), dtype=np.uint8)
+    table[:len(palette), :3] = palette[:, ::-1] # BGR0
+    offset = 54 + table.nbytes
+    atomic_write(filepath, b"".join((
+        struct.pack("<2sIHHI", b"BM", offset + rows.nbytes, 0, 0, offset),
+        struct.pack("<IiiHHIIiiII", 40, width, height, 1, 8, 0, rows.nbytes, 2835, 2835, 256, 0),
+        table.tobytes(),
+        rows.tobytes(),
+    )))
+
+def median_cut(colors, count):
+    """
+    Quantizes (n, 3) uint8 colors to at most count by splitting the color box
+    with the widest channel at its weighted median. Returns (palette, labels).
+    """
+    unique, inverse, weights = np.unique(colors, axis=0, return_inverse=True, return_counts=True)
+    inverse = inverse.reshape(-1)
+    if len(unique) <= count:
+        return unique, inverse
+    
+    def widest(box):
+        spans = unique[box].max(axis=0).astype(np.int64) - unique[box].min(axis=0)
+        return int(spans.max()), int(spans.argmax())
+    
+    boxes = [np.arange(len(unique))]
+    spans = [widest(boxes[0])]
+    while len(boxes) < count:
+        split = max(range(len(boxes)), key=lambda i: spans[i][0])
+        if spans[split][0] == 0:
+            break
+        box = boxes.pop(split)
+        _, axis = spans.pop(split)
+        box = box[np.argsort(unique[box, axis], kind="stable")]
+        cumulative = np.cumsum(weights[box])
+        cut = int(np.clip(np.searchsorted(cumulative, cumulative[-1] / 2.0), 1, len(box) - 1))
+        for half in (box[:cut], box[cut:]):
+            boxes.append(half)
+            spans.append(widest(half))
+    
+    palette = np.array([np.average(unique[box], axis=0, weights=weights[box]) for box in boxes])
+    labels = np.empty(len(unique), dtype=np.int64)
+    for i, box in enumerate(boxes):
+        labels[box] = i
+    return np.clip(np.rint(palette), 0, 255).astype(np.uint8), labels[inverse]
+
+def keyed_texture(pixels):
+    """
+    Palettizes a top-down (height, width, 4) RGBA array for color keying. Pixels
+    with alpha below half are keyed; without any, the color of the top left pixel
+    is the key. Returns (indices, palette) with the key at palette index 0.
+    """
+    rgb = pixels[:, :, :3].reshape(-1, 3)
+    keyed = pixels[:, :, 3].reshape(-1) < 128
+    if keyed.any():
+        colors, counts = np.unique(rgb[keyed], axis=0, return_counts=True)
+        key = colors[np.argmax(counts)]
+    else:
+        key = rgb[0]
+        keyed = (rgb == key).all(axis=1)
+    
+    palette, labels = median_cut(rgb[~keyed], KEYED_PALETTE_SIZE)
+    # An opaque entry equal to the key would turn transparent in game
+    clashes = (palette == key).all(axis=1)
+    palette[clashes, 2] ^= 1
+    indices = np.zeros(len(rgb), dtype=np.uint8)
+    indices[~keyed] = labels + 1
+    return indices.reshape(pixels.shape[:2]), np.vstack([key[None, :], palette])
+
+def convert_texture(job):
+    """
+    Worker side of texture packaging. job holds the "output" path, "keyed" and
+    either the source BMP "data" to copy or the RGBA "pixels" to convert.
+    """
+    if "data" in job:
+        atomic_write(job["output"], job["data"])
+    elif job["keyed"]:
+        write_bmp8(job["output"], *keyed_texture(job["pixels"]))
+    else:
+        write_bmp(job["output"], job["pixels"][:, :, :3])
+    return job["output"]
+
+def image_source_file(image):
+    """Path of the file an image was loaded from when it still matches, else None."""
+    if not image.filepath or image.packed_file or image.is_dirty:
+        return None
+    path = bpy.path.abspath(image.filepath, library=image.library)
+    return path if os.path.isfile(path) else None
+
+# --- STATIC BATCHING ---
+
+# File space swaps the Y and Z axes of Blender space
+SWAP_YZ = Matrix(((1, 0, 0, 0), (0, 0, 1, 0), (0, 1, 0, 0), (0, 0, 0, 1)))
+
+class StaticBatch:
+    """Static frames merged at export, written as one visual frame under their common parent."""
+    type = "BATCH"
+
+    def __init__(self, name, parent, members, render_flags, render_flags2, cull_flags):
+        self.name = name
+        self.parent = parent
+        self.members = members
+        self.render_flags = render_flags
+        self.render_flags2 = render_flags2
+        self.cull_flags = cull_flags
+        self.ls3d_user_props = ""
+
+# --- CULLING VOLUMES ---
+
+def is_sector(obj):
+    """Sectors are told apart by name, their portals are children named portal or plane."""
+    name = obj.name.lower()
+    return obj.type == "MESH" and "sector" in name and "portal" not in name
+
+def is_portal(obj):
+    name = obj.name.lower()
+    return obj.type == "MESH" and obj.parent is not None and is_sector(obj.parent) and ("portal" in name or "plane" in name)
+
+def mesh_positions(mesh, matrix=None):
+    """Vertex positions of mesh data as an (N, 3) array, transformed by matrix if given."""
+    positions = np.empty(len(mesh.vertices) * 3, dtype=np.float32)
+    mesh.vertices.foreach_get("co", positions)
+    positions = positions.reshape(-1, 3).astype(np.float64)
+    if matrix is not None:
+        positions = positions @ np.array(matrix.to_3x3()).T + np.array(matrix.translation)
+    return positions
+
+def bounding_box(points):
+    if len(points) == 0:
+        return np.zeros(3), np.zeros(3)
+    return points.min(axis=0), points.max(axis=0)
+
+def bounding_sphere(points):
+    """Sphere around the box centre reaching the farthest point. Returns (center, radius)."""
+    low, high = bounding_box(points)
+    center = (low + high) * 0.5
+    if len(points) == 0:
+        return center, 0.0
+    return center, float(np.sqrt(((points - center) ** 2).sum(axis=1).max()))
+
+def polygon_plane(points):
+    """
+    Plane of a polygon as (normal, d) with normal . p + d = 0, the normal following
+    the winding of the points (Newell's method, robust for slightly bent polygons).
+    """
+    if len(points) < 3:
+        return np.array([0.0, 0.0, 1.0]), 0.0
+    following = np.roll(points, -1, axis=0)
+    normal = np.array([
+        ((points[:, 1] - following[:, 1]) * (points[:, 2] + following[:, 2])).sum(),
+        ((points[:, 2] - following[:, 2]) * (points[:, 0] + following[:, 0])).sum(),
+        ((points[:, 0] - following[:, 0]) * (points[:, 1] + following[:, 1])).sum(),
+    ])
+    length = np.linalg.norm(normal)
+    if length < 1e-12:
+        return np.array([0.0, 0.0, 1.0]), 0.0
+    normal /= length
+    return normal, float(-normal.dot(points.mean(axis=0)))
+
 class The4DSExporter:
-    def __init__(self, filepath, objects):
+    def __init__(self, filepath, objects, profiler=None, optimize_cache=False, atlas_size=0,
+                 batch_cell_size=0.0, batch_exclude="", keep_bounds=False, package_textures=False, texture_workers=0):
         self.filepath = filepath
+        # Write the bbox_min/bbox_max stored on objects instead of computing them
+        self.keep_bounds = keep_bounds
+        self.profiler = profiler or Profiler(enabled=False)
+        self.optimize_cache = optimize_cache
+        # Transformed vertices of all written face groups: [before, after, triangles]
+        self.cache_stats = [0, 0, 0]
+        # Parts of the current mesh over the vertex limit, written as extra frames
+        self.pending_parts = []
+        # Largest atlas texture in pixels, 0 disables atlasing
+        self.atlas_size = atlas_size
+        # Material -> (u0, v0, su, sv) of its texture in the atlas
+        self.atlas_rects = {}
+        # [atlases written, LOD0 draw calls saved]
+        self.atlas_stats = [0, 0]
+        # Material -> 1-based index in the file
+        self.material_ids = {}
+        # LOD object -> extracted mesh of the atlas pre-pass
+        self.extracted = {}
+        # Cell edge in meters for merging static frames, 0 disables batching
+        self.batch_cell_size = batch_cell_size
+        self.batch_exclude = [p.strip().lower() for p in batch_exclude.replace(";", ",").split(",") if p.strip()]
+        # [frames merged, batch frames written]
+        self.batch_stats = [0, 0]
+        # Convert referenced textures into the maps folder after writing the model
+        self.package = package_textures
+        self.texture_workers = texture_workers if texture_workers > 0 else (os.cpu_count() or 1)
+        # Output name -> [image, color keyed]
+        self.texture_jobs = {}
+        # [converted, unchanged, failed]
+        self.texture_stats = [0, 0, 0]
         self.objects_to_export = objects
         self.materials = []
         self.objects = []
@@ -434,11 +1061,33 @@ class The4DSExporter:
         self.joint_map = {}
         self.frame_index = 1
         self.lod_map = {}
+    def batch_summary(self):
+        merged, batches = self.batch_stats
+        if not batches:
+            return None
+        return f"{merged} static frames merged into {batches}"
+    def texture_summary(self):
+        converted, unchanged, failed = self.texture_stats
+        if not self.texture_jobs:
+            return None
+        summary = f"{converted} textures converted, {unchanged} unchanged"
+        return summary + f", {failed} failed" if failed else summary
+    def atlas_summary(self):
+        atlases, saved = self.atlas_stats
+        if not atlases:
+            return None
+        return f"{atlases} atlas textures, {saved} draw calls saved"
+    def cache_summary(self):
+        before, after, triangles = self.cache_stats
+        if not triangles:
+            return None
+        return f"ACMR {before / triangles:.3f} -> {after / triangles:.3f} over {triangles} triangles"
     def write_string(self, f, string):
         encoded = string.encode("windows-1250")
         f.write(struct.pack("B", len(encoded)))
         if len(encoded) > 0:
             f.write(encoded)
+    @profiled("write header")
     def serialize_header(self, f):
         f.write(b"4DS\0")
         f.write(struct.pack("<H", self.version))
@@ -483,62 +1132,112 @@ class The4DSExporter:
     
     
                 
+    def bone_bind_matrices(self, armature):
+        """Bind pose of every bone in file space (Y/Z swapped), in armature bone order."""
+        return [bone.matrix_local @ SWAP_YZ for bone in armature.data.bones]
+    
+    def partition_skin(self, mesh, lod_obj, armature, base_names):
+        """
+        Reorders the vertices of an extracted LOD into one run per bone, locked
+        vertices before weighted ones, followed by the vertices only the root
+        moves, as the SINGLEMESH block expects. Every vertex goes to its dominant
+        bone with its normalized weight. Stores the skin block data in mesh["skin"].
+        """
+        bones = list(armature.data.bones)
+        bone_index = {bone.name: i for i, bone in enumerate(bones) if bone.name not in base_names}
+        group_bone = {vg.index: bone_index[vg.name] for vg in lod_obj.vertex_groups if vg.name in bone_index}
+        
+        num_source = len(lod_obj.data.vertices)
+        best_bone = np.full(num_source, -1, dtype=np.int64)
+        best_weight = np.zeros(num_source, dtype=np.float64)
+        total_weight = np.zeros(num_source, dtype=np.float64)
+        if group_bone:
+            for v in lod_obj.data.vertices:
+                for g in v.groups:
+                    bone_idx = group_bone.get(g.group)
+                    if bone_idx is None or g.weight <= 0.0:
+                        continue
+                    total_weight[v.index] += g.weight
+                    if g.weight > best_weight[v.index]:
+                        best_weight[v.index] = g.weight
+                        best_bone[v.index] = bone_idx
+        weight = np.divide(best_weight, total_weight, out=np.zeros_like(best_weight), where=total_weight > 0)
+        # Weights too small to matter leave the vertex to the root
+        best_bone[weight <= 0.001] = -1
+        
+        # Blender vertex of every written vertex, unknown ones point at a trailing root entry
+        num_verts = len(mesh["verts"])
+        sources = np.full(num_verts, num_source, dtype=np.int64)
+        unknown = 0
+        for v_index, indices in mesh["vert_map"].items():
+            if v_index >= num_source:
+                unknown += len(indices)
+                continue
+            sources[indices] = v_index
+        if unknown:
+            log.warning(f"{mesh['name']}: {unknown} vertices have no source vertex in '{lod_obj.name}', leaving them to the root")
+        vertex_bone = np.append(best_bone, -1)[sources]
+        vertex_weight = np.append(weight, 0.0)[sources]
+        locked = vertex_weight >= 0.999
+        
+        # Runs per bone (root last), locked before weighted, file order inside a run
+        bone_key = np.where(vertex_bone < 0, len(bones), vertex_bone)
+        order = np.lexsort((np.arange(num_verts), ~locked, bone_key))
+        remap = np.empty(num_verts, dtype=np.int64)
+        remap[order] = np.arange(num_verts)
+        remap_list = remap.tolist()
+        mesh["verts"] = [mesh["verts"][i] for i in order.tolist()]
+        mesh["groups"] = {key: [[remap_list[v] for v in tri] for tri in faces] for key, faces in mesh["groups"].items()}
+        mesh["vert_map"] = {v_index: [remap_list[i] for i in indices] for v_index, indices in mesh["vert_map"].items()}
+        
+        positions = np.array([v['pos'] for v in mesh["verts"]], dtype=np.float64).reshape(-1, 3)
+        vertex_bone = vertex_bone[order]
+        vertex_weight = vertex_weight[order]
+        locked = locked[order]
+        bounds = bounding_box(positions)
+        bone_blocks = []
+        for bone_idx, bind in enumerate(self.bone_bind_matrices(armature)):
+            in_bone = vertex_bone == bone_idx
+            if in_bone.any():
+                # Box in the space of the bone, where the runtime animates it
+                inverse = bind.inverted_safe()
+                local = positions[in_bone][:, [0, 2, 1]] @ np.array(inverse.to_3x3()).T + np.array(inverse.translation)
+                bone_bounds = bounding_box(local)
+            else:
+                bone_bounds = bounds
+            bone_blocks.append({
+                "num_locked": int((in_bone & locked).sum()),
+                "weights": vertex_weight[in_bone & ~locked].astype(np.float32),
+                "bounds": bone_bounds,
+            })
+        mesh["skin"] = {
+            "num_root": int((vertex_bone < 0).sum()),
+            "bounds": bounds,
+            "bones": bone_blocks,
+        }
+    
     def serialize_singlemesh(self, f, obj, num_lods):
         armature_mod = next((m for m in obj.modifiers if m.type == 'ARMATURE'), None)
         if not armature_mod or not armature_mod.object:
             return
         armature = armature_mod.object
-        bones = list(armature.data.bones)
-        total_verts = len(obj.data.vertices)
-        for _ in range(num_lods):
-            f.write(struct.pack("<B", len(bones)))
-            # Unweighted verts count (assigned to root)
-            weighted_verts = set()
-            for v in obj.data.vertices:
-                if any(g.weight > 0.0 for g in v.groups):
-                    weighted_verts.add(v.index)
-            unweighted_count = total_verts - len(weighted_verts)
-            f.write(struct.pack("<I", unweighted_count))
+        binds = self.bone_bind_matrices(armature)
+        for skin in self.current_skin[:num_lods]:
+            f.write(struct.pack("<B", len(binds)))
+            # Vertices only the root moves, stored last
+            f.write(struct.pack("<I", skin["num_root"]))
             # Mesh bounds
-            coords = [v.co for v in obj.data.vertices]
-            min_b = Vector((min(c[i] for c in coords) for i in range(3)))
-            max_b = Vector((max(c[i] for c in coords) for i in range(3)))
-            f.write(struct.pack("<3f", min_b.x, min_b.z, min_b.y))
-            f.write(struct.pack("<3f", max_b.x, max_b.z, max_b.y))
-            for bone_idx, bone in enumerate(bones):
-                # Inverse bind pose
-                mat = bone.matrix_local.copy()
-                # Y/Z swap for Mafia coord system
-                mat = mat @ Matrix([[1,0,0,0], [0,0,1,0], [0,1,0,0], [0,0,0,1]])
-                inv = mat.inverted()
-                # Row-major flatten
+            self.write_file_bounds(f, skin["bounds"])
+            for bone_idx, (bind, block) in enumerate(zip(binds, skin["bones"])):
+                # Inverse bind pose, row-major flatten
+                inv = bind.inverted()
                 flat = [inv[i][j] for i in range(4) for j in range(4)]
                 f.write(struct.pack("<16f", *flat))
-                vg = obj.vertex_groups.get(bone.name)
-                if not vg:
-                    f.write(struct.pack("<4I", 0, 0, bone_idx, 0))
-                    f.write(struct.pack("<6f", min_b.x, min_b.z, min_b.y, max_b.x, max_b.z, max_b.y))
-                    continue
-                locked = []
-                weighted = []
-                weights = []
-                for v_idx in range(total_verts):
-                    try:
-                        weight = vg.weight(v_idx)
-                    except RuntimeError:
-                        continue
-                    if weight >= 0.999:
-                        locked.append(v_idx)
-                    elif weight > 0.001:
-                        weighted.append(v_idx)
-                        weights.append(weight)
-                f.write(struct.pack("<I", len(locked)))
-                f.write(struct.pack("<I", len(weighted)))
+                f.write(struct.pack("<I", block["num_locked"]))
+                f.write(struct.pack("<I", len(block["weights"])))
                 f.write(struct.pack("<I", bone_idx))
-                f.write(struct.pack("<3f", min_b.x, min_b.z, min_b.y))
-                f.write(struct.pack("<3f", max_b.x, max_b.z, max_b.y))
-                for w in weights:
-                    f.write(struct.pack("<f", w))
+                self.write_file_bounds(f, block["bounds"])
+                f.write(block["weights"].astype("<f4").tobytes())
                     
     def serialize_morph(self, f, obj, num_lods):
         shape_keys = obj.data.shape_keys
@@ -589,11 +1288,42 @@ class The4DSExporter:
             f.write(struct.pack("<3f", max_bounds.x, max_bounds.z, max_bounds.y))
             f.write(struct.pack("<3f", center.x, center.z, center.y))
             f.write(struct.pack("<f", dist))
-    def serialize_dummy(self, f, obj):
-        min_bounds = obj.get("bbox_min", (0.0, 0.0, 0.0))
-        max_bounds = obj.get("bbox_max", (0.0, 0.0, 0.0))
+    def stored_bounds(self, obj):
+        """The bbox_min/bbox_max of obj when they are set, else None."""
+        min_bounds = obj.get("bbox_min")
+        max_bounds = obj.get("bbox_max")
+        if min_bounds is None or max_bounds is None or (not any(min_bounds) and not any(max_bounds)):
+            return None
+        return tuple(min_bounds), tuple(max_bounds)
+    def culling_bounds(self, obj, points):
+        """
+        Box of points, unless the stored bounds are kept. Without points the stored
+        bounds (e.g. from import) are used, None when there are none either.
+        """
+        stored = self.stored_bounds(obj)
+        if stored and self.keep_bounds or len(points) == 0:
+            return stored
+        return bounding_box(points)
+    def write_file_bounds(self, f, bounds):
+        """Writes a box already in file space."""
+        f.write(struct.pack("<3f", *bounds[0]))
+        f.write(struct.pack("<3f", *bounds[1]))
+    def write_bounds(self, f, bounds):
+        min_bounds, max_bounds = bounds
         f.write(struct.pack("<3f", min_bounds[0], min_bounds[2], min_bounds[1]))
         f.write(struct.pack("<3f", max_bounds[0], max_bounds[2], max_bounds[1]))
+    def serialize_dummy(self, f, obj):
+        # Box around the geometry below the dummy, in its space
+        inverse = obj.matrix_world.inverted_safe()
+        points = [
+            mesh_positions(child.data, inverse @ child.matrix_world)
+            for child in obj.children_recursive if child.type == "MESH"
+        ]
+        bounds = self.culling_bounds(obj, np.concatenate(points) if points else np.empty((0, 3)))
+        if bounds is None:
+            size = obj.empty_display_size
+            bounds = ((-size,) * 3, (size,) * 3)
+        self.write_bounds(f, bounds)
     def serialize_target(self, f, obj):
         f.write(struct.pack("<H", 0))
         link_ids = obj.get("link_ids", [])
@@ -624,17 +1354,41 @@ class The4DSExporter:
         bone_idx = list(armature.data.bones).index(bone)
         f.write(struct.pack("<I", bone_idx))
     
-    def serialize_material(self, f, mat, mat_index):
+    def material_opacity(self, mat):
+        if mat.use_nodes and mat.node_tree:
+            ls3d_node = next((n for n in mat.node_tree.nodes if n.type == 'GROUP' and n.node_tree and "LS3D Material Data" in n.node_tree.name), None)
+            if ls3d_node and "Opacity" in ls3d_node.inputs:
+                return ls3d_node.inputs["Opacity"].default_value / 100.0
+        return 1.0
+    def diffuse_image(self, mat):
+        if mat.use_nodes and mat.node_tree:
+            ls3d_node = next((n for n in mat.node_tree.nodes if n.type == 'GROUP' and n.node_tree and "LS3D Material Data" in n.node_tree.name), None)
+            if ls3d_node and "Diffuse Map" in ls3d_node.inputs and ls3d_node.inputs["Diffuse Map"].is_linked:
+                tex = self.find_texture_node(ls3d_node.inputs["Diffuse Map"].links[0].from_node)
+                if tex and tex.image:
+                    return tex.image
+        return None
+    def texture_name(self, image, keyed=False):
+        """Texture name written for image, queuing its conversion when packaging textures."""
+        # Baked color key images live in the cache, the model refers to their BMP
+        name = image.get("ls3d_source_name") or os.path.basename(image.filepath or image.name)
+        if not self.package:
+            return name
+        name = os.path.splitext(name)[0].upper() + ".BMP"
+        job = self.texture_jobs.setdefault(name, [image, False])
+        if job[0] != image:
+            log.warning(f"Images {job[0].name} and {image.name} both package to {name}, keeping the first")
+        # One file serves every material, keyed ones need the palette
+        job[1] = job[1] or keyed
+        return name
+    @profiled("write materials")
+    def serialize_material(self, f, mat, mat_index, diffuse_override=None):
         # 1. Colors & Opacity
         env_color = getattr(mat, "ls3d_ambient_color", (0.5, 0.5, 0.5))
         diffuse_color = getattr(mat, "ls3d_diffuse_color", (1.0, 1.0, 1.0))
         emission_color = getattr(mat, "ls3d_emission_color", (0.0, 0.0, 0.0))
         
-        opacity = 1.0
-        if mat.use_nodes and mat.node_tree:
-            ls3d_node = next((n for n in mat.node_tree.nodes if n.type == 'GROUP' and n.node_tree and "LS3D Material Data" in n.node_tree.name), None)
-            if ls3d_node and "Opacity" in ls3d_node.inputs:
-                opacity = ls3d_node.inputs["Opacity"].default_value / 100.0
+        opacity = self.material_opacity(mat)
 
         # 2. BUILD FLAGS (Using Constants)
         final_flags = 0
@@ -670,6 +1424,9 @@ class The4DSExporter:
 
         # Misc Byte
         if mat.ls3d_misc_unlit:       final_flags |= MTL_MISC_UNLIT
+        
+        # Atlas UVs never leave their rectangle
+        if diffuse_override:          final_flags |= MTL_DISABLE_U_TILING | MTL_DISABLE_V_TILING
 
         # 3. WRITE DATA
         f.write(struct.pack("<I", final_flags))
@@ -689,13 +1446,12 @@ class The4DSExporter:
              ls3d_node = next((n for n in nodes if n.type == 'GROUP' and n.node_tree and "LS3D Material Data" in n.node_tree.name), None)
              
              if ls3d_node:
-                 if "Diffuse Map" in ls3d_node.inputs and ls3d_node.inputs["Diffuse Map"].is_linked:
-                     tex = self.find_texture_node(ls3d_node.inputs["Diffuse Map"].links[0].from_node)
-                     if tex and tex.image: diffuse_tex = os.path.basename(tex.image.filepath or tex.image.name)
+                 image = self.diffuse_image(mat)
+                 if image: diffuse_tex = self.texture_name(image, keyed=mat.ls3d_alpha_colorkey)
                  
                  if mat.ls3d_alpha_enabled and "Alpha Map" in ls3d_node.inputs and ls3d_node.inputs["Alpha Map"].is_linked:
                      tex = self.find_texture_node(ls3d_node.inputs["Alpha Map"].links[0].from_node)
-                     if tex and tex.image: alpha_tex = os.path.basename(tex.image.filepath or tex.image.name)
+                     if tex and tex.image: alpha_tex = self.texture_name(tex.image)
                  
                  if mat.ls3d_env_enabled and "Reflection" in ls3d_node.inputs and ls3d_node.inputs["Reflection"].is_linked:
                      link_node = ls3d_node.inputs["Reflection"].links[0].from_node
@@ -703,12 +1459,14 @@ class The4DSExporter:
                          if "Intensity" in link_node.inputs: env_opacity = link_node.inputs["Intensity"].default_value
                          if link_node.inputs["Color"].is_linked:
                              tex = self.find_texture_node(link_node.inputs["Color"].links[0].from_node)
-                             if tex and tex.image: env_tex = os.path.basename(tex.image.filepath or tex.image.name)
+                             if tex and tex.image: env_tex = self.texture_name(tex.image)
                      else:
                          tex = self.find_texture_node(link_node)
                          if tex and tex.image: 
-                             env_tex = os.path.basename(tex.image.filepath or tex.image.name); env_opacity = 1.0
+                             env_tex = self.texture_name(tex.image); env_opacity = 1.0
 
+        if diffuse_override:
+            diffuse_tex = diffuse_override
         if mat.ls3d_env_enabled:
             f.write(struct.pack("<f", env_opacity))
             self.write_string(f, env_tex.upper())
@@ -723,98 +1481,82 @@ class The4DSExporter:
             f.write(struct.pack("<I", 0))
             f.write(struct.pack("<I", 0))
 
-    def serialize_object(self, f, obj, lods):
+    def serialize_object(self, f, obj, lods, skinned=False):
+        meshes = [self.extracted.pop(lod_obj, None) or self.extract_lod(lod_obj) for lod_obj in lods]
+        self.current_skin = []
+        if skinned:
+            armature = next(m.object for m in obj.modifiers if m.type == 'ARMATURE' and m.object)
+            # The importer creates a base bone named after the mesh for the vertices only the root moves
+            base_names = {obj.name}
+            with self.profiler.phase("skin partition"):
+                for mesh, lod_obj in zip(meshes, lods):
+                    self.partition_skin(mesh, lod_obj, armature, base_names)
+            self.current_skin = [mesh["skin"] for mesh in meshes]
+        return self.serialize_meshes(f, obj.name, meshes)
+    
+    def serialize_meshes(self, f, name, meshes):
+        keep_order = any(not mesh["renumber"] for mesh in meshes)
+        oversized = [i for i, mesh in enumerate(meshes) if len(mesh["verts"]) > MAX_OBJECT_VERTICES]
+        self.pending_parts = []
+        if oversized:
+            lod_idx = oversized[0]
+            if keep_order:
+                raise ValueError(
+                    f"{name}: LOD {lod_idx} has {len(meshes[lod_idx]['verts'])} vertices, skinned and morphed "
+                    f"meshes can't be split above {MAX_OBJECT_VERTICES}"
+                )
+            with self.profiler.phase("split meshes"):
+                parts = split_lod_meshes(meshes)
+            log.info(f"{name}: {len(meshes[lod_idx]['verts'])} vertices in LOD {lod_idx}, split into {len(parts)} frames")
+            meshes = parts[0]
+            self.pending_parts = parts[1:]
+        self.write_object(f, meshes)
+        return len(meshes)
+    
+    def write_object(self, f, meshes):
         f.write(struct.pack("<H", 0))
-        f.write(struct.pack("<B", len(lods)))
+        f.write(struct.pack("<B", len(meshes)))
         
         # Initialize storage to prevent crash
         self.current_lod_mappings = [] 
         self.current_lod_counts = []
-        
-        # Helper: Quantization for vertex deduplication (5 decimals)
-        def quant(val):
-            if abs(val) < 0.00001: val = 0.0
-            return int(val * 100000.0)
-
-        for lod_idx, lod_obj in enumerate(lods):
+        for lod_idx, mesh in enumerate(meshes):
             # --- 1. HANDLE FADE DISTANCE ---
             # STRICTLY READ FROM UI: No auto-correction, no forcing LOD0 to 0.
             # We trust the user has set the correct value in the panel.
-            dist = getattr(lod_obj, "ls3d_lod_dist", 0.0)
-            
-            f.write(struct.pack("<f", float(dist)))
-            
-            # --- 2. MESH PROCESSING ---
-            try:
-                # Blender 5.0 safe evaluation
-                depsgraph = bpy.context.evaluated_depsgraph_get()
-                eval_obj = lod_obj.evaluated_get(depsgraph)
-                temp_mesh = eval_obj.to_mesh()
-            except:
-                temp_mesh = lod_obj.data.copy()
-
-            # Triangulate
-            bm = bmesh.new()
-            bm.from_mesh(temp_mesh)
-            bmesh.ops.triangulate(bm, faces=bm.faces, quad_method='BEAUTY', ngon_method='BEAUTY')
-            bm.to_mesh(temp_mesh)
-            bm.free()
-            
-            # Access Data Layers
-            uv_layer = temp_mesh.uv_layers.active.data if temp_mesh.uv_layers.active else None
-            unique_verts = {}
-            final_verts = []
-            mat_groups = {}
-            vert_map = {} 
-            
-            # Ensure normals are ready
-            try: temp_mesh.calc_normals_split()
-            except: pass
-            
-            for poly in temp_mesh.polygons:
-                f_indices = []
-                for loop_index in poly.loop_indices:
-                    loop = temp_mesh.loops[loop_index]
-                    v_index = loop.vertex_index
-                    v_co = temp_mesh.vertices[v_index].co
-                    
-                    u, v_coord = (0.0, 0.0)
-                    if uv_layer:
-                        d = uv_layer[loop_index].uv
-                        u, v_coord = d[0], 1.0 - d[1]
-                    
-                    norm = loop.normal
-                    
-                    # Deduplication Key
-                    key = (
-                        quant(v_co.x), quant(v_co.y), quant(v_co.z),
-                        quant(norm.x), quant(norm.y), quant(norm.z),
-                        quant(u), quant(v_coord)
-                    )
-                    
-                    if key in unique_verts:
-                        idx = unique_verts[key]
-                    else:
-                        idx = len(final_verts)
-                        unique_verts[key] = idx
-                        final_verts.append({
-                            'pos': (v_co.x, v_co.z, v_co.y),
-                            'norm': (norm.x, norm.z, norm.y),
-                            'uv': (u, v_coord)
-                        })
-                    
-                    # Map for skinning
-                    if v_index not in vert_map: vert_map[v_index] = []
-                    if idx not in vert_map[v_index]: vert_map[v_index].append(idx)
-                    
-                    f_indices.append(idx)
-                
-                mat_groups.setdefault(poly.material_index, []).append(f_indices)
+            f.write(struct.pack("<f", float(mesh["dist"])))
+            final_verts = mesh["verts"]
+            mat_groups = mesh["groups"]
+            vert_map = mesh["vert_map"]
+            # 1-based material index in the file, 0 without material
+            slot_ids = {slot: self.material_ids.get(mesh["materials"].get(slot), 0) for slot in mat_groups}
+            if self.atlas_rects and mesh["renumber"]:
+                slot_rects = {slot: self.atlas_rects.get(mesh["materials"].get(slot)) for slot in mat_groups}
+                num_groups = len(mat_groups)
+                final_verts, mat_groups = atlas_face_groups(final_verts, mat_groups, slot_ids, slot_rects)
+                slot_ids = {mat_id: mat_id for mat_id in mat_groups}
+                vert_map = {}
+                if lod_idx == 0:
+                    self.atlas_stats[1] += num_groups - len(mat_groups)
+                if len(final_verts) > MAX_OBJECT_VERTICES:
+                    raise ValueError(f"{mesh['name']}: {len(final_verts)} vertices after atlasing, export without the atlas")
             
-            lod_obj.to_mesh_clear()
+            if self.optimize_cache:
+                with self.profiler.phase("vertex cache"):
+                    # Skinned and morphed meshes only get their triangles reordered, their vertex order is fixed by the skin partition and the morph block
+                    final_verts, mat_groups, remap, before, after = optimize_vertex_cache(final_verts, mat_groups, mesh["renumber"])
+                    vert_map = {v_index: [remap[idx] for idx in indices] for v_index, indices in vert_map.items()}
+                num_triangles = sum(len(faces) for faces in mat_groups.values())
+                if num_triangles:
+                    log.debug(f"{mesh['name']}: ACMR {before / num_triangles:.3f} -> {after / num_triangles:.3f}")
+                self.cache_stats[0] += before
+                self.cache_stats[1] += after
+                self.cache_stats[2] += num_triangles
             
             self.current_lod_mappings.append(vert_map)
             self.current_lod_counts.append(len(final_verts))
+            self.profiler.count("vertices", len(final_verts))
+            self.profiler.count("triangles", sum(len(faces) for faces in mat_groups.values()))
 
             # --- 3. WRITE DATA ---
             f.write(struct.pack("<H", len(final_verts)))
@@ -823,22 +1565,116 @@ class The4DSExporter:
                 f.write(struct.pack("<3f", *v['norm']))
                 f.write(struct.pack("<2f", *v['uv']))
             
-            f.write(struct.pack("<B", len(mat_groups)))
-            for mat_idx, faces in mat_groups.items():
+            # Face groups count their triangles in 16 bits too, longer ones continue in another group
+            chunks = [
+                (mat_idx, faces[i:i + MAX_OBJECT_VERTICES])
+                for mat_idx, faces in mat_groups.items()
+                for i in range(0, len(faces), MAX_OBJECT_VERTICES)
+            ]
+            f.write(struct.pack("<B", len(chunks)))
+            for mat_idx, faces in chunks:
                 f.write(struct.pack("<H", len(faces)))
                 for tri in faces:
                     if len(tri) == 3:
                         f.write(struct.pack("<3H", tri[0], tri[2], tri[1]))
+                f.write(struct.pack("<H", slot_ids[mat_idx]))
+    
+    def extract_lod(self, lod_obj):
+        """Triangulates and de-duplicates one LOD object into the vertex and face group lists written to the file."""
+        dist = getattr(lod_obj, "ls3d_lod_dist", 0.0)
+        
+        # Helper: Quantization for vertex deduplication (5 decimals)
+        def quant(val):
+            if abs(val) < 0.00001: val = 0.0
+            return int(val * 100000.0)
+        
+        # --- 2. MESH PROCESSING ---
+        extract_start = time.perf_counter()
+        try:
+            # Blender 5.0 safe evaluation
+            depsgraph = bpy.context.evaluated_depsgraph_get()
+            eval_obj = lod_obj.evaluated_get(depsgraph)
+            temp_mesh = eval_obj.to_mesh()
+        except:
+            temp_mesh = lod_obj.data.copy()
+
+        # Triangulate
+        bm = bmesh.new()
+        bm.from_mesh(temp_mesh)
+        bmesh.ops.triangulate(bm, faces=bm.faces, quad_method='BEAUTY', ngon_method='BEAUTY')
+        bm.to_mesh(temp_mesh)
+        bm.free()
+        
+        # Access Data Layers
+        uv_layer = temp_mesh.uv_layers.active.data if temp_mesh.uv_layers.active else None
+        unique_verts = {}
+        final_verts = []
+        mat_groups = {}
+        vert_map = {} 
+        
+        # Ensure normals are ready
+        try: temp_mesh.calc_normals_split()
+        except: pass
+        
+        for poly in temp_mesh.polygons:
+            f_indices = []
+            for loop_index in poly.loop_indices:
+                loop = temp_mesh.loops[loop_index]
+                v_index = loop.vertex_index
+                v_co = temp_mesh.vertices[v_index].co
+                
+                u, v_coord = (0.0, 0.0)
+                if uv_layer:
+                    d = uv_layer[loop_index].uv
+                    u, v_coord = d[0], 1.0 - d[1]
                 
-                mat_id = 0
-                if mat_idx < len(lod_obj.material_slots):
-                    real_mat = lod_obj.material_slots[mat_idx].material
-                    if real_mat in self.materials:
-                        mat_id = self.materials.index(real_mat) + 1
-                f.write(struct.pack("<H", mat_id))
+                norm = loop.normal
+                
+                # Deduplication Key
+                key = (
+                    quant(v_co.x), quant(v_co.y), quant(v_co.z),
+                    quant(norm.x), quant(norm.y), quant(norm.z),
+                    quant(u), quant(v_coord)
+                )
+                
+                if key in unique_verts:
+                    idx = unique_verts[key]
+                else:
+                    idx = len(final_verts)
+                    unique_verts[key] = idx
+                    final_verts.append({
+                        'pos': (v_co.x, v_co.z, v_co.y),
+                        'norm': (norm.x, norm.z, norm.y),
+                        'uv': (u, v_coord)
+                    })
+                
+                # Map for skinning
+                if v_index not in vert_map: vert_map[v_index] = []
+                if idx not in vert_map[v_index]: vert_map[v_index].append(idx)
+                
+                f_indices.append(idx)
             
-        return len(lods)
+            mat_groups.setdefault(poly.material_index, []).append(f_indices)
+        
+        lod_obj.to_mesh_clear()
+        self.profiler.add("extract geometry", time.perf_counter() - extract_start)
+        
+        # Material slot -> material, resolved to the file index when writing
+        materials = {}
+        for mat_idx in mat_groups:
+            if mat_idx < len(lod_obj.material_slots):
+                materials[mat_idx] = lod_obj.material_slots[mat_idx].material
+        return {
+            "name": lod_obj.name,
+            "dist": dist,
+            "verts": final_verts,
+            "groups": mat_groups,
+            "materials": materials,
+            "vert_map": vert_map,
+            "renumber": not (lod_obj.data.shape_keys or any(m.type == 'ARMATURE' for m in lod_obj.modifiers)),
+        }
     
+    @profiled("write frames")
     def serialize_frame(self, f, obj):
         frame_type = FRAME_VISUAL
         visual_type = VISUAL_OBJECT
@@ -848,18 +1684,14 @@ class The4DSExporter:
         visual_flags = (r_flag1, r_flag2)
         
         if obj.type == "MESH":
-            if hasattr(obj, "visual_type"):
+            # visual_type is registered on every object, so the frame types have to be checked first
+            if is_sector(obj): frame_type = FRAME_SECTOR
+            elif obj.display_type == "WIRE": frame_type = FRAME_OCCLUDER
+            else:
                 visual_type = int(obj.visual_type)
                 if visual_type in (VISUAL_SINGLEMESH, VISUAL_SINGLEMORPH):
                     has_arm = any(m.type == 'ARMATURE' and m.object for m in obj.modifiers)
                     if not has_arm: visual_type = VISUAL_OBJECT
-            else:
-                if obj.modifiers and any(mod.type == "ARMATURE" for mod in obj.modifiers):
-                    visual_type = VISUAL_SINGLEMORPH if obj.data.shape_keys else VISUAL_SINGLEMESH
-                elif "portal" in obj.name.lower(): pass 
-                elif "sector" in obj.name.lower(): frame_type = FRAME_SECTOR
-                elif obj.display_type == "WIRE": frame_type = FRAME_OCCLUDER
-                elif obj.data.shape_keys: visual_type = VISUAL_MORPH
         
         elif obj.type == "EMPTY":
             if obj.empty_display_type == "CUBE": frame_type = FRAME_DUMMY
@@ -904,7 +1736,7 @@ class The4DSExporter:
         
         if frame_type == FRAME_VISUAL:
             lods = self.lod_map.get(obj, [obj])
-            num = self.serialize_object(f, obj, lods)
+            num = self.serialize_object(f, obj, lods, skinned=visual_type in (VISUAL_SINGLEMESH, VISUAL_SINGLEMORPH))
             
             if visual_type == VISUAL_BILLBOARD:
                 self.serialize_billboard(f, obj)
@@ -917,6 +1749,8 @@ class The4DSExporter:
                 self.serialize_morph(f, obj, num)
             elif visual_type == VISUAL_MORPH:
                 self.serialize_morph(f, obj, num)
+            if self.pending_parts:
+                self.serialize_parts(f, obj, visual_type, visual_flags)
 
         elif frame_type == FRAME_SECTOR:
             self.serialize_sector(f, obj)
@@ -927,6 +1761,28 @@ class The4DSExporter:
         elif frame_type == FRAME_OCCLUDER:
             self.serialize_occluder(f, obj)
 
+    def serialize_parts(self, f, obj, visual_type, visual_flags):
+        """Writes the parts split off an oversized mesh as child frames with an identity transform."""
+        if visual_type not in (VISUAL_OBJECT, VISUAL_LITOBJECT, VISUAL_BILLBOARD):
+            raise ValueError(f"{obj.name}: meshes of visual type {visual_type} can't be split above {MAX_OBJECT_VERTICES} vertices")
+        parent_id = self.frames_map[obj]
+        parts, self.pending_parts = self.pending_parts, []
+        for part_idx, meshes in enumerate(parts, 1):
+            self.frame_index += 1
+            f.write(struct.pack("<B", FRAME_VISUAL))
+            f.write(struct.pack("<B", visual_type))
+            f.write(struct.pack("<2B", *visual_flags))
+            f.write(struct.pack("<H", parent_id))
+            f.write(struct.pack("<3f", 0.0, 0.0, 0.0))
+            f.write(struct.pack("<3f", 1.0, 1.0, 1.0))
+            f.write(struct.pack("<4f", 1.0, 0.0, 0.0, 0.0))
+            f.write(struct.pack("<B", getattr(obj, "cull_flags", 128)))
+            self.write_string(f, f"{obj.name}_part{part_idx}")
+            self.write_string(f, getattr(obj, "ls3d_user_props", ""))
+            self.write_object(f, meshes)
+            if visual_type == VISUAL_BILLBOARD:
+                self.serialize_billboard(f, obj)
+
     def serialize_billboard(self, f, obj):
         # Enum is '0','1','2' string. File needs 1-based index integer.
         # X=0(1), Z=1(2), Y=2(3)
@@ -937,14 +1793,18 @@ class The4DSExporter:
 
     def serialize_mirror(self, f, obj):
         # Bounds
-        min_b = getattr(obj, "bbox_min", (-1,-1,-1))
-        max_b = getattr(obj, "bbox_max", (1,1,1))
-        f.write(struct.pack("<3f", min_b[0], min_b[2], min_b[1]))
-        f.write(struct.pack("<3f", max_b[0], max_b[2], max_b[1]))
+        points = mesh_positions(obj.data)
+        bounds = self.culling_bounds(obj, points) or ((-1.0,) * 3, (1.0,) * 3)
+        self.write_bounds(f, bounds)
         
         # Center/Radius
-        f.write(struct.pack("<3f", 0,0,0)) 
-        f.write(struct.pack("<f", 10.0))
+        if len(points):
+            center, radius = bounding_sphere(points)
+        else:
+            low, high = np.asarray(bounds[0]), np.asarray(bounds[1])
+            center, radius = (low + high) * 0.5, float(np.linalg.norm(high - low)) * 0.5
+        f.write(struct.pack("<3f", center[0], center[2], center[1]))
+        f.write(struct.pack("<f", radius))
         
         # Matrix (Identity)
         m = [1,0,0,0, 0,1,0,0, 0,0,1,0, 0,0,0,1]
@@ -990,42 +1850,39 @@ class The4DSExporter:
             f.write(struct.pack("<3H", face.verts[0].index, face.verts[2].index, face.verts[1].index))
             
         # Bounds
-        min_b = getattr(obj, "bbox_min", (0,0,0))
-        max_b = getattr(obj, "bbox_max", (0,0,0))
-        f.write(struct.pack("<3f", min_b[0], min_b[2], min_b[1]))
-        f.write(struct.pack("<3f", max_b[0], max_b[2], max_b[1]))
+        self.write_bounds(f, self.culling_bounds(obj, mesh_positions(mesh)) or ((0.0,) * 3, (0.0,) * 3))
         
         # Portals
-        portals = [c for c in obj.children if "portal" in c.name.lower() or "plane" in c.name.lower()]
+        portals = [c for c in obj.children if is_portal(c)]
         f.write(struct.pack("<B", len(portals)))
         
         for p_obj in portals:
-            self.serialize_portal(f, p_obj)
+            self.serialize_portal(f, p_obj, obj)
         
         bm.free()
 
-    def serialize_portal(self, f, obj):
-        mesh = obj.data
-        bm = bmesh.new()
-        bm.from_mesh(mesh)
+    def serialize_portal(self, f, obj, sector):
+        # Vertices in sector space, in the winding of the portal polygon
+        points = mesh_positions(obj.data, sector.matrix_world.inverted_safe() @ obj.matrix_world)
+        if len(obj.data.polygons) == 1:
+            points = points[list(obj.data.polygons[0].vertices)]
         
-        f.write(struct.pack("<B", len(bm.verts)))
+        f.write(struct.pack("<B", len(points)))
         
         # Flags, Near, Far
         f.write(struct.pack("<I", getattr(obj, "ls3d_portal_flags", 4)))
         f.write(struct.pack("<f", getattr(obj, "ls3d_portal_near", 0.0)))
         f.write(struct.pack("<f", getattr(obj, "ls3d_portal_far", 100.0)))
         
-        # Normal
-        norm = obj.matrix_world.to_quaternion() @ Vector((0,0,1))
-        f.write(struct.pack("<3f", norm.x, norm.z, norm.y))
-        f.write(struct.pack("<f", 0.0)) # Dot
+        # Plane: normal . p + dot = 0
+        normal, dot = polygon_plane(points)
+        f.write(struct.pack("<3f", normal[0], normal[2], normal[1]))
+        f.write(struct.pack("<f", dot))
         
-        for v in bm.verts:
-            f.write(struct.pack("<3f", v.co.x, v.co.z, v.co.y))
-            
-        bm.free()
+        for p in points:
+            f.write(struct.pack("<3f", p[0], p[2], p[1]))
     
+    @profiled("write joints")
     def serialize_joints(self, f, armature):
         # We don't write the Armature Object itself as a frame, 
         # but we need to pass its hierarchy context.
@@ -1072,6 +1929,223 @@ class The4DSExporter:
             # Joint Body
             self.serialize_joint(f, bone, armature, parent_id)
             
+    def batchable(self, obj):
+        """Plain static visual frames without LODs, children, or names scripts could look up."""
+        if obj.type != "MESH" or int(obj.visual_type) != VISUAL_OBJECT:
+            return False
+        name = obj.name.lower()
+        if is_sector(obj) or "portal" in name or obj.display_type == "WIRE":
+            return False
+        if obj.ls3d_user_props or any(fnmatch.fnmatchcase(name, p) for p in self.batch_exclude):
+            return False
+        if obj.parent and obj.parent_type != 'OBJECT':
+            return False
+        if obj.data.shape_keys or any(m.type == 'ARMATURE' for m in obj.modifiers):
+            return False
+        return len(self.lod_map.get(obj, [obj])) == 1 and not any(c in self.frame_set for c in obj.children)
+    
+    @profiled("static batching")
+    def collect_static_batches(self):
+        """
+        Replaces groups of batchable frames sharing parent, render and cull flags
+        and spatial cell by StaticBatch entries at the position of their first
+        member in self.objects.
+        """
+        self.frame_set = set(self.objects)
+        groups = defaultdict(list)
+        for obj in self.objects:
+            if not self.batchable(obj):
+                continue
+            corners = [obj.matrix_world @ Vector(corner) for corner in obj.bound_box]
+            center = sum(corners, Vector()) / 8.0
+            cell = tuple(int(math.floor(c / self.batch_cell_size)) for c in center)
+            parent = obj.parent if obj.parent in self.frame_set else None
+            groups[(parent, obj.render_flags, obj.render_flags2, obj.cull_flags, cell)].append(obj)
+        
+        replaced = {}
+        for (parent, render_flags, render_flags2, cull_flags, _), members in groups.items():
+            if len(members) < 2:
+                continue
+            batch = StaticBatch(f"static_batch{self.batch_stats[1]}", parent, members, render_flags, render_flags2, cull_flags)
+            replaced[members[0]] = batch
+            for obj in members[1:]:
+                replaced[obj] = None
+            self.batch_stats[0] += len(members)
+            self.batch_stats[1] += 1
+        self.objects = [replaced.get(obj, obj) for obj in self.objects if replaced.get(obj, obj) is not None]
+    
+    def merge_batch(self, batch):
+        """Merges the LOD0 meshes of the batch members in the space of the batch parent, grouped by material."""
+        parent_inverse = batch.parent.matrix_world.inverted() if batch.parent else Matrix.Identity(4)
+        verts = []
+        groups = {}
+        materials = {}
+        keys = {}
+        for obj in batch.members:
+            mesh = self.extracted.pop(obj, None) or self.extract_lod(obj)
+            matrix = SWAP_YZ @ parent_inverse @ obj.matrix_world @ SWAP_YZ
+            rotation = np.array(matrix.to_3x3(), dtype=np.float64)
+            normal_matrix = np.array(matrix.to_3x3().inverted_safe().transposed(), dtype=np.float64)
+            positions = np.array([v['pos'] for v in mesh["verts"]], dtype=np.float64).reshape(-1, 3)
+            normals = np.array([v['norm'] for v in mesh["verts"]], dtype=np.float64).reshape(-1, 3)
+            positions = positions @ rotation.T + np.array(matrix.translation)
+            normals = normals @ normal_matrix.T
+            normals /= np.maximum(np.linalg.norm(normals, axis=1, keepdims=True), 1e-12)
+            # Mirroring transforms turn the faces inside out
+            flip = matrix.determinant() < 0
+            
+            offset = len(verts)
+            for v, pos, norm in zip(mesh["verts"], positions.tolist(), normals.tolist()):
+                verts.append({'pos': tuple(pos), 'norm': tuple(norm), 'uv': v['uv']})
+            for slot, faces in mesh["groups"].items():
+                mat = mesh["materials"].get(slot)
+                key = keys.setdefault(mat, len(keys))
+                materials[key] = mat
+                out = groups.setdefault(key, [])
+                for tri in faces:
+                    tri = [offset + v for v in tri]
+                    out.append([tri[0], tri[2], tri[1]] if flip else tri)
+        return {
+            "name": batch.name,
+            "dist": min(getattr(obj, "ls3d_lod_dist", 0.0) for obj in batch.members),
+            "verts": verts,
+            "groups": groups,
+            "materials": materials,
+            "vert_map": {},
+            "renumber": True,
+        }
+    
+    @profiled("write frames")
+    def serialize_batch(self, f, batch):
+        parent_id = self.frames_map.get(batch.parent, 0) if batch.parent else 0
+        self.frames_map[batch] = self.frame_index
+        self.frame_index += 1
+        visual_flags = (batch.render_flags, batch.render_flags2)
+        f.write(struct.pack("<B", FRAME_VISUAL))
+        f.write(struct.pack("<B", VISUAL_OBJECT))
+        f.write(struct.pack("<2B", *visual_flags))
+        f.write(struct.pack("<H", parent_id))
+        f.write(struct.pack("<3f", 0.0, 0.0, 0.0))
+        f.write(struct.pack("<3f", 1.0, 1.0, 1.0))
+        f.write(struct.pack("<4f", 1.0, 0.0, 0.0, 0.0))
+        f.write(struct.pack("<B", batch.cull_flags))
+        self.write_string(f, batch.name)
+        self.write_string(f, batch.ls3d_user_props)
+        self.serialize_meshes(f, batch.name, [self.merge_batch(batch)])
+        if self.pending_parts:
+            self.serialize_parts(f, batch, VISUAL_OBJECT, visual_flags)
+    
+    def maps_directory(self, create=False):
+        """
+        The game's maps folder next to the models folder or the model if there is
+        one. Otherwise a new maps folder next to the model with create, else the
+        export folder.
+        """
+        model_dir = os.path.dirname(os.path.abspath(self.filepath))
+        for base in (os.path.dirname(model_dir), model_dir):
+            try:
+                for name in os.listdir(base):
+                    if name.lower() == "maps" and os.path.isdir(os.path.join(base, name)):
+                        return os.path.join(base, name)
+            except OSError:
+                pass
+        if create:
+            directory = os.path.join(model_dir, "maps")
+            os.makedirs(directory, exist_ok=True)
+            return directory
+        return model_dir
+    
+    def atlas_candidate(self, mat):
+        """Returns the diffuse image of a material that can move into an atlas, None otherwise."""
+        if not mat.ls3d_diff_enabled or mat.ls3d_diff_anim or mat.ls3d_disable_tex:
+            return None
+        # Color keys, alpha and environment maps need their own texture
+        if mat.ls3d_alpha_colorkey or mat.ls3d_alpha_enabled or mat.ls3d_alpha_imgalpha or mat.ls3d_alpha_anim:
+            return None
+        if mat.ls3d_env_enabled:
+            return None
+        image = self.diffuse_image(mat)
+        if image is None or image.size[0] == 0 or image.size[1] == 0:
+            return None
+        return image
+    
+    @profiled("texture atlas")
+    def build_atlases(self):
+        """
+        Packs the diffuse textures of materials that only differ in that texture
+        into atlas BMPs. Materials qualify when every UV of their faces stays
+        within 0-1 (or tiling is off on that axis). Replaces the packed materials
+        in self.materials by one per atlas and returns {index: atlas texture name}.
+        """
+        # Extract every LOD once, serialize_object reuses the meshes
+        uses = defaultdict(list)
+        blocked = set()
+        for obj in self.objects:
+            if obj.type == "BATCH":
+                lod_objects = obj.members
+            elif obj.type == "MESH":
+                lod_objects = self.lod_map.get(obj, [obj])
+            else:
+                continue
+            for lod_obj in lod_objects:
+                mesh = self.extracted[lod_obj] = self.extract_lod(lod_obj)
+                for slot, mat in mesh["materials"].items():
+                    if mat is None:
+                        continue
+                    if mesh["renumber"]:
+                        uses[mat].append((mesh, slot))
+                    else:
+                        # Skinned and morphed meshes keep their vertex order
+                        blocked.add(mat)
+        
+        groups = defaultdict(list)
+        for mat in self.materials:
+            image = self.atlas_candidate(mat) if mat in uses and mat not in blocked else None
+            if image is None:
+                continue
+            uvs = [mesh["verts"][v]['uv'] for mesh, slot in uses[mat] for tri in mesh["groups"][slot] for v in tri]
+            uvs = np.array(uvs, dtype=np.float32).reshape(-1, 2)
+            inside = ((uvs >= -ATLAS_UV_EPSILON) & (uvs <= 1.0 + ATLAS_UV_EPSILON)).all(axis=0)
+            if not ((inside[0] or not mat.ls3d_misc_tile_u) and (inside[1] or not mat.ls3d_misc_tile_v)):
+                continue
+            key = tuple(tuple(value) if hasattr(value, "__len__") else value
+                        for value in (getattr(mat, prop) for prop in ATLAS_KEY_PROPS))
+            groups[key + (round(self.material_opacity(mat), 4),)].append((mat, image))
+        
+        directory = self.maps_directory()
+        stem = os.path.splitext(os.path.basename(self.filepath))[0]
+        packed = {}
+        templates = []
+        for members in groups.values():
+            if len(members) < 2:
+                continue
+            images = dict(members)
+            for width, height, placements in pack_atlas({mat: tuple(image.size) for mat, image in members}, self.atlas_size):
+                if len(placements) < 2:
+                    continue
+                pixels = np.zeros((height, width, 3), dtype=np.uint8)
+                for mat, (x, y) in placements.items():
+                    image = images[mat]
+                    w, h = image.size
+                    padded = np.pad(image_pixels(image), ((ATLAS_PADDING,) * 2, (ATLAS_PADDING,) * 2, (0, 0)), mode="edge")
+                    pixels[y - ATLAS_PADDING:y + h + ATLAS_PADDING, x - ATLAS_PADDING:x + w + ATLAS_PADDING] = padded
+                    self.atlas_rects[mat] = (x / width, y / height, w / width, h / height)
+                    packed[mat] = len(templates)
+                name = f"{stem}_atlas{len(templates)}.bmp"
+                write_bmp(os.path.join(directory, name), pixels)
+                log.info(f"Packed {len(placements)} textures into {name} ({width}x{height})")
+                templates.append((next(iter(placements)), name))
+        
+        self.materials = [mat for mat in self.materials if mat not in packed]
+        overrides = {}
+        for atlas_idx, (template, name) in enumerate(templates):
+            overrides[len(self.materials)] = name
+            self.materials.append(template)
+        first_atlas = len(self.materials) - len(templates)
+        self.material_ids.update((mat, first_atlas + atlas_idx + 1) for mat, atlas_idx in packed.items())
+        self.atlas_stats[0] = len(templates)
+        return overrides
+    
     def collect_lods(self):
         self.lod_map = {}
         all_lod_objects = set()
@@ -1100,65 +2174,181 @@ class The4DSExporter:
         return all_lod_objects
     
     def serialize_file(self):
-        with open(self.filepath, "wb") as f:
-            self.serialize_header(f)
-            
-            self.materials = self.collect_materials()
-            f.write(struct.pack("<H", len(self.materials)))
-            for i, mat in enumerate(self.materials):
-                self.serialize_material(f, mat, i + 1)
-            
-            lod_objects_set = self.collect_lods()
-            
-            # SAFE CHECK: Use object names to check existence in scene
-            scene_names = set(o.name for o in bpy.context.scene.objects)
-            
-            raw_objects = [
-                obj for obj in self.objects_to_export
-                if obj.name in scene_names 
-                and obj not in lod_objects_set
-                and obj.type in ("MESH", "EMPTY", "ARMATURE")
-            ]
-            
-            # HIERARCHY SORT
-            self.objects = []
-            roots = [o for o in raw_objects if (not o.parent) or (o.parent not in raw_objects)]
-            roots.sort(key=lambda x: x.name)
-
-            def sort_hierarchy(obj):
-                if obj in self.objects: return 
-                self.objects.append(obj)
-                children = [c for c in obj.children if c in raw_objects]
-                children.sort(key=lambda x: x.name)
-                for child in children:
-                    sort_hierarchy(child)
-
-            for root in roots:
-                sort_hierarchy(root)
-            
-            seen = set(self.objects)
-            leftovers = [o for o in raw_objects if o not in seen]
-            self.objects.extend(leftovers)
+        for _ in self.serialize_steps():
+            pass
 
-            armatures = [obj for obj in self.objects if obj.type == "ARMATURE"]
-            visual_frames = [obj for obj in self.objects if obj.type != "ARMATURE"]
-            
-            bone_count = sum(len(arm.data.bones) for arm in armatures)
-            total_frames = len(visual_frames) + bone_count
+    def serialize_steps(self):
+        """
+        Writes the file one material or frame per step, yielding (phase, done, total).
+        Output goes to a temporary file next to the target which replaces it only
+        once complete, so a failed or cancelled export never leaves a truncated file.
+        Closing the generator early discards the temporary file.
+        """
+        directory = os.path.dirname(os.path.abspath(self.filepath))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".", suffix=".4ds.tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                yield from self.serialize_contents(f)
+            # mkstemp creates the file private, keep the permissions of the file it replaces
+            mode = os.stat(self.filepath).st_mode & 0o7777 if os.path.exists(self.filepath) else 0o644
+            os.chmod(tmp_path, mode)
+            with self.profiler.phase("replace target"):
+                os.replace(tmp_path, self.filepath)
+            if self.texture_jobs:
+                yield from self.package_textures()
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def package_textures(self):
+        """
+        Converts the textures queued by texture_name into game BMPs in the maps
+        folder, yielding ("Textures", done, total): 8-bit palettized with the key
+        at index 0 for color keyed materials, 24-bit otherwise. Source BMPs that
+        already fit are copied. Outputs whose source hash matches the manifest of
+        an earlier export are skipped.
+        """
+        directory = self.maps_directory(create=True)
+        manifest_path = os.path.join(directory, TEXTURE_MANIFEST)
+        try:
+            with open(manifest_path, "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            manifest = {}
+        
+        jobs = {}
+        with self.profiler.phase("texture hashing"):
+            for name, (image, keyed) in sorted(self.texture_jobs.items()):
+                output = os.path.join(directory, name)
+                source = image_source_file(image)
+                data = pixels = None
+                if source:
+                    with open(source, "rb") as f:
+                        data = f.read()
+                    digest = hashlib.sha1(data)
+                elif image.size[0] and image.size[1]:
+                    pixels = image_pixels(image, alpha=True)
+                    digest = hashlib.sha1(pixels.tobytes())
+                    digest.update(struct.pack("<2I", *pixels.shape[:2]))
+                else:
+                    log.warning(f"Image {image.name} has no pixels, {name} not written")
+                    self.texture_stats[2] += 1
+                    continue
+                digest.update(b"keyed" if keyed else b"plain")
+                digest = digest.hexdigest()
+                if manifest.get(name) == digest and os.path.exists(output):
+                    self.texture_stats[1] += 1
+                    continue
+                job = {"output": output, "keyed": keyed}
+                bit_count = bmp_bit_count(data) if data else 0
+                if bit_count == 8 or (bit_count == 24 and not keyed):
+                    job["data"] = data
+                else:
+                    job["pixels"] = pixels if pixels is not None else image_pixels(image, alpha=True)
+                jobs[name] = (job, digest)
+        
+        total = len(jobs)
+        if total:
+            with self.profiler.phase("texture conversion"), create_worker_pool(min(self.texture_workers, total)) as pool:
+                futures = {pool.submit(convert_texture, job): (name, digest) for name, (job, digest) in jobs.items()}
+                try:
+                    for done, future in enumerate(as_completed(futures), 1):
+                        name, digest = futures[future]
+                        try:
+                            future.result()
+                        except Exception as e:
+                            log.error(f"Failed to convert {name}: {e}")
+                            self.texture_stats[2] += 1
+                        else:
+                            manifest[name] = digest
+                            self.texture_stats[0] += 1
+                        yield "Textures", done, total
+                finally:
+                    for future in futures:
+                        future.cancel()
+            atomic_write(manifest_path, json.dumps(manifest, indent=1, sort_keys=True).encode("utf-8"))
+        self.profiler.count("textures converted", self.texture_stats[0])
+    
+    def serialize_contents(self, f):
+        self.serialize_header(f)
+        
+        lod_objects_set = self.collect_lods()
+        
+        # SAFE CHECK: Use object names to check existence in scene
+        scene_names = set(o.name for o in bpy.context.scene.objects)
+        
+        raw_objects = [
+            obj for obj in self.objects_to_export
+            if obj.name in scene_names 
+            and obj not in lod_objects_set
+            and obj.type in ("MESH", "EMPTY", "ARMATURE")
+            and not is_portal(obj) # Written inside their sector
+        ]
+        
+        # HIERARCHY SORT
+        self.objects = []
+        roots = [o for o in raw_objects if (not o.parent) or (o.parent not in raw_objects)]
+        roots.sort(key=lambda x: x.name)
+
+        def sort_hierarchy(obj):
+            if obj in self.objects: return 
+            self.objects.append(obj)
+            children = [c for c in obj.children if c in raw_objects]
+            children.sort(key=lambda x: x.name)
+            for child in children:
+                sort_hierarchy(child)
+
+        for root in roots:
+            sort_hierarchy(root)
+        
+        seen = set(self.objects)
+        leftovers = [o for o in raw_objects if o not in seen]
+        self.objects.extend(leftovers)
+        if self.batch_cell_size > 0:
+            self.collect_static_batches()
+
+        self.materials = self.collect_materials()
+        diffuse_overrides = self.build_atlases() if self.atlas_size else {}
+        self.material_ids.update((mat, i + 1) for i, mat in enumerate(self.materials) if i not in diffuse_overrides)
+        f.write(struct.pack("<H", len(self.materials)))
+        for i, mat in enumerate(self.materials):
+            self.serialize_material(f, mat, i + 1, diffuse_overrides.get(i))
+            yield "Materials", i + 1, len(self.materials)
+        
+        armatures = [obj for obj in self.objects if obj.type == "ARMATURE"]
+        visual_frames = [obj for obj in self.objects if obj.type != "ARMATURE"]
+        
+        bone_count = sum(len(arm.data.bones) for arm in armatures)
+        total_frames = len(visual_frames) + bone_count
+        
+        frame_count_offset = f.tell()
+        f.write(struct.pack("<H", total_frames))
+        
+        self.frame_index = 1
+        self.pending_parts = []
+        self.frames_map = {} 
+        self.joint_map = {}
+        
+        for i, obj in enumerate(self.objects):
+            if obj.type == "ARMATURE":
+                self.serialize_joints(f, obj)
+            elif obj.type == "BATCH":
+                self.serialize_batch(f, obj)
+            else:
+                self.serialize_frame(f, obj)
+            yield "Frames", i + 1, len(self.objects)
             
+        # Meshes split over the vertex limit add frames
+        if self.frame_index - 1 != total_frames:
+            total_frames = self.frame_index - 1
+            end = f.tell()
+            f.seek(frame_count_offset)
             f.write(struct.pack("<H", total_frames))
-            
-            self.frame_index = 1
-            self.frames_map = {} 
-            self.joint_map = {}
-            
-            for obj in self.objects:
-                if obj.type == "ARMATURE":
-                    self.serialize_joints(f, obj)
-                else:
-                    self.serialize_frame(f, obj)
-                
-            f.write(struct.pack("<?", False))
+            f.seek(end)
+        f.write(struct.pack("<?", False))
+        self.profiler.count("frames", total_frames)
+        self.profiler.count("materials", len(self.materials))
+        self.profiler.count("bytes written", f.tell())
 
 class The4DSPanelMaterial(bpy.types.Panel):
     bl_label = "4DS Material Properties"
@@ -1262,10 +2452,996 @@ class The4DSPanelMaterial(bpy.types.Panel):
         layout.separator()
         layout.operator("node.add_ls3d_group", icon='NODETREE', text="Add LS3D Material Data Node")
 
-class The4DSImporter:
-    def __init__(self, filepath):
+def fill_mesh_data(mesh, vertices, faces, material_indices=None, smooth=False):
+    """Bulk-fills an empty mesh from (n, 3) vertex and (m, k) face index arrays."""
+    vertices = np.asarray(vertices, dtype=np.float32).reshape(-1, 3)
+    faces = np.asarray(faces, dtype=np.int32)
+    num_faces = len(faces)
+    mesh.vertices.add(len(vertices))
+    mesh.vertices.foreach_set("co", vertices.ravel())
+    if num_faces:
+        corners = faces.shape[1]
+        mesh.loops.add(num_faces * corners)
+        mesh.loops.foreach_set("vertex_index", faces.ravel())
+        mesh.polygons.add(num_faces)
+        mesh.polygons.foreach_set("loop_start", np.arange(0, num_faces * corners, corners, dtype=np.int32))
+        if material_indices is not None:
+            mesh.polygons.foreach_set("material_index", np.asarray(material_indices, dtype=np.int32))
+        if smooth:
+            mesh.polygons.foreach_set("use_smooth", np.ones(num_faces, dtype=bool))
+    mesh.update(calc_edges=True)
+
+def weld_vertices(positions, triangles):
+    """
+    Merges vertices with bit-identical positions. Returns (positions, triangles,
+    source) where source holds the original index of every new vertex. Triangles
+    that would collapse or duplicate another face after welding keep their own
+    copies of the original vertices, so no face is lost.
+    """
+    positions = np.ascontiguousarray(positions, dtype=np.float32) + np.float32(0.0) # -0.0 == 0.0
+    triangles = np.asarray(triangles, dtype=np.int32).reshape(-1, 3)
+    keys = positions.view(np.dtype((np.void, 12))).ravel()
+    _, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+    # Welded vertices in order of first use
+    order = np.argsort(first)
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(order))
+    remap = rank[inverse.ravel()]
+    source = first[order]
+    welded = remap[triangles].astype(np.int32)
+    
+    bad = (welded[:, 0] == welded[:, 1]) | (welded[:, 1] == welded[:, 2]) | (welded[:, 0] == welded[:, 2])
+    # Faces over the same vertices (e.g. double sided geometry) would be merged by mesh validation
+    face_keys = np.ascontiguousarray(np.sort(welded, axis=1)).view(np.dtype((np.void, 12))).ravel()
+    _, first_face = np.unique(face_keys, return_index=True)
+    duplicate = np.ones(len(welded), dtype=bool)
+    duplicate[first_face] = False
+    bad |= duplicate
+    if bad.any():
+        extra = np.unique(triangles[bad])
+        welded[bad] = len(source) + np.searchsorted(extra, triangles[bad])
+        source = np.concatenate([source, extra])
+    return positions[source], welded, source
+
+# --- PARSER ---
+# Pure struct/NumPy decoding of .4ds files. Nothing in here touches bpy, so it can
+# run on worker threads; the importer consumes the decoded records on the main thread.
+
+# LOD vertex layout: Position(3f), Normal(3f), UV(2f)
+LOD_VERTEX_DTYPE = np.dtype([("pos", "<f4", 3), ("norm", "<f4", 3), ("uv", "<f4", 2)])
+
+_STRUCT_CACHE = {}
+
+def get_struct(fmt):
+    s = _STRUCT_CACHE.get(fmt)
+    if s is None:
+        s = _STRUCT_CACHE[fmt] = struct.Struct(fmt)
+    return s
+
+class BufferReader:
+    """Read cursor over a bytes-like buffer (bytes or mmap)."""
+    __slots__ = ("buf", "pos")
+
+    def __init__(self, buf, pos=0):
+        self.buf = buf
+        self.pos = pos
+
+    def unpack(self, fmt):
+        s = get_struct(fmt)
+        values = s.unpack_from(self.buf, self.pos)
+        self.pos += s.size
+        return values
+
+    def read(self, fmt):
+        return self.unpack(fmt)[0]
+
+    def skip(self, size):
+        self.pos += size
+
+    def array(self, dtype, count):
+        """Returns a read-only view into the buffer. Callers copy what they keep."""
+        dtype = np.dtype(dtype)
+        if count == 0:
+            return np.empty(0, dtype)
+        end = self.pos + dtype.itemsize * count
+        if end > len(self.buf):
+            raise ValueError(f"Unexpected end of file at offset {self.pos}")
+        data = np.frombuffer(self.buf, dtype, count, self.pos)
+        self.pos = end
+        return data
+
+    def string(self):
+        length = self.read("B")
+        if length == 0:
+            return ""
+        data = bytes(self.buf[self.pos:self.pos + length])
+        self.pos += length
+        return data.decode("windows-1250", errors="replace")
+
+def clean_triangles(groups, num_vertices):
+    """
+    Drops triangles that are out of range, degenerate or duplicated (in any group),
+    matching what bmesh refuses to create. groups: list of (tris, mat_idx).
+    """
+    if not groups:
+        return groups
+    counts = [len(tris) for tris, _ in groups]
+    if sum(counts) == 0:
+        return groups
+    tris = np.concatenate([t for t, _ in groups])
+    valid = (tris < num_vertices).all(axis=1)
+    valid &= (tris[:, 0] != tris[:, 1]) & (tris[:, 1] != tris[:, 2]) & (tris[:, 0] != tris[:, 2])
+    # Same vertex set in any order is the same face
+    key = np.sort(tris.astype(np.int64), axis=1)
+    key = (key[:, 0] << 32) | (key[:, 1] << 16) | key[:, 2]
+    _, first = np.unique(key, return_index=True)
+    unique_mask = np.zeros(len(tris), dtype=bool)
+    unique_mask[first] = True
+    valid &= unique_mask
+    if valid.all():
+        return groups
+    result = []
+    start = 0
+    for (group_tris, mat_idx), count in zip(groups, counts):
+        result.append((group_tris[valid[start:start + count]], mat_idx))
+        start += count
+    return result
+
+class The4DSParser:
+    """
+    Decodes a .4ds file into plain records and NumPy arrays.
+    Pass 1 reads the header, materials and frame headers and seeks over every
+    payload to record its offset. Pass 2 decodes the payloads of the frames that
+    are imported, on a thread pool when threads > 1.
+    Geometry is returned in Blender space (Y/Z swapped, V flipped, winding fixed).
+    """
+    def __init__(self, filepath, lod0_only=False, skip_frame_types=(), skip_portals=False, name_filter="", profiler=None):
+        self.profiler = profiler or Profiler(enabled=False)
         self.filepath = filepath
+        self.lod0_only = lod0_only
+        self.skip_frame_types = set(skip_frame_types)
+        self.skip_portals = skip_portals
+        self.name_patterns = [p.strip().lower() for p in name_filter.replace(";", ",").split(",") if p.strip()]
+
+    def parse(self, threads=0):
+        """Returns the model dict. Raises ValueError for invalid or unsupported files."""
+        with open(self.filepath, "rb") as fh:
+            if os.fstat(fh.fileno()).st_size == 0:
+                raise ValueError("Not a valid 4DS file (empty)")
+            buf = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            self.profiler.count("bytes read", len(buf))
+            with self.profiler.phase("read header and scan"):
+                model = self.scan(buf)
+            with self.profiler.phase("decode frames"):
+                self.decode_frames(buf, model["frames"], threads)
+        finally:
+            buf.close()
+        return model
+
+    # --- PASS 1: SCAN ---
+
+    def scan(self, buf):
+        r = BufferReader(buf)
+        if bytes(buf[:4]) != b"4DS\0":
+            raise ValueError("Not a valid 4DS file (invalid header)")
+        r.skip(4)
+        version = r.read("<H")
+        if version != VERSION_MAFIA:
+            raise ValueError(f"Unsupported 4DS version {version}. Only version {VERSION_MAFIA} (Mafia) is supported.")
+        timestamp = r.read("<Q")
+        
+        mat_count = r.read("<H")
+        materials = [self.decode_material(r) for _ in range(mat_count)]
+        
+        frame_count = r.read("<H")
+        frames = []
+        for i in range(frame_count):
+            start = r.pos
+            try:
+                record = self.decode_frame_header(r, i + 1)
+                record["offset"] = r.pos
+                self.skip_frame_payload(r, record["type"], record["visual_type"])
+            except (struct.error, ValueError) as e:
+                # Payload sizes are unknown past this point, the rest of the table is lost
+                log.error(f"Frame {i+1}/{frame_count} at offset {start} could not be read ({e}), stopping")
+                break
+            record["end"] = r.pos
+            record["skipped"] = not self.should_import_frame(record["type"], record["name"])
+            frames.append(record)
+        
+        animated = False
+        if r.pos < len(buf):
+            animated = bool(r.read("<B"))
+        
+        return {
+            "version": version,
+            "timestamp": timestamp,
+            "materials": materials,
+            "frames": frames,
+            "animated": animated,
+        }
+
+    def should_import_frame(self, frame_type, name):
+        if frame_type in self.skip_frame_types:
+            return False
+        # Joints are driven by the skinned mesh, they are never name filtered
+        if self.name_patterns and frame_type != FRAME_JOINT:
+            lname = name.lower()
+            return any(fnmatch.fnmatchcase(lname, p) for p in self.name_patterns)
+        return True
+
+    def decode_material(self, r):
+        flags = r.read("<I")
+        ambient = r.unpack("<3f")
+        diffuse = r.unpack("<3f")
+        emission = r.unpack("<3f")
+        opacity = r.read("<f")
+        
+        env_opacity = 0.0
+        env_tex = ""
+        alpha_tex = ""
+        anim_frames = 0
+        anim_period = 0
+        
+        if flags & MTL_ENVMAP:
+            env_opacity = r.read("<f")
+            env_tex = r.string()
+        diffuse_tex = r.string()
+        if flags & MTL_ALPHA:
+            alpha_tex = r.string()
+        if flags & MTL_ANIMATED_DIFFUSE:
+            anim_frames = r.read("<I")
+            r.skip(2)
+            anim_period = r.read("<I")
+            r.skip(8)
+        
+        return {
+            "flags": flags,
+            "ambient": ambient,
+            "diffuse": diffuse,
+            "emission": emission,
+            "opacity": opacity,
+            "env_opacity": env_opacity,
+            "env_texture": env_tex,
+            "diffuse_texture": diffuse_tex,
+            "alpha_texture": alpha_tex,
+            "anim_frames": anim_frames,
+            "anim_period": anim_period,
+        }
+
+    def decode_frame_header(self, r, index):
+        frame_type = r.read("<B")
+        visual_type = 0
+        visual_flags = (128, 42)
+        if frame_type == FRAME_VISUAL:
+            visual_type = r.read("<B")
+            visual_flags = r.unpack("<2B")
+        
+        parent_id = r.read("<H")
+        position = r.unpack("<3f")
+        scale = r.unpack("<3f")
+        rot = r.unpack("<4f")
+        culling_flags = r.read("<B")
+        name = r.string()
+        user_props = r.string()
+        
+        return {
+            "index": index,
+            "type": frame_type,
+            "visual_type": visual_type,
+            "visual_flags": visual_flags,
+            "parent_id": parent_id,
+            "position": (position[0], position[2], position[1]),
+            "scale": (scale[0], scale[2], scale[1]),
+            "rotation": (rot[0], rot[1], rot[3], rot[2]),
+            "culling_flags": culling_flags,
+            "name": name,
+            "user_props": user_props,
+            "data": None,
+        }
+
+    # --- SKIPPING ---
+    # These mirror the decode_* readers but only read the counts needed
+    # to compute block sizes and seek over everything else.
+
+    def skip_lod(self, r):
+        r.skip(4) # Fade distance
+        num_vertices = r.read("<H")
+        r.skip(num_vertices * LOD_VERTEX_DTYPE.itemsize)
+        num_face_groups = r.read("<B")
+        for _ in range(num_face_groups):
+            num_faces = r.read("<H")
+            r.skip(num_faces * 6 + 2) # Indices + Material ID
+        return num_vertices
+
+    def skip_object(self, r):
+        instance_id = r.read("<H")
+        if instance_id > 0:
+            return 0
+        num_lods = r.read("<B")
+        for _ in range(num_lods):
+            self.skip_lod(r)
+        return num_lods
+
+    def skip_singlemesh(self, r, num_lods):
+        for _ in range(num_lods):
+            num_bones = r.read("<B")
+            r.skip(4 + 24) # Non-weighted count + Bounds
+            for _ in range(num_bones):
+                r.skip(64 + 4) # Inverse transform + Locked count
+                num_weighted = r.read("<I")
+                r.skip(4 + 24 + 4 * num_weighted) # Bone ID + Bounds + Weights
+
+    def skip_morph(self, r):
+        num_targets = r.read("<B")
+        if num_targets == 0:
+            return
+        num_channels, num_lods = r.unpack("<2B")
+        for _ in range(num_lods):
+            for _ in range(num_channels):
+                num_morph_vertices = r.read("<H")
+                if num_morph_vertices == 0:
+                    continue
+                r.skip(num_morph_vertices * num_targets * 24)
+                if r.read("<?"):
+                    r.skip(num_morph_vertices * 2)
+            r.skip(40) # Bounds, Center, Dist
+
+    def skip_geometry(self, r):
+        # Plain vertex/triangle block used by sectors, occluders and mirrors
+        num_verts, num_faces = r.unpack("<2I")
+        r.skip(num_verts * 12 + num_faces * 6)
+
+    def skip_portal(self, r):
+        num_verts = r.read("<B")
+        r.skip(12 + 16 + num_verts * 12) # Flags/Near/Far + Plane + Verts
+
+    def skip_sector(self, r):
+        r.skip(8) # Flags
+        self.skip_geometry(r)
+        r.skip(24) # Bounds
+        num_portals = r.read("<B")
+        for _ in range(num_portals):
+            self.skip_portal(r)
+
+    def skip_frame_payload(self, r, frame_type, visual_type):
+        if frame_type == FRAME_VISUAL:
+            if visual_type == VISUAL_MIRROR:
+                r.skip(120) # Bounds, Sphere, Matrix, Color, Dist
+                self.skip_geometry(r)
+                return
+            num_lods = self.skip_object(r)
+            if visual_type == VISUAL_BILLBOARD:
+                r.skip(5)
+            if visual_type in (VISUAL_SINGLEMESH, VISUAL_SINGLEMORPH):
+                self.skip_singlemesh(r, num_lods)
+            if visual_type in (VISUAL_SINGLEMORPH, VISUAL_MORPH):
+                self.skip_morph(r)
+        elif frame_type == FRAME_SECTOR:
+            self.skip_sector(r)
+        elif frame_type == FRAME_DUMMY:
+            r.skip(24)
+        elif frame_type == FRAME_TARGET:
+            r.skip(2)
+            num_links = r.read("<B")
+            r.skip(2 * num_links)
+        elif frame_type == FRAME_OCCLUDER:
+            self.skip_geometry(r)
+        elif frame_type == FRAME_JOINT:
+            r.skip(68)
+
+    # --- PASS 2: DECODE ---
+
+    def decode_frames(self, buf, frames, threads=0):
+        todo = [rec for rec in frames if not rec["skipped"]]
+        if threads <= 0:
+            threads = os.cpu_count() or 1
+        
+        def work(rec):
+            return self.decode_payload(buf, rec)
+        
+        if threads > 1 and len(todo) > 1:
+            with ThreadPoolExecutor(max_workers=min(threads, len(todo))) as pool:
+                results = list(pool.map(work, todo))
+        else:
+            results = [work(rec) for rec in todo]
+        
+        for rec, (data, error) in zip(todo, results):
+            rec["data"] = data
+            rec["error"] = error
+
+    def decode_payload(self, buf, rec):
+        """Returns (data, error). Never raises so one bad frame doesn't stop the pool."""
+        r = BufferReader(buf, rec["offset"])
+        frame_type = rec["type"]
+        visual_type = rec["visual_type"]
+        try:
+            if frame_type == FRAME_VISUAL:
+                if visual_type == VISUAL_MIRROR:
+                    return self.decode_mirror(r), None
+                data = self.decode_object(r)
+                if visual_type == VISUAL_BILLBOARD:
+                    rot_axis, rot_mode = r.unpack("<IB")
+                    data["billboard"] = (rot_axis, rot_mode)
+                if visual_type in (VISUAL_SINGLEMESH, VISUAL_SINGLEMORPH):
+                    data["skin"] = self.decode_singlemesh(r, data["num_lods"])
+                if visual_type in (VISUAL_SINGLEMORPH, VISUAL_MORPH):
+                    data["morph"] = self.decode_morph(r)
+                return data, None
+            if frame_type == FRAME_SECTOR:
+                return self.decode_sector(r), None
+            if frame_type == FRAME_DUMMY:
+                min_b = r.unpack("<3f")
+                max_b = r.unpack("<3f")
+                return {
+                    "bbox_min": (min_b[0], min_b[2], min_b[1]),
+                    "bbox_max": (max_b[0], max_b[2], max_b[1]),
+                }, None
+            if frame_type == FRAME_TARGET:
+                unknown, num_links = r.unpack("<HB")
+                link_ids = r.unpack(f"<{num_links}H")
+                return {"unknown": unknown, "link_ids": list(link_ids)}, None
+            if frame_type == FRAME_OCCLUDER:
+                vertices, triangles = self.decode_geometry(r)
+                return {"vertices": vertices, "triangles": triangles}, None
+            if frame_type == FRAME_JOINT:
+                matrix = r.unpack("<16f")
+                bone_id = r.read("<I")
+                return {"matrix": matrix, "bone_id": bone_id}, None
+            return None, None
+        except (struct.error, ValueError, IndexError) as e:
+            return None, str(e)
+
+    def decode_lod(self, r):
+        distance = r.read("<f")
+        num_vertices = r.read("<H")
+        raw = r.array(LOD_VERTEX_DTYPE, num_vertices)
+        
+        # Swap Y/Z, flip V (fancy indexing copies out of the buffer)
+        positions = raw["pos"][:, [0, 2, 1]]
+        normals = raw["norm"][:, [0, 2, 1]]
+        uvs = raw["uv"][:, [0, 1]]
+        uvs[:, 1] = 1.0 - uvs[:, 1]
+        
+        groups = []
+        num_face_groups = r.read("<B")
+        for _ in range(num_face_groups):
+            num_faces = r.read("<H")
+            # Reverse winding: (0, 2, 1)
+            tris = r.array("<u2", num_faces * 3).reshape(-1, 3)[:, [0, 2, 1]].astype(np.int32)
+            mat_idx = r.read("<H")
+            groups.append((tris, mat_idx))
+        
+        return {
+            "distance": distance,
+            "positions": positions,
+            "normals": normals,
+            "uvs": uvs,
+            "groups": clean_triangles(groups, num_vertices),
+        }
+
+    def decode_object(self, r):
+        instance_id = r.read("<H")
+        if instance_id > 0:
+            return {"instance_id": instance_id, "num_lods": 0, "lods": [], "vertices_per_lod": []}
+        num_lods = r.read("<B")
+        lods = []
+        vertices_per_lod = []
+        for lod_idx in range(num_lods):
+            # Selective import: seek over higher LODs, only their vertex count is needed (morphs)
+            if lod_idx > 0 and self.lod0_only:
+                vertices_per_lod.append(self.skip_lod(r))
+                continue
+            lod = self.decode_lod(r)
+            vertices_per_lod.append(len(lod["positions"]))
+            lods.append(lod)
+        return {"instance_id": 0, "num_lods": num_lods, "lods": lods, "vertices_per_lod": vertices_per_lod}
+
+    def decode_singlemesh(self, r, num_lods):
+        skin_lods = []
+        for _ in range(num_lods):
+            num_bones = r.read("<B")
+            num_non_weighted = r.read("<I")
+            min_bounds = r.unpack("<3f")
+            max_bounds = r.unpack("<3f")
+            bones = []
+            for _ in range(num_bones):
+                inverse_transform = r.unpack("<16f")
+                num_locked, num_weighted, file_bone_id = r.unpack("<3I")
+                bone_min = r.unpack("<3f")
+                bone_max = r.unpack("<3f")
+                weights = r.array("<f4", num_weighted).astype(np.float32)
+                bones.append({
+                    "inverse_transform": inverse_transform,
+                    "num_locked": num_locked,
+                    "bone_id": file_bone_id,
+                    "bbox_min": bone_min,
+                    "bbox_max": bone_max,
+                    "weights": weights,
+                })
+            skin_lods.append({
+                "num_non_weighted": num_non_weighted,
+                "bbox_min": min_bounds,
+                "bbox_max": max_bounds,
+                "bones": bones,
+            })
+        return skin_lods
+
+    def decode_morph(self, r):
+        num_targets = r.read("<B")
+        if num_targets == 0:
+            return None
+        num_channels, num_lods = r.unpack("<2B")
+        lods = []
+        for _ in range(num_lods):
+            channels = []
+            for _ in range(num_channels):
+                num_morph_vertices = r.read("<H")
+                if num_morph_vertices == 0:
+                    channels.append(None)
+                    continue
+                raw = r.array("<f4", num_morph_vertices * num_targets * 6).reshape(num_morph_vertices, num_targets, 6)
+                # Convert coordinate system (Swap Y and Z)
+                positions = raw[:, :, [0, 2, 1]]
+                normals = raw[:, :, [3, 5, 4]]
+                if r.read("<?"):
+                    indices = r.array("<u2", num_morph_vertices).astype(np.int32)
+                else:
+                    indices = np.arange(num_morph_vertices, dtype=np.int32)
+                channels.append({"positions": positions, "normals": normals, "indices": indices})
+            min_bounds = r.unpack("<3f")
+            max_bounds = r.unpack("<3f")
+            center = r.unpack("<3f")
+            dist = r.read("<f")
+            lods.append({
+                "channels": channels,
+                "bbox_min": min_bounds,
+                "bbox_max": max_bounds,
+                "center": center,
+                "dist": dist,
+            })
+        return {"num_targets": num_targets, "num_channels": num_channels, "lods": lods}
+
+    def decode_geometry(self, r):
+        num_verts, num_faces = r.unpack("<2I")
+        vertices = r.array("<f4", num_verts * 3).reshape(-1, 3)[:, [0, 2, 1]]
+        triangles = r.array("<u2", num_faces * 3).reshape(-1, 3)[:, [0, 2, 1]].astype(np.int32)
+        triangles = clean_triangles([(triangles, 0)], num_verts)[0][0]
+        return vertices, triangles
+
+    def decode_sector(self, r):
+        flags = r.unpack("<2I")
+        vertices, triangles = self.decode_geometry(r)
+        # Mafia: Bounds are stored AFTER the mesh
+        min_b = r.unpack("<3f")
+        max_b = r.unpack("<3f")
+        portals = []
+        num_portals = r.read("<B")
+        for _ in range(num_portals):
+            if self.skip_portals:
+                self.skip_portal(r)
+                continue
+            num_verts = r.read("<B")
+            # Mafia Order: Flags(I), Near(f), Far(f)
+            portal_flags, near_r, far_r = r.unpack("<Iff")
+            # Plane: Normal(3f), Dot(f)
+            normal = r.unpack("<3f")
+            dotp = r.read("<f")
+            verts = r.array("<f4", num_verts * 3).reshape(-1, 3)[:, [0, 2, 1]]
+            portals.append({
+                "flags": portal_flags,
+                "near": near_r,
+                "far": far_r,
+                "normal": (normal[0], normal[2], normal[1]),
+                "dot": dotp,
+                "vertices": verts,
+            })
+        return {
+            "flags": flags,
+            "vertices": vertices,
+            "triangles": triangles,
+            "bbox_min": (min_b[0], min_b[2], min_b[1]),
+            "bbox_max": (max_b[0], max_b[2], max_b[1]),
+            "portals": portals,
+        }
+
+    def decode_mirror(self, r):
+        dmin = r.unpack("<3f")
+        dmax = r.unpack("<3f")
+        center = r.unpack("<3f")
+        radius = r.read("<f")
+        matrix = r.unpack("<16f")
+        color = r.unpack("<3f")
+        dist = r.read("<f")
+        # It has its own geometry block inside the mirror struct
+        vertices, triangles = self.decode_geometry(r)
+        return {
+            "bbox_min": (dmin[0], dmin[2], dmin[1]),
+            "bbox_max": (dmax[0], dmax[2], dmax[1]),
+            "center": (center[0], center[2], center[1]),
+            "radius": radius,
+            "matrix": matrix,
+            "color": color,
+            "dist": dist,
+            "vertices": vertices,
+            "triangles": triangles,
+        }
+
+def material_record_key(record):
+    """Hashable identity of a decoded material, used to share materials between files."""
+    return tuple(record[k] for k in (
+        "flags", "ambient", "diffuse", "emission", "opacity", "env_opacity",
+        "env_texture", "diffuse_texture", "alpha_texture", "anim_frames", "anim_period",
+    ))
+
+def parse_4ds_file(filepath, options, cache=None):
+    """Worker entry point: decodes one file. Returns (model, error)."""
+    try:
+        parser = The4DSParser(filepath, **options)
+        if cache:
+            return cache.parse(parser, threads=1), None
+        return parser.parse(threads=1), None
+    except (OSError, ValueError) as e:
+        return None, str(e)
+
+# (path, size, mtime_ns) -> content hash, shared by all caches of the session
+CONTENT_HASHES = {}
+
+class ModelCache:
+    """
+    On-disk cache of decoded models. The file size and mtime select a memoized
+    content hash, the blake2b hash of the file and the decode options name the
+    entry. An entry is a JSON description of the model followed by one blob with
+    all its arrays, so a hit is a single read. The least recently used entries
+    are evicted once the cache grows past max_bytes.
+    """
+    MAGIC = b"4DSCACHE"
+    FORMAT = 1
+
+    def __init__(self, directory, max_bytes=1 << 30):
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+    def content_hash(self, filepath):
+        st = os.stat(filepath)
+        memo_key = (os.path.abspath(filepath), st.st_size, st.st_mtime_ns)
+        digest = CONTENT_HASHES.get(memo_key)
+        if digest is None:
+            h = hashlib.blake2b(digest_size=16)
+            with open(filepath, "rb") as f:
+                for block in iter(lambda: f.read(1 << 20), b""):
+                    h.update(block)
+            digest = h.hexdigest()
+            CONTENT_HASHES[memo_key] = digest
+        return digest
+
+    def entry_path(self, parser):
+        options = json.dumps([
+            self.FORMAT, parser.lod0_only, sorted(parser.skip_frame_types),
+            parser.skip_portals, sorted(parser.name_patterns),
+        ])
+        key = hashlib.blake2b(options.encode(), digest_size=8, key=self.content_hash(parser.filepath).encode()).hexdigest()
+        return os.path.join(self.directory, key + ".4dsc")
+
+    def parse(self, parser, threads=0):
+        """Returns the cached model of parser's file, decoding and storing it on a miss."""
+        path = self.entry_path(parser)
+        try:
+            model = self.load(path)
+            os.utime(path) # Mark as recently used
+            log.info(f"Loaded {os.path.basename(parser.filepath)} from the model cache")
+            return model
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            log.warning(f"Ignoring broken cache entry {path}: {e}")
+        model = parser.parse(threads)
+        try:
+            self.store(path, model)
+            self.evict()
+        except OSError as e:
+            log.warning(f"Could not write the model cache: {e}")
+        return model
+
+    def store(self, path, model):
+        arrays = []
+        def flatten(value):
+            if isinstance(value, np.ndarray):
+                arrays.append(np.ascontiguousarray(value))
+                return {"__array__": len(arrays) - 1}
+            if isinstance(value, dict):
+                return {k: flatten(v) for k, v in value.items()}
+            if isinstance(value, tuple):
+                return {"__tuple__": [flatten(v) for v in value]}
+            if isinstance(value, (list, set)):
+                return [flatten(v) for v in value]
+            if isinstance(value, np.generic):
+                return value.item()
+            return value
+        skeleton = flatten(model)
+        table = []
+        offset = 0
+        for array in arrays:
+            offset = (offset + 15) & ~15
+            table.append([array.dtype.str, list(array.shape), offset])
+            offset += array.nbytes
+        header = json.dumps({"format": self.FORMAT, "arrays": table, "model": skeleton}).encode()
+        data_start = (len(self.MAGIC) + 4 + len(header) + 15) & ~15
+        
+        os.makedirs(self.directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(self.MAGIC)
+                f.write(struct.pack("<I", len(header)))
+                f.write(header)
+                for array, (_, _, array_offset) in zip(arrays, table):
+                    f.write(b"\0" * (data_start + array_offset - f.tell()))
+                    f.write(array.tobytes())
+            # Concurrent writers of the same entry write the same content
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def load(self, path):
+        with open(path, "rb") as f:
+            data = bytearray(f.read())
+        if data[:len(self.MAGIC)] != self.MAGIC:
+            raise ValueError("not a model cache entry")
+        header_size = struct.unpack_from("<I", data, len(self.MAGIC))[0]
+        header_start = len(self.MAGIC) + 4
+        header = json.loads(data[header_start:header_start + header_size])
+        if header["format"] != self.FORMAT:
+            raise ValueError(f"cache format {header['format']}")
+        data_start = (header_start + header_size + 15) & ~15
+        # Arrays are views into the (writable) buffer, no copies
+        arrays = [
+            np.frombuffer(data, dtype=np.dtype(dtype), count=int(np.prod(shape)), offset=data_start + offset).reshape(shape)
+            for dtype, shape, offset in header["arrays"]
+        ]
+        def restore(value):
+            if isinstance(value, dict):
+                if "__array__" in value:
+                    return arrays[value["__array__"]]
+                if "__tuple__" in value:
+                    return tuple(restore(v) for v in value["__tuple__"])
+                return {k: restore(v) for k, v in value.items()}
+            if isinstance(value, list):
+                return [restore(v) for v in value]
+            return value
+        return restore(header["model"])
+
+    def evict(self):
+        """Removes the least recently used entries until the cache fits max_bytes."""
+        entries = []
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.name.endswith(".4dsc"):
+                    st = entry.stat()
+                    entries.append((st.st_mtime, st.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass # Already evicted by another process
+
+def default_cache_dir():
+    return bpy.utils.user_resource("DATAFILES", path="ls3d_4ds_cache", create=True)
+
+# --- COLOR KEY BAKING ---
+# Color keyed BMPs carry their key as palette index 0. Baking the key into real
+# alpha lets the viewport cut out with plain image alpha instead of comparing
+# colors per pixel in the shader.
+
+def bake_color_key(data):
+    """
+    Top-down (height, width, 4) RGBA pixels of uncompressed palettized BMP data,
+    transparent wherever the color of palette index 0 appears. None for any other
+    image, which has no color key.
+    """
+    if len(data) < 54 or data[:2] != b"BM":
+        return None
+    pixel_offset = struct.unpack_from("<I", data, 10)[0]
+    info_size, width, height, _, bit_count, compression = struct.unpack_from("<IiiHHI", data, 14)
+    colors_used = struct.unpack_from("<I", data, 46)[0]
+    if bit_count not in (1, 4, 8) or compression != 0 or width <= 0 or height == 0:
+        return None
+    num_colors = colors_used or 1 << bit_count
+    palette = np.frombuffer(data, dtype=np.uint8, count=num_colors * 4, offset=14 + info_size).reshape(-1, 4)[:, 2::-1]
+    
+    row_size = (width * bit_count + 31) // 32 * 4
+    rows = np.frombuffer(data, dtype=np.uint8, count=row_size * abs(height), offset=pixel_offset).reshape(abs(height), row_size)
+    if bit_count == 8:
+        indices = rows[:, :width]
+    else:
+        bits = np.unpackbits(rows, axis=1)[:, :width * bit_count].reshape(abs(height), width, bit_count)
+        indices = (bits << np.arange(bit_count - 1, -1, -1, dtype=np.uint8)).sum(axis=2)
+    if height > 0:
+        indices = indices[::-1] # Stored bottom-up
+    
+    rgb = palette[np.minimum(indices, len(palette) - 1)]
+    alpha = np.where((rgb == palette[0]).all(axis=2), 0, 255).astype(np.uint8)
+    return np.dstack([rgb, alpha])
+
+def write_png(filepath, pixels):
+    """Writes a top-down (height, width, 4) uint8 RGBA array as a PNG."""
+    height, width, _ = pixels.shape
+    raw = np.zeros((height, width * 4 + 1), dtype=np.uint8) # Filter byte 0 per row
+    raw[:, 1:] = pixels.reshape(height, width * 4)
+    def chunk(tag, body):
+        return struct.pack(">I", len(body)) + tag + body + struct.pack(">I", zlib.crc32(tag + body) & 0xFFFFFFFF)
+    atomic_write(filepath, b"".join((
+        b"\x89PNG\r\n\x1a\n",
+        chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 6, 0, 0, 0)),
+        chunk(b"IDAT", zlib.compress(raw.tobytes(), 6)),
+        chunk(b"IEND", b""),
+    )))
+
+class ColorKeyCache:
+    """
+    On-disk cache of baked color key textures. An entry is the RGBA PNG of a BMP,
+    named after the blake2b hash of the BMP contents, so every texture is baked
+    once no matter which file or folder it is loaded from.
+    """
+    FORMAT = 1
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.hashes = {}
+
+    def baked_path(self, filepath):
+        """Path of the baked PNG of a color keyed BMP, baking it on a miss. None when it has no palette."""
+        st = os.stat(filepath)
+        memo_key = (os.path.abspath(filepath), st.st_size, st.st_mtime_ns)
+        path = self.hashes.get(memo_key)
+        if path is None:
+            with open(filepath, "rb") as f:
+                data = f.read()
+            digest = hashlib.blake2b(data, digest_size=16).hexdigest()
+            path = os.path.join(self.directory, f"{digest}_{self.FORMAT}.png")
+            if not os.path.exists(path):
+                pixels = bake_color_key(data)
+                if pixels is None:
+                    path = ""
+                else:
+                    os.makedirs(self.directory, exist_ok=True)
+                    write_png(path, pixels)
+            self.hashes[memo_key] = path
+        return path or None
+
+def color_key_cache_dir():
+    return os.path.join(default_cache_dir(), "color_keys")
+
+
+def create_worker_pool(max_workers):
+    """
+    Pool for pure decode work. On Linux workers are forked so they inherit this
+    module (a spawned interpreter cannot import it without bpy). Elsewhere a thread
+    pool is used: Windows has no fork and forking Blender on macOS is unsafe.
+    """
+    if sys.platform.startswith("linux"):
+        return ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("fork"))
+    return ThreadPoolExecutor(max_workers=max_workers)
+
+def collect_4ds_files(paths, recursive=False):
+    """Expands files and directories into a sorted list of .4ds files."""
+    result = set()
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, names in os.walk(path):
+                result.update(os.path.join(root, n) for n in names if n.lower().endswith(".4ds"))
+                if not recursive:
+                    break
+        elif os.path.isfile(path):
+            result.add(path)
+    return sorted(result)
+
+class The4DSBatchImporter:
+    """
+    Imports many .4ds files. Decoding runs in worker processes, Blender data is
+    created on the main thread as results arrive. Textures and materials are
+    shared between all files of the batch.
+    """
+    def __init__(self, filepaths, workers=0, profiler=None, cache=None, weld=False, color_key_cache=None, **options):
+        self.filepaths = list(filepaths)
+        self.profiler = profiler
+        self.weld = weld
+        self.color_key_cache = color_key_cache
+        self.cache = cache
+        self.workers = workers if workers > 0 else (os.cpu_count() or 1)
+        self.options = options
         self.texture_cache = {}
+        self.material_cache = {}
+        self.imported = []
+        self.errors = []
+
+    def run(self, context=None):
+        total = len(self.filepaths)
+        wm = context.window_manager if context else None
+        if wm: wm.progress_begin(0, total)
+        start = time.perf_counter()
+        try:
+            with create_worker_pool(min(self.workers, total)) as pool:
+                futures = {pool.submit(parse_4ds_file, path, self.options, self.cache): path for path in self.filepaths}
+                for done, future in enumerate(as_completed(futures), 1):
+                    path = futures[future]
+                    try:
+                        model, error = future.result()
+                        if error:
+                            raise ValueError(error)
+                        importer = The4DSImporter(
+                            path,
+                            texture_cache=self.texture_cache,
+                            material_cache=self.material_cache,
+                            profiler=self.profiler,
+                            weld=self.weld,
+                            color_key_cache=self.color_key_cache,
+                            **self.options,
+                        )
+                        importer.build_model(model)
+                        self.imported.append(path)
+                        log.info(f"[{done}/{total}] Imported {path}")
+                    except Exception as e:
+                        # Collect and keep going, one broken model must not abort the batch
+                        self.errors.append((path, str(e)))
+                        log.error(f"[{done}/{total}] {path}: {e}")
+                    if wm: wm.progress_update(done)
+        finally:
+            if wm: wm.progress_end()
+        log.info(f"Batch import: {len(self.imported)}/{total} files in {time.perf_counter() - start:.2f}s, {len(self.errors)} failed")
+        return self.imported, self.errors
+
+def object_world_matrix(obj):
+    """World matrix from the parent chain, valid before the depsgraph has evaluated obj."""
+    if obj.parent is None:
+        return obj.matrix_basis.copy()
+    parent_world = object_world_matrix(obj.parent)
+    if obj.parent_type == "BONE" and obj.parent_bone in obj.parent.data.bones:
+        bone = obj.parent.data.bones[obj.parent_bone]
+        parent_world = parent_world @ bone.matrix_local @ Matrix.Translation((0.0, bone.length, 0.0))
+    return parent_world @ obj.matrix_parent_inverse @ obj.matrix_basis
+
+class The4DSImporter:
+    def __init__(self, filepath, lod0_only=False, skip_frame_types=(), skip_portals=False, name_filter="", threads=0,
+                 texture_cache=None, material_cache=None, profiler=None, cache=None, collection=None, weld=False,
+                 color_key_cache=None):
+        self.filepath = filepath
+        # Merge the vertices the format splits at normal/UV seams (normals and UVs stay per corner)
+        self.weld = weld
+        # Welded mesh data -> (original index of each of its vertices, original vertex count)
+        self.weld_sources = {}
+        # Collection receiving the created objects, a new one named after the file by default.
+        # Objects are built unlinked and linked in one batch at the end of the import.
+        self.collection = collection
+        self.pending_links = []
+        self.pending_hidden = []
+        # Optional ModelCache of decoded models
+        self.cache = cache
+        # Optional ColorKeyCache, color keyed diffuse maps then load baked with real alpha
+        self.color_key_cache = color_key_cache
+        self.profiler = profiler or Profiler(enabled=False)
+        # Caches can be shared between importers (batch import)
+        self.texture_cache = texture_cache if texture_cache is not None else {}
+        self.material_cache = material_cache
+        
+        # Selective import options are applied by the parser (skipped blocks are never decoded)
+        self.parser = The4DSParser(
+            filepath,
+            lod0_only=lod0_only,
+            skip_frame_types=skip_frame_types,
+            skip_portals=skip_portals,
+            name_filter=name_filter,
+            profiler=self.profiler,
+        )
+        # Geometry decode threads (0 = all cores, 1 = main thread only)
+        self.threads = threads
+        self.skipped_frames = {}
         
         # 1. Determine Paths
         # E.g. filepath = "D:\Mafia\models\car.4ds"
@@ -1273,7 +3449,7 @@ class The4DSImporter:
         
         # FIX: Go back ONE level (models -> Mafia), not two
         self.base_dir = os.path.abspath(os.path.join(model_dir, ".."))
-        print(f"Base directory set to: {self.base_dir}")
+        log.info(f"Base directory set to: {self.base_dir}")
         
         self.maps_dir = None
         
@@ -1296,10 +3472,10 @@ class The4DSImporter:
             self.maps_dir = find_folder(model_dir, "maps")
             
         if self.maps_dir:
-            print(f"Maps directory found at: {self.maps_dir}")
+            log.info(f"Maps directory found at: {self.maps_dir}")
         else:
             # Keep original warning message style
-            print(f"Warning: 'maps' folder not found at {os.path.join(self.base_dir, 'maps')}. Textures may not load.")
+            log.warning(f"'maps' folder not found at {os.path.join(self.base_dir, 'maps')}. Textures may not load.")
 
         self.version = 0
         self.materials = []
@@ -1335,70 +3511,106 @@ class The4DSImporter:
             
         return None
 
+    def parse_model(self):
+        if self.cache:
+            return self.cache.parse(self.parser, self.threads)
+        return self.parser.parse(self.threads)
+
     def import_file(self):
-        with open(self.filepath, "rb") as f:
-            header = f.read(4)
-            if header != b"4DS\0":
-                print("Error: Not a valid 4DS file (invalid header)")
-                return
-            self.version = struct.unpack("<H", f.read(2))[0]
-            if self.version != VERSION_MAFIA:
-                print(f"Error: Unsupported 4DS version {self.version}. Only version {VERSION_MAFIA} (Mafia) is supported.")
-                return
-            f.read(8)
-            mat_count = struct.unpack("<H", f.read(2))[0]
-            print(f"Reading {mat_count} materials...")
-            self.materials = []
-            for _ in range(mat_count):
-                mat = self.deserialize_material(f)
-                self.materials.append(mat)
-            frame_count = struct.unpack("<H", f.read(2))[0]
-            print(f"Reading {frame_count} frames...")
-            frames = []
-            for i in range(frame_count):
-                print(f"Processing frame {i+1}/{frame_count}...")
-                if not self.deserialize_frame(f, self.materials, frames):
-                    print(f"Failed to deserialize frame {i+1}")
-                    continue
-            if self.armature and self.joints:
-                print("Building armature...")
-                self.build_armature()
-                print("Applying skinning...")
-                for mesh, vertex_groups, bone_to_parent in self.skinned_meshes:
-                    self.apply_skinning(mesh, vertex_groups, bone_to_parent)
-            print("Applying parenting...")
-            self.apply_deferred_parenting()
-            is_animated = struct.unpack("<B", f.read(1))[0]
-            if is_animated:
-                print("Animation data present (not supported)")
-            print("Import completed.")
+        try:
+            model = self.parse_model()
+        except (OSError, ValueError) as e:
+            log.error(f"Failed to read {self.filepath}: {e}")
+            return False
+        self.build_model(model)
+        return True
+
+    def build_model(self, model):
+        """Creates the Blender data for a model decoded by The4DSParser."""
+        for _ in self.build_steps(model):
+            pass
+
+    def build_steps(self, model):
+        """
+        Same as build_model, one material or frame per step. Yields (done, total)
+        so a modal operator can spread the work over several UI updates.
+        """
+        self.version = model["version"]
+        if self.collection is None:
+            self.collection = bpy.data.collections.new(os.path.splitext(os.path.basename(self.filepath))[0])
+            bpy.context.collection.children.link(self.collection)
+        mat_count = len(model["materials"])
+        frame_count = len(model["frames"])
+        total = mat_count + frame_count + 1
+        debug = log.isEnabledFor(logging.DEBUG)
+        profiler = self.profiler
+        if profiler.enabled:
+            ids_before = sum(len(getattr(bpy.data, name)) for name in IMPORT_ID_COLLECTIONS)
+            profiler.count("frames", frame_count)
+            profiler.count("materials", mat_count)
+        log.info(f"Reading {mat_count} materials...")
+        self.materials = []
+        for i, mat_record in enumerate(model["materials"]):
+            mat = self.deserialize_material(mat_record)
+            self.materials.append(mat)
+            yield i + 1, total
+        log.info(f"Reading {frame_count} frames...")
+        frames = []
+        for i, record in enumerate(model["frames"]):
+            if debug:
+                log.debug("Processing frame %d/%d '%s'", i + 1, frame_count, record["name"])
+            if not self.deserialize_frame(record, self.materials, frames):
+                log.warning(f"Failed to deserialize frame {i+1}")
+            yield mat_count + i + 1, total
+        if self.armature and self.joints:
+            log.info("Building armature...")
+            self.build_armature()
+            log.info("Applying skinning...")
+            for mesh, vertex_groups, bone_to_parent in self.skinned_meshes:
+                self.apply_skinning(mesh, vertex_groups, bone_to_parent)
+        log.info("Applying parenting...")
+        self.apply_deferred_parenting()
+        self.link_pending_objects()
+        if model["animated"]:
+            log.info("Animation data present, import its .5ds files with File > Import > 5DS Animation")
+        if profiler.enabled:
+            ids_after = sum(len(getattr(bpy.data, name)) for name in IMPORT_ID_COLLECTIONS)
+            profiler.count("datablocks created", ids_after - ids_before)
+        log.info("Import completed.")
+        yield total, total
+    def link_object(self, obj, hidden=False):
+        """Queues obj for the batch link at the end of the import."""
+        self.pending_links.append(obj)
+        if hidden:
+            self.pending_hidden.append(obj)
+
+    def link_pending_objects(self):
+        # One view layer resync for the whole file instead of one per object
+        link = self.collection.objects.link
+        for obj in self.pending_links:
+            link(obj)
+        # Hiding needs the objects in the view layer
+        for obj in self.pending_hidden:
+            obj.hide_set(True)
+        self.pending_links = []
+        self.pending_hidden = []
+
     def parent_to_bone(self, obj, bone_name):
-        bpy.ops.object.select_all(action="DESELECT")
-        self.armature.select_set(True)
-        bpy.context.view_layer.objects.active = self.armature
-        bpy.ops.object.mode_set(mode="EDIT")
-        if bone_name not in self.armature.data.edit_bones:
-            print(f"Error: Bone {bone_name} not found in armature during parenting")
-            bpy.ops.object.mode_set(mode="OBJECT")
+        # Same result as parent_set(type="BONE", keep_transform=True) on the offset object,
+        # computed from rest matrices so the objects don't have to be linked or evaluated
+        if bone_name not in self.armature.data.bones:
+            log.error(f"Bone {bone_name} not found in armature during parenting")
             return
-        edit_bone = self.armature.data.edit_bones[bone_name]
-        self.armature.data.edit_bones.active = edit_bone
-        bone_matrix = Matrix(edit_bone.matrix)
-        bpy.ops.object.mode_set(mode="OBJECT")
-        bpy.ops.object.select_all(action="DESELECT")
-        obj.select_set(True)
-        self.armature.select_set(True)
-        bpy.context.view_layer.objects.active = self.armature
-        bone_matrix_tr = Matrix.Translation(bone_matrix.to_translation())
-        obj.matrix_basis = self.armature.matrix_world @ bone_matrix_tr @ obj.matrix_basis
-        bpy.ops.object.parent_set(type="BONE", xmirror=False, keep_transform=True)
-    def read_string_fixed(self, f, length):
-        bytes_data = f.read(length)
-        unpacked = struct.unpack(f"{length}c", bytes_data)
-        return "".join(c.decode("windows-1250", errors='replace') for c in unpacked)
-    def read_string(self, f):
-        length = struct.unpack("B", f.read(1))[0]
-        return self.read_string_fixed(f, length) if length > 0 else ""
+        bone = self.armature.data.bones[bone_name]
+        armature_world = object_world_matrix(self.armature)
+        world = armature_world @ Matrix.Translation(bone.matrix_local.to_translation()) @ obj.matrix_basis
+        obj.parent = self.armature
+        obj.parent_type = "BONE"
+        obj.parent_bone = bone_name
+        # Bone parents are relative to the bone tail
+        bone_world = armature_world @ bone.matrix_local @ Matrix.Translation((0.0, bone.length, 0.0))
+        obj.matrix_parent_inverse = bone_world.inverted_safe()
+        obj.matrix_basis = world
     
     def get_color_key(self, filename):
         """
@@ -1436,14 +3648,15 @@ class The4DSImporter:
                         
                     return (srgb_to_lin(r), srgb_to_lin(g), srgb_to_lin(b))
         except Exception as e:
-            print(f"Error reading Color Key from {full_path}: {e}")
+            log.error(f"Error reading Color Key from {full_path}: {e}")
             
         return None
             
+    @profiled("textures")
     def get_or_load_texture(self, filename):
-        # Normalize cache key
+        # Normalize cache key (maps folder included, the cache may be shared between files)
         base_name = os.path.basename(filename)
-        norm_key = base_name.lower()
+        norm_key = os.path.join(self.maps_dir or "", base_name).lower()
         
         if norm_key not in self.texture_cache:
             full_path = None
@@ -1456,15 +3669,38 @@ class The4DSImporter:
                     image = bpy.data.images.load(full_path, check_existing=True)
                     self.texture_cache[norm_key] = image
                 except Exception as e:
-                    print(f"Warning: Failed to load texture {full_path}: {e}")
+                    log.warning(f"Failed to load texture {full_path}: {e}")
                     self.texture_cache[norm_key] = None
             else:
                 # Keep original warning style, but specific to filename
-                print(f"Warning: Texture file not found: {os.path.join(self.base_dir, 'maps', base_name)}")
+                log.warning(f"Texture file not found: {os.path.join(self.base_dir, 'maps', base_name)}")
                 self.texture_cache[norm_key] = None
                 
         return self.texture_cache[norm_key]
     
+    def get_or_load_keyed_texture(self, filename):
+        """The baked RGBA image of a color keyed texture, None when it can't be baked."""
+        base_name = os.path.basename(filename)
+        norm_key = os.path.join(self.maps_dir or "", base_name).lower() + "|color_key"
+        
+        if norm_key not in self.texture_cache:
+            image = None
+            full_path = self.get_real_file_path(self.maps_dir, base_name) if self.maps_dir else None
+            if full_path:
+                try:
+                    baked_path = self.color_key_cache.baked_path(full_path)
+                    if baked_path:
+                        image = bpy.data.images.load(baked_path, check_existing=True)
+                        image.name = base_name
+                        image.alpha_mode = 'STRAIGHT'
+                        # The exporter writes this name instead of the cache file
+                        image["ls3d_source_name"] = base_name
+                except (OSError, RuntimeError, ValueError) as e:
+                    log.warning(f"Failed to bake color key of {full_path}: {e}")
+            self.texture_cache[norm_key] = image
+        
+        return self.texture_cache[norm_key]
+    
     def set_material_data(
         self, material, diffuse, alpha_tex, env_tex, emission, alpha, metallic, use_color_key
     ):
@@ -1575,6 +3811,7 @@ class The4DSImporter:
             links.new(principled.outputs["BSDF"], output.inputs["Surface"])
                
                                                            
+    @profiled("armature")
     def build_armature(self):
         if not self.armature or not self.joints:
             return
@@ -1611,6 +3848,8 @@ class The4DSImporter:
                     break
             if frame_index != -1:
                 world_matrices[frame_index] = current_world_matrix
+            # Kept for 5DS import, the bone axes change below
+            bone["ls3d_file_matrix"] = [v for row in current_world_matrix for v in row]
          
             # Apply Matrix (Sets Head and Orientation)
             bone.matrix = current_world_matrix
@@ -1658,11 +3897,11 @@ class The4DSImporter:
                 # Leaf Bone: Always extend along the Rotation Axis
                 bone.tail = bone.head + matrix_forward * target_length
         bpy.ops.object.mode_set(mode="OBJECT")
+    @profiled("skinning")
     def apply_skinning(self, mesh, vertex_groups, bone_to_parent):
         mod = mesh.modifiers.new(name="Armature", type="ARMATURE")
         mod.object = self.armature
         total_vertices = len(mesh.data.vertices)
-        vertex_counter = 0
         if vertex_groups:
             lod_vertex_groups = vertex_groups[0]
             bone_nodes = self.bone_nodes
@@ -1672,49 +3911,63 @@ class The4DSImporter:
             bone_name_list = [
                 name for _, name in bone_names
             ] # ["back1", "back2", "back3", "l_shoulder", ...]
+            # Skin data addresses the vertices in file order, resolve it per original vertex
+            source, num_original = self.weld_sources.get(mesh.data, (None, total_vertices))
+            vertex_bone = np.full(num_original, -1, dtype=np.int32) # -1: base bone
+            vertex_weight = np.ones(num_original, dtype=np.float32)
+            vertex_locked = np.zeros(num_original, dtype=bool)
+            vertex_counter = 0
             for bone_id, num_locked, weights in lod_vertex_groups:
-                if bone_id < len(bone_name_list):
+                locked_end = min(vertex_counter + num_locked, num_original)
+                vertex_bone[vertex_counter:locked_end] = bone_id
+                vertex_locked[vertex_counter:locked_end] = True
+                vertex_counter += num_locked
+                weighted_end = min(vertex_counter + len(weights), num_original)
+                if weighted_end < vertex_counter + len(weights):
+                    log.warning(
+                        f"Vertex index {weighted_end} out of range ({num_original})"
+                    )
+                vertex_bone[vertex_counter:weighted_end] = bone_id
+                vertex_weight[vertex_counter:weighted_end] = weights[:max(weighted_end - vertex_counter, 0)]
+                vertex_counter += len(weights)
+            if source is not None:
+                vertex_bone = vertex_bone[source]
+                vertex_weight = vertex_weight[source]
+                vertex_locked = vertex_locked[source]
+            if not mesh.vertex_groups.get(self.base_bone_name):
+                mesh.vertex_groups.new(name=self.base_bone_name)
+            
+            for bone_id in np.unique(vertex_bone):
+                if bone_id < 0:
+                    bone_name = self.base_bone_name
+                elif bone_id < len(bone_name_list):
                     bone_name = bone_name_list[bone_id]
                 else:
-                    print(
-                        f"Warning: Bone ID {bone_id} exceeds available bone names ({len(bone_name_list)})"
+                    log.warning(
+                        f"Bone ID {bone_id} exceeds available bone names ({len(bone_name_list)})"
                     )
                     bone_name = f"unknown_bone_{bone_id}"
                 bvg = mesh.vertex_groups.get(bone_name)
                 if not bvg:
                     bvg = mesh.vertex_groups.new(name=bone_name)
-                locked_vertices = list(
-                    range(vertex_counter, vertex_counter + num_locked)
-                )
-                if locked_vertices:
-                    bvg.add(locked_vertices, 1.0, "ADD")
-                vertex_counter += num_locked
-                weighted_vertices = list(
-                    range(vertex_counter, vertex_counter + len(weights))
-                )
-                for i, w in zip(weighted_vertices, weights):
-                    if i < total_vertices:
-                        bvg.add([i], w, "REPLACE")
-                    else:
-                        print(
-                            f"Warning: Vertex index {i} out of range ({total_vertices})"
-                        )
-                vertex_counter += len(weights)
-            base_vg = mesh.vertex_groups.get(self.base_bone_name)
-            if not base_vg:
-                base_vg = mesh.vertex_groups.new(name=self.base_bone_name)
-            base_vertices = list(range(vertex_counter, total_vertices))
-            if base_vertices:
-                base_vg.add(base_vertices, 1.0, "ADD")
-    
-    def deserialize_singlemesh(self, f, num_lods, mesh):
+                in_bone = vertex_bone == bone_id
+                locked = np.flatnonzero(in_bone & vertex_locked)
+                if len(locked):
+                    bvg.add(locked.tolist(), 1.0, "ADD")
+                # One call per distinct weight instead of one per vertex
+                weighted = np.flatnonzero(in_bone & ~vertex_locked)
+                weights = vertex_weight[weighted]
+                for weight in np.unique(weights):
+                    bvg.add(weighted[weights == weight].tolist(), float(weight), "REPLACE")
+    
+    def deserialize_singlemesh(self, skin_lods, num_lods, mesh):
         armature_name = mesh.name
         if not self.armature:
             armature_data = bpy.data.armatures.new(armature_name + "_bones")
             armature_data.display_type = "OCTAHEDRAL"
             self.armature = bpy.data.objects.new(armature_name, armature_data)
             self.armature.show_in_front = True
-            bpy.context.collection.objects.link(self.armature)
+            self.collection.objects.link(self.armature)
             bpy.context.view_layer.objects.active = self.armature
             bpy.ops.object.mode_set(mode="EDIT")
             base_bone = self.armature.data.edit_bones.new(armature_name)
@@ -1731,39 +3984,23 @@ class The4DSImporter:
         self.armature.parent = mesh
         vertex_groups = []
         bone_to_parent = {}
-        for lod_id in range(num_lods):
-            num_bones = struct.unpack("<B", f.read(1))[0]
-            num_non_weighted_verts = struct.unpack("<I", f.read(4))[0]
-            min_bounds = struct.unpack("<3f", f.read(12))
-            max_bounds = struct.unpack("<3f", f.read(12))
+        for skin_lod in skin_lods[:num_lods]:
             lod_vertex_groups = []
-            sequential_bone_id = 0
-            for _ in range(num_bones):
-                inverse_transform = struct.unpack("<16f", f.read(64))
-                num_locked = struct.unpack("<I", f.read(4))[0]
-                num_weighted = struct.unpack("<I", f.read(4))[0]
-                file_bone_id = struct.unpack("<I", f.read(4))[0]
-                bone_min = struct.unpack("<3f", f.read(12))
-                bone_max = struct.unpack("<3f", f.read(12))
-                weights = list(struct.unpack(f"<{num_weighted}f", f.read(4 * num_weighted)))
-                bone_id = sequential_bone_id
-                sequential_bone_id += 1
+            for bone_id, bone in enumerate(skin_lod["bones"]):
                 parent_id = 0
                 for _, _, pid, bid in self.joints:
-                    if bid == file_bone_id:
+                    if bid == bone["bone_id"]:
                         parent_id = pid
                         break
                 bone_to_parent[bone_id] = parent_id
-                lod_vertex_groups.append((bone_id, num_locked, weights))
+                lod_vertex_groups.append((bone_id, bone["num_locked"], bone["weights"]))
             vertex_groups.append(lod_vertex_groups)
         self.skinned_meshes.append((mesh, vertex_groups, bone_to_parent))
         return vertex_groups
          
-    def deserialize_dummy(self, f, empty, pos, rot, scale):
-        min_bounds = struct.unpack("<3f", f.read(12))
-        max_bounds = struct.unpack("<3f", f.read(12))
-        min_bounds = (min_bounds[0], min_bounds[2], min_bounds[1])
-        max_bounds = (max_bounds[0], max_bounds[2], max_bounds[1])
+    def deserialize_dummy(self, data, empty, pos, rot, scale):
+        min_bounds = data["bbox_min"]
+        max_bounds = data["bbox_max"]
         aabb_size = (
             max_bounds[0] - min_bounds[0],
             max_bounds[1] - min_bounds[1],
@@ -1779,12 +4016,7 @@ class The4DSImporter:
         empty.scale = scale
         empty["bbox_min"] = min_bounds
         empty["bbox_max"] = max_bounds
-    def deserialize_target(self, f, empty, pos, rot, scale):
-        unknown = struct.unpack("<H", f.read(2))[0]
-        num_links = struct.unpack("<B", f.read(1))[0]
-        link_ids = struct.unpack(
-            f"<{num_links}H", f.read(2 * num_links)
-        )
+    def deserialize_target(self, data, empty, pos, rot, scale):
         empty.empty_display_type = "PLAIN_AXES"
         empty.empty_display_size = 0.5
         empty.show_name = True
@@ -1792,129 +4024,145 @@ class The4DSImporter:
         empty.rotation_mode = "QUATERNION"
         empty.rotation_quaternion = (rot[0], rot[1], rot[3], rot[2])
         empty.scale = scale
-        empty["link_ids"] = list(link_ids)
-    def deserialize_morph(self, f, mesh, num_vertices_per_lod):
-            num_targets = struct.unpack("<B", f.read(1))[0]
-            if num_targets == 0:
-                return
-            num_channels = struct.unpack("<B", f.read(1))[0]
-            num_lods = struct.unpack("<B", f.read(1))[0]
-            if len(num_vertices_per_lod) != num_lods:
-                num_lods = min(num_lods, len(num_vertices_per_lod))
-            morph_data = []
-            for lod_idx in range(num_lods):
-                lod_data = []
-                for channel_idx in range(num_channels):
-                    num_morph_vertices = struct.unpack("<H", f.read(2))[0]
-                    if num_morph_vertices == 0:
-                        lod_data.append([])
-                        continue
-                    vertex_data = []
-                    for vert_idx in range(num_morph_vertices):
-                        targets = []
-                        for target_idx in range(num_targets):
-                            p = struct.unpack("<3f", f.read(12))
-                            n = struct.unpack("<3f", f.read(12))
-                            # Convert coordinate system (Swap Y and Z)
-                            p = (p[0], p[2], p[1])
-                            n = (n[0], n[2], n[1])
-                            targets.append((p, n))
-                        vertex_data.append(targets)
-                    unknown = struct.unpack("<?", f.read(1))[0]
-                    vertex_indices = []
-                    if unknown:
-                        vertex_indices = struct.unpack(
-                            f"<{num_morph_vertices}H", f.read(2 * num_morph_vertices)
-                        )
-                    else:
-                        vertex_indices = list(range(num_morph_vertices))
-                    lod_data.append((vertex_data, vertex_indices))
-                morph_data.append(lod_data)
-                min_bounds = struct.unpack("<3f", f.read(12))
-                max_bounds = struct.unpack("<3f", f.read(12))
-                center = struct.unpack("<3f", f.read(12))
-                dist = struct.unpack("<f", f.read(4))
+        empty["link_ids"] = list(data["link_ids"])
+    @profiled("morphs")
+    def deserialize_morph(self, mesh, morph, num_vertices_per_lod):
+            num_targets = morph["num_targets"]
+            num_channels = morph["num_channels"]
+            morph_lods = morph["lods"]
+            num_lods = min(len(morph_lods), len(num_vertices_per_lod))
             # Apply shape keys to mesh
             if not mesh.data.shape_keys:
                 mesh.shape_key_add(name="Basis", from_mix=False)
+            basis = np.empty(len(mesh.data.vertices) * 3, dtype=np.float32)
+            mesh.data.vertices.foreach_get("co", basis)
+            basis = basis.reshape(-1, 3)
+            # Welded meshes are addressed through their original vertex indices
+            source, mesh_vertices = self.weld_sources.get(mesh.data, (None, len(mesh.data.vertices)))
             for lod_idx in range(num_lods):
                 num_vertices = num_vertices_per_lod[lod_idx]
-                if len(mesh.data.vertices) != num_vertices:
+                if mesh_vertices != num_vertices:
                     continue
-                lod_data = morph_data[lod_idx]
+                channels = morph_lods[lod_idx]["channels"]
                 for channel_idx in range(num_channels):
-                    if not lod_data[channel_idx]:
+                    channel = channels[channel_idx]
+                    if channel is None:
                         continue
-                    vertex_data, vertex_indices = lod_data[channel_idx]
+                    indices = channel["indices"]
+                    valid = indices < num_vertices
                     for target_idx in range(num_targets):
                         shape_key_name = (
                             f"Target_{target_idx}_LOD{lod_idx}_Channel{channel_idx}"
                         )
                         shape_key = mesh.shape_key_add(name=shape_key_name, from_mix=False)
-                        for morph_idx, vert_idx in enumerate(vertex_indices):
-                            if vert_idx >= num_vertices:
-                                continue
-                            target_pos, _ = vertex_data[morph_idx][target_idx]
-                            shape_key.data[vert_idx].co = target_pos
+                        co = basis.copy()
+                        if source is None:
+                            co[indices[valid]] = channel["positions"][valid, target_idx]
+                        else:
+                            original = np.full((num_vertices, 3), np.nan, dtype=np.float32)
+                            original[indices[valid]] = channel["positions"][valid, target_idx]
+                            moved = original[source]
+                            has_target = ~np.isnan(moved[:, 0])
+                            co[has_target] = moved[has_target]
+                        shape_key.data.foreach_set("co", co.ravel())
+    @profiled("parenting")
     def apply_deferred_parenting(self):
         for frame_index, parent_id in self.parenting_info:
+            if frame_index in self.skipped_frames:
+                continue
             if frame_index not in self.frames_map:
-                print(f"Warning: Frame {frame_index} not found in frames_map")
+                log.warning(f"Frame {frame_index} not found in frames_map")
                 continue
             if frame_index == parent_id:
-                print(f"Ignoring frame {frame_index} - parent set to itself")
+                log.debug(f"Ignoring frame {frame_index} - parent set to itself")
                 continue
+            if parent_id in self.skipped_frames:
+                parent_id = self.resolve_skipped_parent(frame_index, parent_id)
+                if not parent_id:
+                    continue
             parent_type = self.frame_types.get(parent_id, 0)
             child_obj = self.frames_map[frame_index]
             if child_obj is None or isinstance(
                 child_obj, str
             ):
-                print(
+                log.warning(
                     f"Skipping parenting for frame {frame_index}: Not a valid object (value: {child_obj})"
                 )
                 continue
             if parent_id not in self.frames_map:
-                print(
-                    f"Warning: Parent {parent_id} for frame {frame_index} not found in frames_map"
+                log.warning(
+                    f"Parent {parent_id} for frame {frame_index} not found in frames_map"
                 )
                 continue
             parent_entry = self.frames_map[parent_id]
             if parent_type == FRAME_JOINT:
                 if not self.armature:
-                    print(
-                        f"Warning: No armature available to parent frame {frame_index} to joint {parent_id}"
+                    log.warning(
+                        f"No armature available to parent frame {frame_index} to joint {parent_id}"
                     )
                     continue
                 parent_bone_name = self.bones_map.get(parent_id)
                 if not parent_bone_name:
-                    print(f"Warning: Bone for joint {parent_id} not found in bones_map")
+                    log.warning(f"Bone for joint {parent_id} not found in bones_map")
                     continue
                 if parent_bone_name not in self.armature.data.bones:
-                    print(f"Warning: Bone {parent_bone_name} not found in armature")
+                    log.warning(f"Bone {parent_bone_name} not found in armature")
                     continue
                 self.parent_to_bone(child_obj, parent_bone_name)
             else:
                 if isinstance(parent_entry, str):
-                    print(
-                        f"Warning: Parent {parent_id} is a joint but frame type is {parent_type}"
+                    log.warning(
+                        f"Parent {parent_id} is a joint but frame type is {parent_type}"
                     )
                     continue
                 parent_obj = parent_entry
                 child_obj.parent = parent_obj
-    def deserialize_material(self, f):
+    def resolve_skipped_parent(self, frame_index, parent_id):
+        """
+        Bakes the transforms of skipped ancestors into the child.
+        Returns the nearest imported ancestor ID (0 if none).
+        """
+        child_obj = self.frames_map.get(frame_index)
+        chain = Matrix.Identity(4)
+        visited = set()
+        while parent_id in self.skipped_frames and parent_id not in visited:
+            visited.add(parent_id)
+            transform_mat, grand_parent_id = self.skipped_frames[parent_id]
+            chain = transform_mat @ chain
+            parent_id = grand_parent_id
+        if child_obj is not None and not isinstance(child_obj, str):
+            child_obj.matrix_local = chain @ child_obj.matrix_local
+        return parent_id
+
+    @profiled("materials")
+    def deserialize_material(self, record):
+        if self.material_cache is not None:
+            key = material_record_key(record)
+            cached = self.material_cache.get(key)
+            try:
+                if cached is not None and cached.name in bpy.data.materials:
+                    return cached
+            except ReferenceError:
+                pass # Removed since it was cached
+            mat = self.create_material(record)
+            self.material_cache[key] = mat
+            return mat
+        return self.create_material(record)
+
+    def create_material(self, record):
         mat = bpy.data.materials.new("LS3D_Material")
         mat.use_nodes = True
         tree = mat.node_tree
         tree.nodes.clear()
 
-        # 1. READ RAW FLAGS
-        raw_flags = struct.unpack("<I", f.read(4))[0]
+        # 1. RAW FLAGS
+        raw_flags = record["flags"]
         
-        # 2. READ VALUES
-        mat.ls3d_ambient_color = struct.unpack("<3f", f.read(12))
-        mat.ls3d_diffuse_color = struct.unpack("<3f", f.read(12))
-        mat.ls3d_emission_color = struct.unpack("<3f", f.read(12))
-        opacity = struct.unpack("<f", f.read(4))[0]
+        # 2. VALUES
+        mat.ls3d_ambient_color = record["ambient"]
+        mat.ls3d_diffuse_color = record["diffuse"]
+        mat.ls3d_emission_color = record["emission"]
+        opacity = record["opacity"]
 
         # 3. PARSE FLAGS USING CONSTANTS
         # Tiling is inverted (Flag set = Disable Tiling)
@@ -1954,27 +4202,17 @@ class The4DSImporter:
         # Z-Write is often associated with Additive in tools, but we keep it separate
         mat.ls3d_misc_zwrite = bool(raw_flags & MTL_ADDITIVE) 
 
-        # 4. READ TEXTURE NAMES
-        env_opacity = 0.0
-        env_tex_name = ""
-        diff_tex_name = ""
-        alpha_tex_name = ""
+        # 4. TEXTURE NAMES
+        env_opacity = record["env_opacity"]
+        env_tex_name = record["env_texture"]
+        diff_tex_name = record["diffuse_texture"]
+        alpha_tex_name = record["alpha_texture"]
         
-        if mat.ls3d_env_enabled:
-            env_opacity = struct.unpack("<f", f.read(4))[0]
-            env_tex_name = self.read_string(f)
-            
-        diff_tex_name = self.read_string(f)
         if diff_tex_name: mat.name = diff_tex_name
-        
-        if mat.ls3d_alpha_enabled:
-            alpha_tex_name = self.read_string(f)
             
         if mat.ls3d_diff_anim:
-            mat.ls3d_diff_frame_count = struct.unpack("<I", f.read(4))[0]
-            f.read(2) 
-            mat.ls3d_diff_frame_period = struct.unpack("<I", f.read(4))[0]
-            f.read(8)
+            mat.ls3d_diff_frame_count = record["anim_frames"]
+            mat.ls3d_diff_frame_period = record["anim_period"]
 
         # 5. RECONSTRUCT NODE GRAPH
         ls3d_group = get_or_create_ls3d_group()
@@ -1992,14 +4230,17 @@ class The4DSImporter:
 
         if diff_tex_name:
             tex = tree.nodes.new('ShaderNodeTexImage')
-            tex.image = self.get_or_load_texture(diff_tex_name)
+            baked = None
+            if mat.ls3d_alpha_colorkey and self.color_key_cache:
+                baked = self.get_or_load_keyed_texture(diff_tex_name)
+            tex.image = baked or self.get_or_load_texture(diff_tex_name)
             tex.location = (-400, 200)
             tex.label = "Diffuse Map"
             if mat.ls3d_alpha_colorkey: tex.interpolation = 'Closest'
             
             if "Diffuse Map" in group_node.inputs:
                 tree.links.new(tex.outputs["Color"], group_node.inputs["Diffuse Map"])
-            if mat.ls3d_alpha_imgalpha and "Alpha Map" in group_node.inputs:
+            if (baked or mat.ls3d_alpha_imgalpha) and "Alpha Map" in group_node.inputs:
                 tree.links.new(tex.outputs["Alpha"], group_node.inputs["Alpha Map"])
 
         if alpha_tex_name:
@@ -2043,33 +4284,27 @@ class The4DSImporter:
         
         return mat
     
-    def deserialize_object(self, f, materials, mesh, mesh_data, culling_flags):
-        instance_id = struct.unpack("<H", f.read(2))[0]
-        if instance_id > 0:
+    def deserialize_object(self, data, materials, mesh, mesh_data, culling_flags):
+        if data["instance_id"] > 0:
             return None, None
-            
-        vertices_per_lod = []
-        num_lods = struct.unpack("<B", f.read(1))[0]
         
         base_name = mesh.name
         
-        for lod_idx in range(num_lods):
-            # 1. READ DISTANCE
-            clipping_range = struct.unpack("<f", f.read(4))[0]
+        for lod_idx, lod in enumerate(data["lods"]):
+            clipping_range = lod["distance"]
             
-            # 2. CREATE OBJECT & ASSIGN DISTANCE
+            # CREATE OBJECT & ASSIGN DISTANCE
             if lod_idx > 0:
                 name = f"{base_name}_lod{lod_idx}"
                 mesh_data = bpy.data.meshes.new(name)
                 new_mesh = bpy.data.objects.new(name, mesh_data)
                 new_mesh.parent = mesh 
                 new_mesh.matrix_local = Matrix.Identity(4) 
-                bpy.context.collection.objects.link(new_mesh)
+                self.link_object(new_mesh, hidden=True)
                 
                 # Assign to child LOD
                 new_mesh.ls3d_lod_dist = clipping_range
                 new_mesh.cull_flags = culling_flags
-                new_mesh.hide_set(True)
                 new_mesh.hide_render = True
                 
                 current_mesh = mesh_data
@@ -2078,299 +4313,198 @@ class The4DSImporter:
                 mesh.ls3d_lod_dist = clipping_range
                 current_mesh = mesh_data
 
-            num_vertices = struct.unpack("<H", f.read(2))[0]
-            vertices_per_lod.append(num_vertices)
-            
-            # --- GEOMETRY ---
-            raw_pos = []
-            raw_norm = []
-            raw_uv = []
-            
-            for _ in range(num_vertices):
-                data = struct.unpack("<3f3f2f", f.read(32))
-                raw_pos.append((data[0], data[2], data[1]))
-                raw_norm.append((data[3], data[5], data[4]))
-                raw_uv.append((data[6], 1.0 - data[7]))
-
-            bm = bmesh.new()
-            bm_verts = [bm.verts.new(p) for p in raw_pos]
-            bm.verts.ensure_lookup_table()
+            self.build_lod_mesh(current_mesh, lod, materials)
             
-            num_face_groups = struct.unpack("<B", f.read(1))[0]
-            
-            for group_idx in range(num_face_groups):
-                num_faces = struct.unpack("<H", f.read(2))[0]
-                raw_faces = struct.unpack(f"<{num_faces*3}H", f.read(num_faces * 6))
-                mat_idx = struct.unpack("<H", f.read(2))[0]
-                
-                slot_index = 0
-                if mat_idx > 0 and (mat_idx - 1) < len(materials):
-                    target_mat = materials[mat_idx - 1]
-                    if target_mat.name in current_mesh.materials:
-                        slot_index = current_mesh.materials.find(target_mat.name)
-                    else:
-                        current_mesh.materials.append(target_mat)
-                        slot_index = len(current_mesh.materials) - 1
-                
-                for i in range(0, len(raw_faces), 3):
-                    try:
-                        v1, v2, v3 = bm_verts[raw_faces[i]], bm_verts[raw_faces[i+2]], bm_verts[raw_faces[i+1]]
-                        face = bm.faces.new((v1, v2, v3))
-                        face.material_index = slot_index
-                        face.smooth = True 
-                    except ValueError: pass
-
-            bm.to_mesh(current_mesh)
-            bm.free()
-            
-            # --- NORMALS & UVS ---
-            if num_vertices > 0:
+        return data["num_lods"], data["vertices_per_lod"]
+
+    @profiled("mesh build")
+    def build_lod_mesh(self, current_mesh, lod, materials):
+        """Bulk-builds one LOD from decoded arrays (no per-vertex Python work)."""
+        num_vertices = len(lod["positions"])
+        
+        # --- GEOMETRY ---
+        triangles = []
+        slot_indices = []
+        for tris, mat_idx in lod["groups"]:
+            slot_index = 0
+            if mat_idx > 0 and (mat_idx - 1) < len(materials):
+                target_mat = materials[mat_idx - 1]
+                if target_mat.name in current_mesh.materials:
+                    slot_index = current_mesh.materials.find(target_mat.name)
+                else:
+                    current_mesh.materials.append(target_mat)
+                    slot_index = len(current_mesh.materials) - 1
+            triangles.append(tris)
+            slot_indices.append(np.full(len(tris), slot_index, dtype=np.int32))
+        
+        if triangles:
+            triangles = np.concatenate(triangles)
+            slot_indices = np.concatenate(slot_indices)
+        else:
+            triangles = np.empty((0, 3), dtype=np.int32)
+            slot_indices = np.empty(0, dtype=np.int32)
+        
+        positions = lod["positions"]
+        topology = triangles
+        if self.weld and num_vertices > 0:
+            with self.profiler.phase("weld"):
+                positions, topology, source = weld_vertices(positions, triangles)
+            self.weld_sources[current_mesh] = (source, num_vertices)
+        fill_mesh_data(current_mesh, positions, topology, slot_indices, smooth=True)
+        self.profiler.count("vertices", len(positions))
+        self.profiler.count("triangles", len(triangles))
+        
+        # --- NORMALS & UVS (per corner) ---
+        if num_vertices > 0:
+            corners = triangles.ravel()
+            with self.profiler.phase("normals and uvs"):
                 uv_layer = current_mesh.uv_layers.new(name="UVMap")
-                loop_normals = []
-                for loop in current_mesh.loops:
-                    v_idx = loop.vertex_index
-                    uv_layer.data[loop.index].uv = raw_uv[v_idx]
-                    loop_normals.append(raw_norm[v_idx])
+                uv_layer.data.foreach_set("uv", lod["uvs"][corners].ravel())
                 
-                try: current_mesh.normals_split_custom_set(loop_normals)
+                try: current_mesh.normals_split_custom_set(lod["normals"][corners])
                 except: pass
 
-                if hasattr(current_mesh, "use_auto_smooth"):
-                    current_mesh.use_auto_smooth = True
-                current_mesh.validate(clean_customdata=False)
-            
-        return num_lods, vertices_per_lod
+            if hasattr(current_mesh, "use_auto_smooth"):
+                current_mesh.use_auto_smooth = True
+            current_mesh.validate(clean_customdata=False)
     
-    def deserialize_sector(self, f, mesh):
+    def deserialize_sector(self, data, mesh):
         # 1. Flags
-        flags = struct.unpack("<2I", f.read(8))
-        mesh.ls3d_sector_flags1 = flags[0]
-        mesh.ls3d_sector_flags2 = flags[1]
+        mesh.ls3d_sector_flags1 = data["flags"][0]
+        mesh.ls3d_sector_flags2 = data["flags"][1]
         
         # 2. Geometry
-        num_verts = struct.unpack("<I", f.read(4))[0]
-        num_faces = struct.unpack("<I", f.read(4))[0]
-        
-        bm = bmesh.new()
-        vertices = []
-        for _ in range(num_verts):
-            p = struct.unpack("<3f", f.read(12))
-            # Swap Y/Z for Blender
-            vert = bm.verts.new((p[0], p[2], p[1]))
-            vertices.append(vert)
-        bm.verts.ensure_lookup_table()
-        
-        for _ in range(num_faces):
-            idxs = struct.unpack("<3H", f.read(6))
-            try: bm.faces.new([vertices[idxs[0]], vertices[idxs[2]], vertices[idxs[1]]])
-            except: pass
-            
-        bm.to_mesh(mesh.data)
-        bm.free()
+        fill_mesh_data(mesh.data, data["vertices"], data["triangles"])
         
-        # 3. Bounds (Mafia: Read AFTER mesh)
-        min_b = struct.unpack("<3f", f.read(12))
-        max_b = struct.unpack("<3f", f.read(12))
-        mesh.bbox_min = (min_b[0], min_b[2], min_b[1])
-        mesh.bbox_max = (max_b[0], max_b[2], max_b[1])
+        # 3. Bounds
+        mesh.bbox_min = data["bbox_min"]
+        mesh.bbox_max = data["bbox_max"]
         
         # 4. Portals
-        num_portals = struct.unpack("<B", f.read(1))[0]
-        for i in range(num_portals):
-            self.deserialize_portal(f, mesh, i)
+        for i, portal in enumerate(data["portals"]):
+            self.deserialize_portal(portal, mesh, i)
 
-    def deserialize_portal(self, f, parent_sector, index):
-        # Byte 1: Num Verts
-        num_verts = struct.unpack("<B", f.read(1))[0]
-        
-        # Mafia Order: Flags(I), Near(f), Far(f)
-        flags = struct.unpack("<I", f.read(4))[0]
-        near_r = struct.unpack("<f", f.read(4))[0]
-        far_r = struct.unpack("<f", f.read(4))[0]
-        
-        # Plane: Normal(3f), Dot(f)
-        normal = struct.unpack("<3f", f.read(12))
-        dotp = struct.unpack("<f", f.read(4))[0]
-        
-        # Vertices
-        verts = []
-        for _ in range(num_verts):
-            p = struct.unpack("<3f", f.read(12))
-            verts.append((p[0], p[2], p[1]))
-            
+    def deserialize_portal(self, portal, parent_sector, index):
         # Create Object
         p_name = f"{parent_sector.name}_Portal_{index}"
         p_mesh = bpy.data.meshes.new(p_name)
         p_obj = bpy.data.objects.new(p_name, p_mesh)
         p_obj.parent = parent_sector
-        bpy.context.collection.objects.link(p_obj)
+        self.link_object(p_obj)
         
-        p_obj.ls3d_portal_flags = flags
-        p_obj.ls3d_portal_near = near_r
-        p_obj.ls3d_portal_far = far_r
+        p_obj.ls3d_portal_flags = portal["flags"]
+        p_obj.ls3d_portal_near = portal["near"]
+        p_obj.ls3d_portal_far = portal["far"]
         
-        # Build Mesh
-        bm = bmesh.new()
-        for v in verts: bm.verts.new(v)
-        bm.verts.ensure_lookup_table()
-        if len(bm.verts) >= 3: bm.faces.new(bm.verts)
-        bm.to_mesh(p_mesh)
-        bm.free()
+        # Build Mesh (single n-gon)
+        verts = portal["vertices"]
+        if len(verts) >= 3:
+            faces = np.arange(len(verts), dtype=np.int32).reshape(1, -1)
+        else:
+            faces = np.empty((0, 3), dtype=np.int32)
+        fill_mesh_data(p_mesh, verts, faces)
 
-    def deserialize_frame(self, f, materials, frames):
-        frame_type = struct.unpack("<B", f.read(1))[0]
-        visual_type = 0
-        visual_flags = (128, 42) 
-        
-        if frame_type == FRAME_VISUAL:
-            visual_type = struct.unpack("<B", f.read(1))[0]
-            visual_flags = struct.unpack("<2B", f.read(2))
-            
-        parent_id = struct.unpack("<H", f.read(2))[0]
-        position = struct.unpack("<3f", f.read(12))
-        scale = struct.unpack("<3f", f.read(12))
-        rot = struct.unpack("<4f", f.read(16)) 
+    @profiled("frames")
+    def deserialize_frame(self, record, materials, frames):
+        frame_index = record["index"]
+        frame_type = record["type"]
+        visual_type = record["visual_type"]
+        visual_flags = record["visual_flags"]
+        parent_id = record["parent_id"]
+        name = record["name"]
+        user_props = record["user_props"]
+        culling_flags = int(record["culling_flags"])
         
-        pos = (position[0], position[2], position[1])
-        scl = (scale[0], scale[2], scale[1])
-        rot_tuple = (rot[0], rot[1], rot[3], rot[2])
+        pos = record["position"]
+        scl = record["scale"]
+        rot_tuple = record["rotation"]
         
         scale_mat = Matrix.Diagonal(scl).to_4x4()
         rot_mat = Quaternion(rot_tuple).to_matrix().to_4x4()
         trans_mat = Matrix.Translation(pos)
         transform_mat = trans_mat @ rot_mat @ scale_mat
         
-        # Read Flag and convert to int just to be safe
-        culling_flags = int(struct.unpack("<B", f.read(1))[0])
-        name = self.read_string(f)
-        user_props = self.read_string(f)
-        
-        self.frame_types[self.frame_index] = frame_type
+        self.frame_types[frame_index] = frame_type
         if parent_id > 0:
-            self.parenting_info.append((self.frame_index, parent_id))
+            self.parenting_info.append((frame_index, parent_id))
+        
+        if record["skipped"]:
+            # Keep the transform so children can still be placed correctly
+            self.skipped_frames[frame_index] = (transform_mat, parent_id)
+            return True
+        
+        data = record["data"]
+        if data is None and record.get("error"):
+            log.warning(f"Could not parse frame '{name}' (type {frame_type}, visual type {visual_type}): {record['error']}")
+            return False
         
         mesh = None
         empty = None
         
         if frame_type == FRAME_VISUAL:
-            if visual_type in (VISUAL_OBJECT, VISUAL_LITOBJECT):
-                mesh_data = bpy.data.meshes.new(name + "_mesh")
-                mesh = bpy.data.objects.new(name, mesh_data)
-                bpy.context.collection.objects.link(mesh)
-                mesh.visual_type = str(visual_type)
-                frames.append(mesh)
-                self.frames_map[self.frame_index] = mesh
-                self.frame_index += 1
-                mesh.matrix_local = transform_mat
-                
-                mesh.cull_flags = culling_flags
-                self.deserialize_object(f, materials, mesh, mesh_data, culling_flags)
+            mesh_data = bpy.data.meshes.new(name + "_mesh")
+            mesh = bpy.data.objects.new(name, mesh_data)
+            self.link_object(mesh)
+            mesh.visual_type = str(visual_type)
+            frames.append(mesh)
+            self.frames_map[frame_index] = mesh
+            mesh.matrix_local = transform_mat
             
-            elif visual_type == VISUAL_BILLBOARD:
-                mesh_data = bpy.data.meshes.new(name + "_mesh")
-                mesh = bpy.data.objects.new(name, mesh_data)
-                bpy.context.collection.objects.link(mesh)
-                mesh.visual_type = '4'
-                frames.append(mesh)
-                self.frames_map[self.frame_index] = mesh
-                self.frame_index += 1
-                mesh.matrix_local = transform_mat
-                
-                mesh.cull_flags = culling_flags
-                self.deserialize_object(f, materials, mesh, mesh_data, culling_flags)
-                self.deserialize_billboard(f, mesh)
-
-            elif visual_type == VISUAL_MIRROR:
-                mesh_data = bpy.data.meshes.new(name + "_mesh")
-                mesh = bpy.data.objects.new(name, mesh_data)
-                bpy.context.collection.objects.link(mesh)
-                mesh.visual_type = '8'
-                frames.append(mesh)
-                self.frames_map[self.frame_index] = mesh
-                self.frame_index += 1
-                mesh.matrix_local = transform_mat
-                self.deserialize_mirror(f, mesh)
-
-            elif visual_type in (VISUAL_SINGLEMESH, VISUAL_SINGLEMORPH, VISUAL_MORPH):
-                mesh_data = bpy.data.meshes.new(name + "_mesh")
-                mesh = bpy.data.objects.new(name, mesh_data)
-                bpy.context.collection.objects.link(mesh)
-                mesh.visual_type = str(visual_type)
-                frames.append(mesh)
-                self.frames_map[self.frame_index] = mesh
-                mesh.matrix_local = transform_mat
-                
+            if visual_type == VISUAL_MIRROR:
+                self.deserialize_mirror(data, mesh)
+            else:
                 mesh.cull_flags = culling_flags
-                num_lods, verts_per_lod = self.deserialize_object(f, materials, mesh, mesh_data, culling_flags)
+                num_lods, verts_per_lod = self.deserialize_object(data, materials, mesh, mesh_data, culling_flags)
                 
-                if visual_type != VISUAL_MORPH:
-                    self.deserialize_singlemesh(f, num_lods, mesh)
-                    self.bones_map[self.frame_index] = self.base_bone_name
+                if visual_type == VISUAL_BILLBOARD:
+                    self.deserialize_billboard(data["billboard"], mesh)
                 
-                if visual_type != VISUAL_SINGLEMESH:
-                    self.deserialize_morph(f, mesh, verts_per_lod)
+                if visual_type in (VISUAL_SINGLEMESH, VISUAL_SINGLEMORPH):
+                    self.deserialize_singlemesh(data["skin"], num_lods, mesh)
+                    self.bones_map[frame_index] = self.base_bone_name
                 
-                self.frame_index += 1
-            
-            else:
-                mesh_data = bpy.data.meshes.new(name + "_mesh")
-                mesh = bpy.data.objects.new(name, mesh_data)
-                bpy.context.collection.objects.link(mesh)
-                mesh.visual_type = str(visual_type)
-                frames.append(mesh)
-                self.frames_map[self.frame_index] = mesh
-                self.frame_index += 1
-                mesh.matrix_local = transform_mat
-                try: 
-                    mesh.cull_flags = culling_flags
-                    self.deserialize_object(f, materials, mesh, mesh_data, culling_flags)
-                except: 
-                    print(f"Warning: Could not parse geometry for visual type {visual_type}")
+                if visual_type in (VISUAL_SINGLEMORPH, VISUAL_MORPH) and data.get("morph"):
+                    self.deserialize_morph(mesh, data["morph"], verts_per_lod)
 
         elif frame_type == FRAME_SECTOR:
             mesh_data = bpy.data.meshes.new(name)
             mesh = bpy.data.objects.new(name, mesh_data)
-            bpy.context.collection.objects.link(mesh)
+            self.link_object(mesh)
             frames.append(mesh)
-            self.frames_map[self.frame_index] = mesh
-            self.frame_index += 1
+            self.frames_map[frame_index] = mesh
             mesh.matrix_local = transform_mat
-            self.deserialize_sector(f, mesh)
+            self.deserialize_sector(data, mesh)
 
         elif frame_type == FRAME_DUMMY:
             empty = bpy.data.objects.new(name, None)
-            bpy.context.collection.objects.link(empty)
+            self.link_object(empty)
             frames.append(empty)
-            self.frames_map[self.frame_index] = empty
-            self.frame_index += 1
-            self.deserialize_dummy(f, empty, pos, rot_tuple, scl)
+            self.frames_map[frame_index] = empty
+            self.deserialize_dummy(data, empty, pos, rot_tuple, scl)
             
         elif frame_type == FRAME_TARGET:
             empty = bpy.data.objects.new(name, None)
-            bpy.context.collection.objects.link(empty)
+            self.link_object(empty)
             frames.append(empty)
-            self.frames_map[self.frame_index] = empty
-            self.frame_index += 1
-            self.deserialize_target(f, empty, pos, rot_tuple, scl)
+            self.frames_map[frame_index] = empty
+            self.deserialize_target(data, empty, pos, rot_tuple, scl)
             
         elif frame_type == FRAME_OCCLUDER:
             mesh_data = bpy.data.meshes.new(name)
             mesh = bpy.data.objects.new(name, mesh_data)
-            bpy.context.collection.objects.link(mesh)
+            self.link_object(mesh)
             frames.append(mesh)
-            self.frames_map[self.frame_index] = mesh
-            self.frame_index += 1
-            self.deserialize_occluder(f, mesh, pos, rot_tuple, scl)
+            self.frames_map[frame_index] = mesh
+            mesh.matrix_local = transform_mat
+            self.deserialize_occluder(data, mesh)
             
         elif frame_type == FRAME_JOINT:
-            _ = f.read(64) 
-            bone_id = struct.unpack("<I", f.read(4))[0]
+            bone_id = data["bone_id"]
             if self.armature:
                 self.joints.append((name, transform_mat, parent_id, bone_id))
                 self.bone_nodes[bone_id] = name
-                self.bones_map[self.frame_index] = name
-                self.frames_map[self.frame_index] = name
-                self.frame_index += 1
+                self.bones_map[frame_index] = name
+                self.frames_map[frame_index] = name
         
         target_obj = mesh if mesh else empty
         if target_obj:
@@ -2384,75 +4518,1325 @@ class The4DSImporter:
                 
         return True
     
-    def deserialize_billboard(self, f, obj):
+    def deserialize_billboard(self, billboard, obj):
         # rotAxis (U32, 1-based), rotMode (U8, 1-based)
-        rot_axis = struct.unpack("<I", f.read(4))[0]
-        rot_mode = struct.unpack("<B", f.read(1))[0]
+        rot_axis, rot_mode = billboard
         
         # Map to 0-based Enum
         obj.rot_axis = str(max(0, rot_axis - 1))
         obj.rot_mode = str(max(0, rot_mode - 1))
 
-    def deserialize_mirror(self, f, obj):
+    def deserialize_occluder(self, data, mesh):
+        fill_mesh_data(mesh.data, data["vertices"], data["triangles"])
+        # The exporter recognises occluders by their wire display
+        mesh.display_type = "WIRE"
+        mesh.hide_render = True
+    
+    def deserialize_mirror(self, data, obj):
         # 1. Props
-        dmin = struct.unpack("<3f", f.read(12))
-        dmax = struct.unpack("<3f", f.read(12))
-        center = struct.unpack("<3f", f.read(12))
-        radius = struct.unpack("<f", f.read(4))[0]
-        
-        # Matrix (16 floats)
-        mat_floats = struct.unpack("<16f", f.read(64))
-        
-        # Color (3 floats)
-        rgb = struct.unpack("<3f", f.read(12))
-        obj.mirror_color = rgb
-        
-        dist = struct.unpack("<f", f.read(4))[0]
-        obj.mirror_dist = dist
+        obj.mirror_color = data["color"]
+        obj.mirror_dist = data["dist"]
+        obj.bbox_min = data["bbox_min"]
+        obj.bbox_max = data["bbox_max"]
         
         # 2. Mirror Mesh
         # It has its own geometry block inside the mirror struct
-        num_verts = struct.unpack("<I", f.read(4))[0]
-        num_faces = struct.unpack("<I", f.read(4))[0]
+        fill_mesh_data(obj.data, data["vertices"], data["triangles"])
+    
+class ProfileOptions:
+    """Profiling options shared by the import and export operators."""
+    profile: BoolProperty(name="Profile", default=False, description="Measure the time of each phase and show it in the report")
+    profile_trace: StringProperty(name="Trace File", subtype="FILE_PATH", default="", description="Write phase times and counters to this JSON file")
+    profile_cprofile: StringProperty(name="cProfile File", subtype="FILE_PATH", default="", description="Run under cProfile and dump the stats (.prof) to this file. Only the main thread is profiled")
+
+    def draw_profile(self, layout):
+        box = layout.box()
+        box.label(text="Profiling")
+        box.prop(self, "profile")
+        box.prop(self, "profile_trace")
+        box.prop(self, "profile_cprofile")
+
+    def begin_profile(self):
+        self.profiler = Profiler(enabled=self.profile or bool(self.profile_trace))
+        self.cprofile = None
+        if self.profile_cprofile:
+            self.cprofile = cProfile.Profile()
+            self.cprofile.enable()
+        return self.profiler
+
+    def end_profile(self, filepath, completed=True):
+        if self.cprofile:
+            self.cprofile.disable()
+            if completed:
+                self.cprofile.dump_stats(bpy.path.abspath(self.profile_cprofile))
+        if not (completed and self.profiler.enabled):
+            return
+        summary = self.profiler.summary()
+        log.info(f"Profile of {os.path.basename(filepath)}: {summary}")
+        self.report({"INFO"}, summary)
+        if self.profile_trace:
+            self.profiler.write_json(
+                bpy.path.abspath(self.profile_trace),
+                operator=self.bl_idname,
+                file=filepath,
+                blender=bpy.app.version_string,
+                date=datetime.now().isoformat(timespec="seconds"),
+            )
+
+# --- LOD GENERATION ---
+# Fills the {name}_lod{i} chain collect_lods picks up with decimated copies. The
+# Decimate and Data Transfer modifiers stay live, the exporter evaluates them.
+
+def lod_geometric_error(radius, triangles):
+    """
+    Estimated size of the detail lost by a LOD: the edge length of triangles of
+    equal area covering the bounding sphere.
+    """
+    return radius * math.sqrt(4.0 * math.pi / max(triangles, 1))
+
+def lod_fade_distance(error, pixel_error, screen_height, fov):
+    """Distance from which error projects to less than pixel_error pixels on screen."""
+    return error * screen_height / (2.0 * math.tan(fov / 2.0) * pixel_error)
+
+def evaluated_lod_stats(obj, depsgraph):
+    """Returns (bounding radius in world units, triangle count) of the evaluated object."""
+    eval_obj = obj.evaluated_get(depsgraph)
+    mesh = eval_obj.to_mesh()
+    try:
+        mesh.calc_loop_triangles()
+        triangles = len(mesh.loop_triangles)
+        corners = [Vector(corner) for corner in eval_obj.bound_box]
+        center = sum(corners, Vector()) / 8.0
+        radius = max((corner - center).length for corner in corners) * max(obj.matrix_world.to_scale())
+    finally:
+        eval_obj.to_mesh_clear()
+    return radius, triangles
+
+def generate_lod_chain(context, obj, levels, ratio, pixel_error, screen_height, fov):
+    """
+    Creates obj_lod1..obj_lod{levels} as hidden children of obj, each decimated
+    by ratio relative to the previous one, and sets the fade distances from the
+    target screen error. Returns the created objects.
+    """
+    created = []
+    collection = obj.users_collection[0] if obj.users_collection else context.scene.collection
+    for lod_idx in range(1, levels + 1):
+        lod = bpy.data.objects.new(f"{obj.name}_lod{lod_idx}", obj.data.copy())
+        lod.data.name = lod.name
+        lod.parent = obj
+        lod.matrix_local = Matrix.Identity(4)
+        for prop in ("visual_type", "render_flags", "render_flags2", "cull_flags"):
+            setattr(lod, prop, getattr(obj, prop))
+        if lod.data.shape_keys:
+            lod.shape_key_clear()
         
-        bm = bmesh.new()
-        vertices = []
-        for _ in range(num_verts):
-            p = struct.unpack("<3f", f.read(12))
-            vertices.append(bm.verts.new((p[0], p[2], p[1])))
-        bm.verts.ensure_lookup_table()
+        decimate = lod.modifiers.new(name="LOD Decimate", type="DECIMATE")
+        decimate.decimate_type = "COLLAPSE"
+        decimate.ratio = ratio ** lod_idx
+        decimate.use_collapse_triangulate = True
+        # UVs and material groups follow the collapsed faces, the normals come back from the source
+        transfer = lod.modifiers.new(name="LOD Normals", type="DATA_TRANSFER")
+        transfer.object = obj
+        transfer.use_object_transform = False
+        transfer.use_loop_data = True
+        transfer.data_types_loops = {"CUSTOM_NORMAL"}
+        transfer.loop_mapping = "POLYINTERP_NEAREST"
         
-        for _ in range(num_faces):
-            idxs = struct.unpack("<3H", f.read(6))
-            try: bm.faces.new([vertices[idxs[0]], vertices[idxs[2]], vertices[idxs[1]]])
-            except: pass
-            
-        bm.to_mesh(obj.data)
+        lod["ls3d_generated_lod"] = True
+        collection.objects.link(lod)
+        created.append(lod)
+    
+    depsgraph = context.evaluated_depsgraph_get()
+    for lod in created:
+        radius, triangles = evaluated_lod_stats(lod, depsgraph)
+        error = lod_geometric_error(radius, triangles)
+        lod.ls3d_lod_dist = lod_fade_distance(error, pixel_error, screen_height, fov)
+        lod.hide_set(True)
+        lod.hide_render = True
+    # LOD0 is visible from the camera on
+    obj.ls3d_lod_dist = 0.0
+    return created
+
+def remove_generated_lods(obj):
+    """Removes the LODs a previous generate_lod_chain created for obj. Returns False when obj has hand made LODs."""
+    lods = [bpy.data.objects.get(f"{obj.name}_lod{i}") for i in range(1, 10)]
+    lods = [lod for lod in lods if lod is not None]
+    if any(not lod.get("ls3d_generated_lod") for lod in lods):
+        return False
+    meshes = [lod.data for lod in lods]
+    bpy.data.batch_remove(lods)
+    bpy.data.batch_remove([mesh for mesh in meshes if not mesh.users])
+    return True
+
+class LODGenerationOptions:
+    """LOD generation settings shared by the generator operator and the exporter."""
+    lod_levels: IntProperty(name="Levels", default=3, min=1, max=9, description="Number of LODs generated after LOD0")
+    lod_ratio: FloatProperty(name="Ratio", default=0.5, min=0.01, max=0.99, description="Triangles kept by every LOD relative to the previous one")
+    lod_pixel_error: FloatProperty(name="Pixel Error", default=1.0, min=0.1, max=100.0, description="Screen space error in pixels at which the next LOD fades in")
+    lod_screen_height: IntProperty(name="Screen Height", default=768, min=120, description="Vertical resolution the distances are computed for")
+    lod_fov: FloatProperty(name="Field of View", default=math.radians(60.0), min=math.radians(10.0), max=math.radians(150.0), subtype="ANGLE", description="Vertical field of view of the game camera")
+
+    def draw_lod_options(self, layout):
+        col = layout.column(align=True)
+        col.prop(self, "lod_levels")
+        col.prop(self, "lod_ratio")
+        col.prop(self, "lod_pixel_error")
+        col.prop(self, "lod_screen_height")
+        col.prop(self, "lod_fov")
+
+    def generate_lods(self, context, objects, replace=True):
+        """Generates LOD chains for the visual frames among objects. Returns (created objects, skipped names)."""
+        created = []
+        skipped = []
+        for obj in objects:
+            if obj.type != "MESH" or "_lod" in obj.name or obj.display_type == "WIRE" or is_sector(obj) or is_portal(obj):
+                continue
+            if int(obj.visual_type) not in (VISUAL_OBJECT, VISUAL_LITOBJECT, VISUAL_BILLBOARD):
+                continue
+            if bpy.data.objects.get(f"{obj.name}_lod1"):
+                if not replace or not remove_generated_lods(obj):
+                    skipped.append(obj.name)
+                    continue
+            created += generate_lod_chain(context, obj, self.lod_levels, self.lod_ratio, self.lod_pixel_error,
+                                          self.lod_screen_height, self.lod_fov)
+        return created, skipped
+
+class LS3D_OT_GenerateLODs(bpy.types.Operator, LODGenerationOptions):
+    """Generate a decimated LOD chain with fade distances for the selected meshes"""
+    bl_idname = "object.ls3d_generate_lods"
+    bl_label = "Generate LODs"
+    bl_options = {'REGISTER', 'UNDO'}
+
+    def draw(self, context):
+        self.draw_lod_options(self.layout)
+
+    def execute(self, context):
+        objects = context.selected_objects or ([context.object] if context.object else [])
+        created, skipped = self.generate_lods(context, objects)
+        for name in skipped:
+            self.report({'WARNING'}, f"{name} already has hand made LODs, skipped")
+        self.report({'INFO'}, f"Generated {len(created)} LODs")
+        return {'FINISHED'}
+
+# --- OCCLUDER GENERATION ---
+# Occluders hide everything behind them, so they have to stay inside the geometry
+# they stand for. Generated ones are shrunk towards their centre by an inset.
+
+def farthest_points(points, count):
+    """Picks count points spreading over the set (farthest point sampling)."""
+    if len(points) <= count:
+        return points
+    first = int(np.argmax(((points - points.mean(axis=0)) ** 2).sum(axis=1)))
+    chosen = [first]
+    distance = ((points - points[first]) ** 2).sum(axis=1)
+    for _ in range(count - 1):
+        index = int(np.argmax(distance))
+        chosen.append(index)
+        distance = np.minimum(distance, ((points - points[index]) ** 2).sum(axis=1))
+    return points[chosen]
+
+def hull_mesh(mesh, points, max_triangles):
+    """Fills mesh with the triangulated convex hull of points, simplified to at most max_triangles."""
+    # A hull over n points has at most 2n - 4 triangles
+    count = max(4, max_triangles // 2 + 2)
+    while True:
+        bm = bmesh.new()
+        for p in farthest_points(points, count):
+            bm.verts.new(p)
+        result = bmesh.ops.convex_hull(bm, input=bm.verts)
+        bmesh.ops.delete(bm, geom=result["geom_interior"] + result["geom_unused"], context="VERTS")
+        bmesh.ops.triangulate(bm, faces=bm.faces)
+        if len(bm.faces) <= max_triangles or count <= 4:
+            break
         bm.free()
+        count -= 1
+    bm.to_mesh(mesh)
+    bm.free()
+
+BOX_TRIANGLES = np.array([
+    (0, 2, 1), (1, 2, 3), (4, 5, 6), (5, 7, 6), (0, 1, 4), (1, 5, 4),
+    (2, 6, 3), (3, 6, 7), (0, 4, 2), (2, 4, 6), (1, 3, 5), (3, 7, 5),
+], dtype=np.int32)
+
+def generate_occluder(context, obj, shape, inset, max_triangles):
+    """Creates a wire-display occluder object in the place of obj. Returns it."""
+    points = mesh_positions(obj.data)
+    center = (points.min(axis=0) + points.max(axis=0)) * 0.5
+    points = center + (points - center) * (1.0 - inset)
+    mesh = bpy.data.meshes.new(f"{obj.name}_occluder")
+    if shape == "BOX":
+        low, high = bounding_box(points)
+        corners = np.array([[(low, high)[(i >> axis) & 1][axis] for axis in range(3)] for i in range(8)])
+        fill_mesh_data(mesh, corners, BOX_TRIANGLES)
+    else:
+        hull_mesh(mesh, points, max_triangles)
+    occluder = bpy.data.objects.new(mesh.name, mesh)
+    occluder.parent = obj.parent
+    occluder.parent_type = obj.parent_type
+    occluder.parent_bone = obj.parent_bone
+    occluder.matrix_world = obj.matrix_world
+    occluder.display_type = "WIRE"
+    occluder.hide_render = True
+    collection = obj.users_collection[0] if obj.users_collection else context.scene.collection
+    collection.objects.link(occluder)
+    return occluder
+
+class LS3D_OT_GenerateOccluders(bpy.types.Operator):
+    """Generate simplified occluder frames for the selected meshes"""
+    bl_idname = "object.ls3d_generate_occluders"
+    bl_label = "Generate Occluders"
+    bl_options = {'REGISTER', 'UNDO'}
+
+    shape: EnumProperty(
+        name="Shape",
+        items=(
+            ("BOX", "Box", "Box along the object axes, 12 triangles"),
+            ("HULL", "Convex Hull", "Simplified convex hull within the triangle budget"),
+        ),
+        default="BOX",
+    )
+    inset: FloatProperty(name="Inset", default=0.05, min=0.0, max=0.5, subtype="FACTOR", description="Shrinks the occluder towards its centre so it stays inside concave geometry")
+    min_size: FloatProperty(name="Minimum Size", default=4.0, min=0.0, subtype="DISTANCE", description="Meshes whose smallest world dimension is below this get no occluder")
+    max_triangles: IntProperty(name="Triangle Budget", default=32, min=4, max=1024, description="Most triangles of a convex hull occluder")
+
+    def execute(self, context):
+        created = []
+        skipped = 0
+        for obj in context.selected_objects:
+            if obj.type != "MESH" or obj.display_type == "WIRE" or is_sector(obj) or is_portal(obj):
+                continue
+            if len(obj.data.vertices) < 4 or min(obj.dimensions) < self.min_size:
+                skipped += 1
+                continue
+            created.append(generate_occluder(context, obj, self.shape, self.inset, self.max_triangles))
+        for obj in context.selected_objects:
+            obj.select_set(False)
+        for obj in created:
+            obj.select_set(True)
+        self.report({'INFO'}, f"Generated {len(created)} occluders, {skipped} meshes below the minimum size")
+        return {'FINISHED'}
+
+# --- LOD PREVIEW ---
+# Shows one level of every {name}_lod{i} chain in the viewport, picked from the
+# distance between the view and the frame like the game does. Frame centres and
+# fade distances are cached per scene. Frames are binned into a grid; each cell
+# remembers where the view was when it was last evaluated and how far the view can
+# move from there before any of its frames crosses a fade distance, so a tick only
+# touches the cells the view actually moved far enough for.
+
+LOD_PREVIEW_INTERVAL = 0.1
+
+LOD_PREVIEW_CELL_SIZE = 50.0
+
+LOD_PREVIEW = {}
+
+class LODPreview:
+    def __init__(self, scene, cell_size=LOD_PREVIEW_CELL_SIZE):
+        objects = scene.objects
+        self.num_objects = len(objects)
+        self.chains = []
+        centers = []
+        dists = []
+        for obj in objects:
+            if obj.type != "MESH" or "_lod" in obj.name:
+                continue
+            lods = [obj] + [objects.get(f"{obj.name}_lod{i}") for i in range(1, 10)]
+            lods = [lod for lod in lods if lod is not None and lod.type == "MESH"]
+            if len(lods) < 2:
+                continue
+            corners = np.array([obj.matrix_world @ Vector(corner) for corner in obj.bound_box])
+            centers.append(corners.mean(axis=0))
+            dists.append([lod.ls3d_lod_dist for lod in lods[1:]])
+            self.chains.append(tuple(lod.name for lod in lods))
+        # Frame of every object in a chain, for invalidating single frames
+        self.frame_of = {name: frame for frame, chain in enumerate(self.chains) for name in chain}
+        
+        num_frames = len(self.chains)
+        self.centers = np.array(centers, dtype=np.float64).reshape(-1, 3)
+        # Fade-in distance of LOD1.. per frame, padded with inf
+        self.dists = np.full((num_frames, max((len(d) for d in dists), default=1)), np.inf)
+        for i, d in enumerate(dists):
+            self.dists[i, :len(d)] = d
+        self.levels = np.full(num_frames, -1, dtype=np.int64)
+        
+        keys = np.floor(self.centers / cell_size).astype(np.int64)
+        _, self.frame_cell = np.unique(keys, axis=0, return_inverse=True)
+        self.frame_cell = self.frame_cell.reshape(-1)
+        num_cells = int(self.frame_cell.max()) + 1 if num_frames else 0
+        order = np.argsort(self.frame_cell, kind="stable")
+        self.cells = np.split(order, np.cumsum(np.bincount(self.frame_cell, minlength=num_cells))[:-1])
+        self.cell_origin = np.full((num_cells, 3), np.nan)
+        self.cell_margin = np.zeros(num_cells)
+    
+    def pick_levels(self, frames, distance):
+        """Highest LOD whose fade-in distance was reached, LOD0 before any."""
+        reached = self.dists[frames] <= distance[:, None]
+        last = reached.shape[1] - np.argmax(reached[:, ::-1], axis=1)
+        return np.where(reached.any(axis=1), last, 0)
+    
+    def update(self, view):
+        """Re-evaluates the cells the view left the safe radius of. Returns the number of frames switched."""
+        travel = np.linalg.norm(self.cell_origin - view, axis=1)
+        stale = np.flatnonzero(~(travel < self.cell_margin))
+        if not stale.size:
+            return 0
+        frames = np.concatenate([self.cells[c] for c in stale])
+        distance = np.linalg.norm(self.centers[frames] - view, axis=1)
+        levels = self.pick_levels(frames, distance)
+        
+        # A frame keeps its level while the view moves less than its distance to the nearest fade distance
+        margin = np.abs(self.dists[frames] - distance[:, None]).min(axis=1)
+        cell_margin = np.full(len(self.cell_margin), np.inf)
+        np.minimum.at(cell_margin, self.frame_cell[frames], margin)
+        self.cell_margin[stale] = cell_margin[stale]
+        self.cell_origin[stale] = view
+        
+        changed = levels != self.levels[frames]
+        for frame, level in zip(frames[changed].tolist(), levels[changed].tolist()):
+            self.show(frame, level)
+        self.levels[frames] = levels
+        return int(changed.sum())
+    
+    def refresh(self, frame):
+        """Takes the new centre of a moved frame and re-evaluates its cell on the next update."""
+        obj = bpy.data.objects.get(self.chains[frame][0])
+        if obj is None:
+            return
+        corners = np.array([obj.matrix_world @ Vector(corner) for corner in obj.bound_box])
+        self.centers[frame] = corners.mean(axis=0)
+        self.cell_origin[self.frame_cell[frame]] = np.nan
+    
+    def show(self, frame, level):
+        for lod_idx, name in enumerate(self.chains[frame]):
+            obj = bpy.data.objects.get(name)
+            if obj is None:
+                continue
+            hidden = lod_idx != level
+            try:
+                if lod_idx > 0 and obj.hide_viewport:
+                    # LODs placed from the library are hidden on the object, move that to the view layer
+                    obj.hide_set(True)
+                    obj.hide_viewport = False
+                if obj.hide_get() != hidden:
+                    obj.hide_set(hidden)
+            except RuntimeError:
+                # Not in the active view layer
+                pass
     
-class Export4DS(bpy.types.Operator, ExportHelper):
+    def restore(self):
+        """Back to the import state: LOD0 shown, the rest hidden."""
+        for frame in range(len(self.chains)):
+            self.show(frame, 0)
+
+def preview_view_location(context, scene):
+    """Location of the first 3D viewport showing scene, else of the scene camera."""
+    for window in context.window_manager.windows:
+        if window.scene != scene:
+            continue
+        for area in window.screen.areas:
+            if area.type == 'VIEW_3D':
+                return np.array(area.spaces.active.region_3d.view_matrix.inverted().translation)
+    if scene.camera:
+        return np.array(scene.camera.matrix_world.translation)
+    return None
+
+def lod_preview_tick():
+    context = bpy.context
+    scene = context.scene
+    if not any(s.ls3d_lod_preview for s in bpy.data.scenes):
+        return None
+    if scene is None or not scene.ls3d_lod_preview:
+        return LOD_PREVIEW_INTERVAL
+    preview = LOD_PREVIEW.get(scene.name)
+    if preview is None or preview.num_objects != len(scene.objects):
+        # Rebuilt frames start from unknown levels, every chain gets set on the next update
+        preview = LOD_PREVIEW[scene.name] = LODPreview(scene)
+    view = preview_view_location(context, scene)
+    if view is not None:
+        preview.update(view)
+    return LOD_PREVIEW_INTERVAL
+
+def start_lod_preview():
+    if not bpy.app.timers.is_registered(lod_preview_tick):
+        bpy.app.timers.register(lod_preview_tick, first_interval=0.0)
+
+def invalidate_lod_preview(self, context):
+    LOD_PREVIEW.clear()
+
+def update_lod_preview(self, context):
+    if self.ls3d_lod_preview:
+        start_lod_preview()
+    else:
+        (LOD_PREVIEW.pop(self.name, None) or LODPreview(self)).restore()
+
+@bpy.app.handlers.persistent
+def lod_preview_depsgraph(scene, depsgraph):
+    preview = LOD_PREVIEW.get(scene.name)
+    if preview is None:
+        return
+    for update in depsgraph.updates:
+        # Visibility changes come through as plain object updates, only moved frames invalidate
+        if isinstance(update.id, bpy.types.Object) and (update.is_updated_transform or update.is_updated_geometry):
+            frame = preview.frame_of.get(update.id.name)
+            if frame is not None:
+                preview.refresh(frame)
+
+@bpy.app.handlers.persistent
+def lod_preview_load(*args):
+    LOD_PREVIEW.clear()
+    if any(scene.ls3d_lod_preview for scene in bpy.data.scenes):
+        start_lod_preview()
+
+class Export4DS(bpy.types.Operator, ExportHelper, ProfileOptions, LODGenerationOptions):
     bl_idname = "export_scene.4ds"
     bl_label = "Export 4DS"
     filename_ext = ".4ds"
-    filter_glob = StringProperty(default="*.4ds", options={"HIDDEN"})
+    filter_glob: StringProperty(default="*.4ds", options={"HIDDEN"})
+    optimize_vertex_cache: BoolProperty(name="Optimize Vertex Cache", default=False, description="Reorder triangles and vertices for the post-transform vertex cache of the game renderer")
+    build_atlas: BoolProperty(name="Texture Atlas", default=False, description="Pack the diffuse textures of materials that only differ in their texture into atlas BMPs in the maps folder and merge their face groups")
+    atlas_size: EnumProperty(
+        name="Atlas Size",
+        items=(("512", "512", ""), ("1024", "1024", ""), ("2048", "2048", "")),
+        default="1024",
+        description="Largest atlas texture",
+    )
+    static_batching: BoolProperty(name="Static Batching", default=False, description="Merge static visual frames with the same parent, flags and cell into combined frames")
+    batch_cell_size: FloatProperty(name="Batch Cell Size", default=50.0, min=1.0, subtype="DISTANCE", description="Edge of the grid cells merged frames are grouped by")
+    batch_exclude: StringProperty(name="Keep Frames", default="", description="Comma separated names or glob patterns of frames scripts refer to, never merged. Frames with string parameters are always kept")
+    keep_bounds: BoolProperty(name="Keep Stored Bounds", default=False, description="Write the bounding boxes stored on sectors, dummies and mirrors (e.g. from import) even where they could be computed from the geometry. Without geometry the stored boxes are always used")
+    generate_missing_lods: BoolProperty(name="Generate Missing LODs", default=False, description="Export a generated LOD chain for meshes without LODs. The scene is left unchanged")
+    package_textures: BoolProperty(name="Package Textures", default=False, description="Convert every referenced texture to a game BMP in the maps folder, palettized for color keyed materials. Unchanged textures are skipped")
+    texture_workers: IntProperty(name="Texture Workers", default=0, min=0, max=64, description="Processes converting textures in parallel. 0 uses all CPU cores")
+
+    # Seconds of serialization per UI update in interactive exports
+    TIME_SLICE = 0.05
+
     def execute(self, context):
         # Use selected objects if any, otherwise all objects in scene
-        objects = context.selected_objects if context.selected_objects else context.scene.objects
-        exporter = The4DSExporter(self.filepath, objects)
-        exporter.serialize_file()
+        objects = list(context.selected_objects if context.selected_objects else context.scene.objects)
+        self.temporary_lods = []
+        self.saved_lod_dists = {}
+        if self.generate_missing_lods:
+            self.saved_lod_dists = {obj.name: obj.ls3d_lod_dist for obj in objects if obj.type == "MESH"}
+            self.temporary_lods, _ = self.generate_lods(context, objects, replace=False)
+            objects += self.temporary_lods
+        exporter = The4DSExporter(self.filepath, objects, profiler=self.begin_profile(),
+                                  optimize_cache=self.optimize_vertex_cache,
+                                  atlas_size=int(self.atlas_size) if self.build_atlas else 0,
+                                  batch_cell_size=self.batch_cell_size if self.static_batching else 0.0,
+                                  batch_exclude=self.batch_exclude,
+                                  keep_bounds=self.keep_bounds,
+                                  package_textures=self.package_textures,
+                                  texture_workers=self.texture_workers)
+        if context.window and not bpy.app.background:
+            return self.start_modal(context, exporter)
+        try:
+            exporter.serialize_file()
+        except:
+            self.end_profile(self.filepath, completed=False)
+            raise
+        finally:
+            self.remove_temporary_lods()
+        self.end_profile(self.filepath)
+        self.report_export_stats(exporter)
         return {"FINISHED"}
-class Import4DS(bpy.types.Operator, ImportHelper):
+
+    def remove_temporary_lods(self):
+        if not self.temporary_lods:
+            return
+        meshes = [lod.data for lod in self.temporary_lods]
+        bpy.data.batch_remove(self.temporary_lods)
+        bpy.data.batch_remove(meshes)
+        for name, dist in self.saved_lod_dists.items():
+            obj = bpy.data.objects.get(name)
+            if obj:
+                obj.ls3d_lod_dist = dist
+        self.temporary_lods = []
+
+    def report_export_stats(self, exporter):
+        summary = exporter.cache_summary()
+        if summary:
+            log.info(f"Vertex cache: {summary}")
+            self.report({"INFO"}, f"Vertex cache: {summary}")
+        summary = exporter.batch_summary()
+        if summary:
+            log.info(f"Static batching: {summary}")
+            self.report({"INFO"}, f"Static batching: {summary}")
+        summary = exporter.atlas_summary()
+        if summary:
+            log.info(f"Texture atlas: {summary}")
+            self.report({"INFO"}, f"Texture atlas: {summary}")
+        summary = exporter.texture_summary()
+        if summary:
+            log.info(f"Textures: {summary}")
+            self.report({"WARNING"} if exporter.texture_stats[2] else {"INFO"}, f"Textures: {summary}")
+
+    def start_modal(self, context, exporter):
+        """
+        Serializes in time slices so the UI keeps redrawing. Other input is blocked
+        until the export ends, the scene and the temporary LODs must not change under
+        it. Esc cancels, leaving the target untouched.
+        """
+        self.exporter = exporter
+        self.steps = exporter.serialize_steps()
+        wm = context.window_manager
+        wm.progress_begin(0, 100)
+        self.timer = wm.event_timer_add(0.01, window=context.window)
+        wm.modal_handler_add(self)
+        return {"RUNNING_MODAL"}
+
+    def finish_modal(self, context):
+        wm = context.window_manager
+        wm.event_timer_remove(self.timer)
+        wm.progress_end()
+        context.workspace.status_text_set(None)
+        self.remove_temporary_lods()
+
+    def modal(self, context, event):
+        if event.type == "ESC":
+            self.steps.close() # Removes the temporary file
+            self.finish_modal(context)
+            self.end_profile(self.exporter.filepath, completed=False)
+            self.report({"WARNING"}, "Export cancelled")
+            return {"CANCELLED"}
+        if event.type != "TIMER":
+            return {"RUNNING_MODAL"}
+        
+        deadline = time.perf_counter() + self.TIME_SLICE
+        try:
+            while True:
+                phase, done, total = next(self.steps)
+                if time.perf_counter() >= deadline:
+                    break
+        except StopIteration:
+            self.finish_modal(context)
+            self.report({"INFO"}, f"Exported {os.path.basename(self.exporter.filepath)}")
+            self.end_profile(self.exporter.filepath)
+            self.report_export_stats(self.exporter)
+            return {"FINISHED"}
+        except Exception as e:
+            self.finish_modal(context)
+            self.end_profile(self.exporter.filepath, completed=False)
+            log.exception("Export failed")
+            self.report({"ERROR"}, f"Export failed: {e}")
+            return {"CANCELLED"}
+        # Materials are quick, the progress bar follows the frames and then the textures
+        context.window_manager.progress_update(int(done * 100 / total) if phase in ("Frames", "Textures") else 0)
+        name = os.path.basename(self.exporter.filepath)
+        context.workspace.status_text_set(f"Exporting {name}: {phase} {done}/{total} (Esc to cancel)")
+        return {"RUNNING_MODAL"}
+# --- MODEL LIBRARY ---
+# Models imported in "instance" or "linked" mode are built once per session into
+# a child collection of LIBRARY_COLLECTION, which is excluded from the view layer.
+# Later imports of the same file only place that data again.
+
+LIBRARY_COLLECTION = "4DS Library"
+
+# library key -> collection name
+MODEL_LIBRARY = {}
+
+def library_key(filepath, options, weld=False, baked_color_keys=False):
+    st = os.stat(filepath)
+    return json.dumps([
+        os.path.normcase(os.path.abspath(filepath)), st.st_size, st.st_mtime_ns,
+        options["lod0_only"], sorted(options["skip_frame_types"]), options["skip_portals"], options["name_filter"],
+        weld, baked_color_keys,
+    ])
+
+def find_layer_collection(layer_collection, collection):
+    if layer_collection.collection == collection:
+        return layer_collection
+    for child in layer_collection.children:
+        found = find_layer_collection(child, collection)
+        if found:
+            return found
+    return None
+
+def get_library_model(context, filepath, options, **importer_args):
+    """
+    Returns (collection, created) for filepath, importing it into the library on
+    the first use. Raises ValueError when the file can't be read.
+    """
+    key = library_key(filepath, options, importer_args.get("weld", False),
+                      importer_args.get("color_key_cache") is not None)
+    name = MODEL_LIBRARY.get(key)
+    collection = bpy.data.collections.get(name) if name else None
+    # The library only lives as long as the blend file it was built in
+    if collection and collection.get("ls3d_library_key") == key:
+        return collection, False
+    
+    root = bpy.data.collections.get(LIBRARY_COLLECTION)
+    if root is None:
+        root = bpy.data.collections.new(LIBRARY_COLLECTION)
+    if root.name not in context.scene.collection.children:
+        context.scene.collection.children.link(root)
+    collection = bpy.data.collections.new(os.path.splitext(os.path.basename(filepath))[0])
+    collection["ls3d_library_key"] = key
+    root.children.link(collection)
+    
+    # Built while visible, armature editing needs the objects in the view layer
+    importer = The4DSImporter(filepath, collection=collection, **options, **importer_args)
+    if not importer.import_file():
+        bpy.data.collections.remove(collection)
+        raise ValueError(f"Could not read {os.path.basename(filepath)}")
+    # Instances and excluded collections ignore the view layer hide state, the hidden LODs keep it on the object
+    for obj in collection.all_objects:
+        if obj.hide_get():
+            obj.hide_viewport = True
+    layer = find_layer_collection(context.view_layer.layer_collection, collection)
+    if layer:
+        layer.exclude = True
+    MODEL_LIBRARY[key] = collection.name
+    return collection, True
+
+def place_collection_instance(context, collection):
+    empty = bpy.data.objects.new(collection.name, None)
+    empty.instance_type = "COLLECTION"
+    empty.instance_collection = collection
+    empty.empty_display_size = 0.5
+    context.collection.objects.link(empty)
+    return [empty]
+
+def place_linked_duplicates(context, collection):
+    """
+    Copies the library objects, sharing their mesh, armature and material data.
+    LOD copies are renamed after the copy of their LOD0 so the chain still resolves.
+    """
+    originals = list(collection.all_objects)
+    copies = {obj: obj.copy() for obj in originals}
+    by_name = {obj.name: obj for obj in originals}
+    for original, copy in copies.items():
+        base_name, sep, level = original.name.rpartition("_lod")
+        if sep and level.isdigit() and base_name in by_name:
+            copy.name = f"{copies[by_name[base_name]].name}_lod{level}"
+    for original, copy in copies.items():
+        if original.parent in copies:
+            copy.parent = copies[original.parent]
+            copy.matrix_parent_inverse = original.matrix_parent_inverse.copy()
+        for modifier in copy.modifiers:
+            target = getattr(modifier, "object", None)
+            if target in copies:
+                modifier.object = copies[target]
+        for constraint in copy.constraints:
+            target = getattr(constraint, "target", None)
+            if target in copies:
+                constraint.target = copies[target]
+        context.collection.objects.link(copy)
+    return list(copies.values())
+
+# Data blocks an import can create, removed again when it is cancelled
+IMPORT_ID_COLLECTIONS = ("objects", "meshes", "armatures", "materials", "images", "collections")
+
+def snapshot_ids():
+    return {name: {id.as_pointer() for id in getattr(bpy.data, name)} for name in IMPORT_ID_COLLECTIONS}
+
+def remove_new_ids(snapshot):
+    """Removes every data block created since snapshot_ids() was taken."""
+    removed = 0
+    for name in IMPORT_ID_COLLECTIONS:
+        before = snapshot[name]
+        new_ids = [id for id in getattr(bpy.data, name) if id.as_pointer() not in before]
+        if new_ids:
+            bpy.data.batch_remove(new_ids)
+            removed += len(new_ids)
+    return removed
+
+class Import4DS(bpy.types.Operator, ImportHelper, ProfileOptions):
     bl_idname = "import_scene.4ds"
     bl_label = "Import 4DS"
     bl_options = {"REGISTER", "UNDO"}
     filename_ext = ".4ds"
-    filter_glob = StringProperty(default="*.4ds", options={"HIDDEN"})
+    filter_glob: StringProperty(default="*.4ds", options={"HIDDEN"})
+
+    # Multiple files / whole directories
+    files: CollectionProperty(type=bpy.types.OperatorFileListElement, options={"HIDDEN", "SKIP_SAVE"})
+    directory: StringProperty(subtype="DIR_PATH", options={"HIDDEN", "SKIP_SAVE"})
+    include_subfolders: BoolProperty(name="Include Subfolders", default=False, description="When importing a directory, also import the .4ds files of its subfolders")
+    batch_workers: IntProperty(name="Worker Processes", default=0, min=0, max=64, description="Processes decoding files in parallel when importing several files. 0 uses all CPU cores")
+
+    # Selective import
+    import_lods: BoolProperty(name="Import LODs", default=True, description="Create the higher detail levels as hidden _lod children. When disabled, only LOD0 is read")
+    import_sectors: BoolProperty(name="Sectors", default=True, description="Import sector frames")
+    import_portals: BoolProperty(name="Portals", default=True, description="Import the portals of imported sectors")
+    import_occluders: BoolProperty(name="Occluders", default=True, description="Import occluder frames")
+    import_dummies: BoolProperty(name="Dummies", default=True, description="Import dummy frames")
+    import_targets: BoolProperty(name="Targets", default=True, description="Import target frames")
+    name_filter: StringProperty(name="Frame Filter", default="", description="Only import frames matching one of these comma separated names or glob patterns (e.g. body, wheel_*). Empty imports everything")
+    decode_threads: IntProperty(name="Decode Threads", default=0, min=0, max=64, description="Threads decoding frame geometry in parallel. 0 uses all CPU cores, 1 decodes on the main thread")
+    weld_vertices: BoolProperty(name="Weld Vertices", default=False, description="Merge vertices split at normal and UV seams into connected topology. Custom normals and UVs are kept per face corner")
+    bake_color_keys: BoolProperty(name="Bake Color Keys", default=False, description="Load color keyed textures as cached RGBA images with the key color as alpha, for exact cutouts and simpler shaders")
+    log_level: EnumProperty(name="Log Level", items=LOG_LEVEL_ITEMS, default="INFO", description="Messages printed to the system console")
+    import_mode: EnumProperty(
+        name="Mode",
+        items=(
+            ("FULL", "Full Copy", "Create new meshes, materials and armatures on every import"),
+            ("INSTANCE", "Collection Instance", "Import each file once into a hidden library collection and place an instance of it"),
+            ("LINKED", "Linked Duplicates", "Import each file once into a hidden library collection and place objects sharing its data"),
+        ),
+        default="FULL",
+        description="How repeated imports of the same file are placed",
+    )
+    use_cache: BoolProperty(name="Use Model Cache", default=False, description="Keep decoded models on disk so unchanged files are not decoded again")
+    cache_size: IntProperty(name="Cache Size (MB)", default=1024, min=16, description="Least recently used models are removed above this size")
+
+    # Seconds of scene building per UI update in interactive imports
+    TIME_SLICE = 0.05
+
+    def draw(self, context):
+        layout = self.layout
+        layout.prop(self, "import_mode")
+        layout.prop(self, "import_lods")
+        layout.prop(self, "name_filter")
+        layout.prop(self, "weld_vertices")
+        layout.prop(self, "bake_color_keys")
+        layout.prop(self, "decode_threads")
+        layout.prop(self, "log_level")
+        row = layout.row()
+        row.prop(self, "use_cache")
+        row.prop(self, "cache_size", text="MB")
+        box = layout.box()
+        box.label(text="Frame Types")
+        grid = box.grid_flow(row_major=True, columns=2, even_columns=True, align=True)
+        grid.prop(self, "import_sectors")
+        grid.prop(self, "import_portals")
+        grid.prop(self, "import_occluders")
+        grid.prop(self, "import_dummies")
+        grid.prop(self, "import_targets")
+        box = layout.box()
+        box.label(text="Batch")
+        box.prop(self, "include_subfolders")
+        box.prop(self, "batch_workers")
+        self.draw_profile(layout)
+
+    def import_options(self):
+        skip_types = set()
+        if not self.import_sectors: skip_types.add(FRAME_SECTOR)
+        if not self.import_occluders: skip_types.add(FRAME_OCCLUDER)
+        if not self.import_dummies: skip_types.add(FRAME_DUMMY)
+        if not self.import_targets: skip_types.add(FRAME_TARGET)
+        return {
+            "lod0_only": not self.import_lods,
+            "skip_frame_types": skip_types,
+            "skip_portals": not self.import_portals,
+            "name_filter": self.name_filter,
+        }
+
+    def collect_filepaths(self):
+        directory = self.directory or os.path.dirname(self.filepath)
+        names = [f.name for f in self.files if f.name]
+        if names:
+            paths = [os.path.join(directory, name) for name in names]
+        elif self.filepath and os.path.isfile(self.filepath):
+            paths = [self.filepath]
+        else:
+            # Nothing selected: import the whole directory
+            paths = [directory]
+        return collect_4ds_files(paths, recursive=self.include_subfolders)
+
     def execute(self, context):
-        importer = The4DSImporter(self.filepath)
-        importer.import_file()
+        filepaths = self.collect_filepaths()
+        if not filepaths:
+            self.report({"ERROR"}, "No .4ds files found")
+            return {"CANCELLED"}
+        
+        configure_logging(self.log_level)
+        options = self.import_options()
+        profiler = self.begin_profile()
+        cache = ModelCache(default_cache_dir(), self.cache_size << 20) if self.use_cache else None
+        color_key_cache = ColorKeyCache(color_key_cache_dir()) if self.bake_color_keys else None
+        if self.import_mode != "FULL":
+            return self.import_from_library(context, filepaths, options, profiler, cache, color_key_cache)
+        if len(filepaths) == 1:
+            importer = The4DSImporter(filepaths[0], threads=self.decode_threads, profiler=profiler, cache=cache,
+                                      weld=self.weld_vertices, color_key_cache=color_key_cache, **options)
+            if context.window and not bpy.app.background:
+                return self.start_modal(context, importer)
+            importer.import_file()
+            self.end_profile(filepaths[0])
+            return {"FINISHED"}
+        
+        batch = The4DSBatchImporter(filepaths, workers=self.batch_workers, profiler=profiler, cache=cache,
+                                    weld=self.weld_vertices, color_key_cache=color_key_cache, **options)
+        imported, errors = batch.run(context)
+        self.end_profile(self.directory or filepaths[0])
+        if errors:
+            for path, error in errors:
+                self.report({"WARNING"}, f"{os.path.basename(path)}: {error}")
+            self.report({"WARNING"}, f"Imported {len(imported)} of {len(filepaths)} files, {len(errors)} failed")
+        else:
+            self.report({"INFO"}, f"Imported {len(imported)} files")
+        return {"FINISHED"}
+
+    def import_from_library(self, context, filepaths, options, profiler, cache, color_key_cache):
+        place = place_collection_instance if self.import_mode == "INSTANCE" else place_linked_duplicates
+        built = 0
+        placed = []
+        failed = 0
+        for filepath in filepaths:
+            try:
+                collection, created = get_library_model(
+                    context, filepath, options, threads=self.decode_threads, profiler=profiler, cache=cache,
+                    weld=self.weld_vertices, color_key_cache=color_key_cache)
+            except (OSError, ValueError) as e:
+                self.report({"WARNING"}, str(e))
+                failed += 1
+                continue
+            built += created
+            placed += place(context, collection)
+        for obj in context.selected_objects:
+            obj.select_set(False)
+        for obj in placed:
+            if obj.visible_get():
+                obj.select_set(True)
+        if placed:
+            context.view_layer.objects.active = placed[0]
+        self.end_profile(filepaths[0])
+        self.report({"INFO"}, f"Placed {len(filepaths) - failed} models, {built} newly imported")
         return {"FINISHED"}
+
+    def start_modal(self, context, importer):
+        """Decodes in a background thread, then builds the scene in time slices. Esc cancels."""
+        self.importer = importer
+        self.model = None
+        self.parse_error = None
+        self.steps = None
+        self.id_snapshot = snapshot_ids()
+        self.thread = threading.Thread(target=self.parse_in_background, daemon=True)
+        self.thread.start()
+        wm = context.window_manager
+        wm.progress_begin(0, 100)
+        self.timer = wm.event_timer_add(0.01, window=context.window)
+        wm.modal_handler_add(self)
+        self.set_status(context, "Reading")
+        return {"RUNNING_MODAL"}
+
+    def parse_in_background(self):
+        try:
+            self.model = self.importer.parse_model()
+        except (OSError, ValueError) as e:
+            self.parse_error = str(e)
+
+    def set_status(self, context, text):
+        name = os.path.basename(self.importer.filepath)
+        context.workspace.status_text_set(f"Importing {name}: {text} (Esc to cancel)" if text else None)
+
+    def finish_modal(self, context):
+        wm = context.window_manager
+        wm.event_timer_remove(self.timer)
+        wm.progress_end()
+        self.set_status(context, None)
+
+    def modal(self, context, event):
+        if event.type == "ESC":
+            self.finish_modal(context)
+            # The decode thread can't be interrupted, its result is dropped when it ends
+            removed = remove_new_ids(self.id_snapshot)
+            self.end_profile(self.importer.filepath, completed=False)
+            log.info(f"Import cancelled, removed {removed} data blocks")
+            self.report({"WARNING"}, "Import cancelled")
+            return {"CANCELLED"}
+        if event.type != "TIMER":
+            return {"RUNNING_MODAL"}
+        
+        if self.steps is None:
+            if self.thread.is_alive():
+                return {"RUNNING_MODAL"}
+            if self.parse_error:
+                self.finish_modal(context)
+                self.end_profile(self.importer.filepath, completed=False)
+                log.error(f"Failed to read {self.importer.filepath}: {self.parse_error}")
+                self.report({"ERROR"}, self.parse_error)
+                return {"CANCELLED"}
+            self.steps = self.importer.build_steps(self.model)
+        
+        deadline = time.perf_counter() + self.TIME_SLICE
+        try:
+            while True:
+                done, total = next(self.steps)
+                if time.perf_counter() >= deadline:
+                    break
+        except StopIteration:
+            self.finish_modal(context)
+            self.report({"INFO"}, f"Imported {os.path.basename(self.importer.filepath)}")
+            self.end_profile(self.importer.filepath)
+            return {"FINISHED"}
+        except Exception as e:
+            self.finish_modal(context)
+            self.end_profile(self.importer.filepath, completed=False)
+            remove_new_ids(self.id_snapshot)
+            log.exception("Import failed")
+            self.report({"ERROR"}, f"Import failed: {e}")
+            return {"CANCELLED"}
+        context.window_manager.progress_update(int(done * 100 / total))
+        self.set_status(context, f"{done}/{total}")
+        return {"RUNNING_MODAL"}
+# --- 5DS ANIMATION ---
+# A .5ds file animates frames of a .4ds model by name: per frame a track with
+# optional rotation, position and scale keys, each with its own key frame numbers.
+# Keys are decoded straight into arrays and written with foreach_set, so an
+# action costs a few numpy operations per track instead of one call per key.
+
+ANIM_MAGIC = b"5DS\0"
+ANIM_VERSION = 20
+# Name and data pointers count from the end of the header
+ANIM_DATA_OFFSET = 18
+
+ANIM_POSITION = 0x2
+ANIM_ROTATION = 0x4
+ANIM_SCALE = 0x8
+
+def read_anim_keys(r, width):
+    """Returns (frames, values) of one key block, values as (n, width) float32."""
+    count = r.read("<H")
+    frames = r.array("<u2", count).astype(np.float64)
+    # Counts and frame numbers are padded to 4 bytes
+    if count % 2 == 0:
+        r.skip(2)
+    values = r.array("<f4", count * width).reshape(count, width).astype(np.float64)
+    return frames, values
+
+def parse_5ds_file(filepath):
+    """
+    Decodes a .5ds file into {"num_frames", "tracks"}. Every track holds the
+    frame "name" and (frames, values) per present channel: "rotation" as w, x, y, z
+    quaternions, "position" and "scale", all converted to Blender axes like the
+    frames of the .4ds reader. Raises ValueError for files that aren't 5DS.
+    """
+    with open(filepath, "rb") as f:
+        buf = f.read()
+    r = BufferReader(buf)
+    if len(buf) < ANIM_DATA_OFFSET + 4 or r.unpack("<4s")[0] != ANIM_MAGIC:
+        raise ValueError("not a 5DS file")
+    version = r.read("<H")
+    if version != ANIM_VERSION:
+        raise ValueError(f"unsupported 5DS version {version}")
+    r.pos = ANIM_DATA_OFFSET
+    num_tracks, num_frames = r.unpack("<2H")
+    pointers = [r.unpack("<2I") for _ in range(num_tracks)]
+    
+    tracks = []
+    for name_offset, data_offset in pointers:
+        start = ANIM_DATA_OFFSET + name_offset
+        end = buf.find(b"\0", start)
+        name = buf[start:end if end >= 0 else len(buf)].decode("windows-1250", errors="replace")
+        r.pos = ANIM_DATA_OFFSET + data_offset
+        flags = r.read("<I")
+        track = {"name": name}
+        if flags & ANIM_ROTATION:
+            frames, values = read_anim_keys(r, 4)
+            track["rotation"] = (frames, values[:, [0, 1, 3, 2]])
+        if flags & ANIM_POSITION:
+            frames, values = read_anim_keys(r, 3)
+            track["position"] = (frames, values[:, [0, 2, 1]])
+        if flags & ANIM_SCALE:
+            frames, values = read_anim_keys(r, 3)
+            track["scale"] = (frames, values[:, [0, 2, 1]])
+        if flags & ~(ANIM_ROTATION | ANIM_POSITION | ANIM_SCALE):
+            log.debug(f"Track {name}: ignoring unknown flags {flags:#x}")
+        tracks.append(track)
+    return {"num_frames": num_frames, "tracks": tracks}
+
+def sample_keys(frames, values, times):
+    """Linear interpolation of (n, k) values keyed at frames, held past both ends."""
+    return np.stack([np.interp(times, frames, values[:, i]) for i in range(values.shape[1])], axis=1)
+
+def quaternion_continuity(quats):
+    """Flips quaternions into the hemisphere of their predecessor so F-curves don't take the long way."""
+    if len(quats) < 2:
+        return quats
+    dots = (quats[1:] * quats[:-1]).sum(axis=1)
+    signs = np.concatenate([[1.0], np.cumprod(np.where(dots < 0.0, -1.0, 1.0))])
+    return quats * signs[:, None]
+
+def sample_rotations(frames, quats, times):
+    """Normalized linear interpolation of quaternions keyed at frames."""
+    quats = quaternion_continuity(quats / np.linalg.norm(quats, axis=1, keepdims=True))
+    return normalize_rows(sample_keys(frames, quats, times))
+
+def normalize_rows(values):
+    return values / np.maximum(np.linalg.norm(values, axis=1, keepdims=True), 1e-12)
+
+def quaternion_matrices(quats):
+    """(n, 4) w, x, y, z unit quaternions to (n, 3, 3) rotation matrices."""
+    w, x, y, z = quats.T
+    return np.stack([
+        1 - 2 * (y * y + z * z), 2 * (x * y - w * z), 2 * (x * z + w * y),
+        2 * (x * y + w * z), 1 - 2 * (x * x + z * z), 2 * (y * z - w * x),
+        2 * (x * z - w * y), 2 * (y * z + w * x), 1 - 2 * (x * x + y * y),
+    ], axis=1).reshape(-1, 3, 3)
+
+def matrix_quaternions(rotations):
+    """(n, 3, 3) rotation matrices to (n, 4) w, x, y, z quaternions."""
+    m = rotations
+    quats = np.empty((len(m), 4))
+    diagonal = np.stack([m[:, 0, 0] + m[:, 1, 1] + m[:, 2, 2], m[:, 0, 0], m[:, 1, 1], m[:, 2, 2]], axis=1)
+    case = np.argmax(diagonal, axis=1)
+    # Each case divides by its largest component for stability
+    for c, (i, j, k) in enumerate(((None, None, None), (0, 1, 2), (1, 2, 0), (2, 0, 1))):
+        sel = case == c
+        if not sel.any():
+            continue
+        n = m[sel]
+        if c == 0:
+            s = np.sqrt(np.maximum(1.0 + diagonal[sel, 0], 1e-12)) * 2.0
+            quats[sel] = np.stack([0.25 * s, (n[:, 2, 1] - n[:, 1, 2]) / s, (n[:, 0, 2] - n[:, 2, 0]) / s, (n[:, 1, 0] - n[:, 0, 1]) / s], axis=1)
+        else:
+            s = np.sqrt(np.maximum(1.0 + n[:, i, i] - n[:, j, j] - n[:, k, k], 1e-12)) * 2.0
+            q = np.empty((len(n), 4))
+            q[:, 0] = (n[:, k, j] - n[:, j, k]) / s
+            q[:, 1 + i] = 0.25 * s
+            q[:, 1 + j] = (n[:, j, i] + n[:, i, j]) / s
+            q[:, 1 + k] = (n[:, k, i] + n[:, i, k]) / s
+            quats[sel] = q
+    return quats
+
+def compose_matrices(positions, quats, scales):
+    """Per key T @ R @ S as (n, 4, 4) matrices."""
+    matrices = np.zeros((len(positions), 4, 4))
+    matrices[:, :3, :3] = quaternion_matrices(quats) * scales[:, None, :]
+    matrices[:, :3, 3] = positions
+    matrices[:, 3, 3] = 1.0
+    return matrices
+
+def decompose_matrices(matrices):
+    """(n, 4, 4) matrices to (positions, quaternions, scales)."""
+    upper = matrices[:, :3, :3]
+    scales = np.linalg.norm(upper, axis=1)
+    # A mirrored basis keeps a proper rotation with a negative x scale
+    scales[:, 0] *= np.where(np.linalg.det(upper) < 0.0, -1.0, 1.0)
+    rotations = upper / np.where(np.abs(scales) > 1e-12, scales, 1.0)[:, None, :]
+    return matrices[:, :3, 3].copy(), quaternion_continuity(matrix_quaternions(rotations)), scales
+
+class AnimTarget:
+    """
+    Where a track goes: an object, or a pose bone of an armature object. The
+    channels of the track give the local file transform L of the frame; the
+    keyed basis is pre @ L @ post.
+    """
+    __slots__ = ("obj", "bone", "pre", "post", "rest")
+
+    def __init__(self, obj, bone=None, pre=None, post=None, rest=None):
+        self.obj = obj
+        self.bone = bone
+        self.pre = np.eye(4) if pre is None else pre
+        self.post = np.eye(4) if post is None else post
+        # (position, quaternion, scale) of L in the rest pose, for absent channels
+        self.rest = rest
+
+    def data_path(self, prop):
+        if self.bone is None:
+            return prop
+        return f'pose.bones["{bpy.utils.escape_identifier(self.bone)}"].{prop}'
+
+def bone_file_matrix(bone):
+    """Armature space matrix of the file frame of a bone, stored by the importer."""
+    if bone is None or bone.parent is None:
+        # The base bone stands for the model root
+        return Matrix.Identity(4)
+    stored = bone.get("ls3d_file_matrix")
+    if stored is not None:
+        return Matrix([stored[i:i + 4] for i in range(0, 16, 4)])
+    return bone.matrix_local.copy()
+
+def rest_channels(matrix):
+    loc, rot, scale = matrix.decompose()
+    return np.array(loc), np.array(rot), np.array(scale)
+
+def collect_anim_targets(objects):
+    """
+    Frame name -> AnimTarget for the given objects and the bones of their armatures.
+    Objects renamed with a numeric suffix by a repeated import also answer to their
+    frame name.
+    """
+    targets = {}
+    aliases = {}
+    for obj in objects:
+        if obj.type == "ARMATURE":
+            for bone in obj.data.bones:
+                if bone.parent is None:
+                    continue # Base bone
+                world = bone_file_matrix(bone)
+                local = bone_file_matrix(bone.parent).inverted_safe() @ world
+                # The bone axes differ from the file frame where the importer aimed the bone at its children
+                offset = world.inverted_safe() @ bone.matrix_local
+                pre = offset.inverted_safe() @ local.inverted_safe()
+                targets.setdefault(bone.name, AnimTarget(obj, bone.name, np.array(pre), np.array(offset), rest_channels(local)))
+        basis = obj.matrix_basis
+        pre = None
+        if obj.parent_type == "BONE" and obj.parent and obj.parent_bone in getattr(obj.parent.data, "bones", ()):
+            # Bone children keep the armature and bone head offset in their basis (see parent_to_bone)
+            head = obj.parent.data.bones[obj.parent_bone].matrix_local.to_translation()
+            pre = object_world_matrix(obj.parent) @ Matrix.Translation(head)
+            basis = pre.inverted_safe() @ basis
+            pre = np.array(pre)
+        target = AnimTarget(obj, None, pre, None, rest_channels(basis))
+        targets.setdefault(obj.name, target)
+        base, _, suffix = obj.name.rpartition(".")
+        if base and suffix.isdigit():
+            aliases.setdefault(base, target)
+    for name, target in aliases.items():
+        targets.setdefault(name, target)
+    return targets
+
+def ensure_channelbag(action, obj):
+    """New slot of obj in a layered action and its channelbag in the keyframe strip."""
+    slot = action.slots.new(id_type="OBJECT", name=obj.name)
+    layer = action.layers[0] if action.layers else action.layers.new("Layer")
+    strip = layer.strips[0] if layer.strips else layer.strips.new(type="KEYFRAME")
+    return slot, strip.channelbag(slot, ensure=True)
+
+def add_fcurves(channelbag, group_name, data_path, times, values):
+    """One F-curve per column of values, keys filled with foreach_set."""
+    group = channelbag.groups.get(group_name) or channelbag.groups.new(group_name)
+    coords = np.empty((len(times), 2), dtype=np.float32)
+    coords[:, 0] = times
+    interpolation = np.full(len(times), 1, dtype=np.int32) # LINEAR
+    for index in range(values.shape[1]):
+        fcurve = channelbag.fcurves.new(data_path, index=index)
+        fcurve.group = group
+        coords[:, 1] = values[:, index]
+        fcurve.keyframe_points.add(len(times))
+        fcurve.keyframe_points.foreach_set("co", coords.ravel())
+        fcurve.keyframe_points.foreach_set("interpolation", interpolation)
+        fcurve.update()
+
+class The5DSImporter:
+    """
+    Builds one layered action per .5ds file, with a slot for every animated
+    object (bones are animated through their armature object). Key frames are
+    the file's frame numbers.
+    """
+    def __init__(self, objects, profiler=None):
+        self.profiler = profiler or Profiler(enabled=False)
+        self.targets = collect_anim_targets(objects)
+        self.missing = set()
+
+    @profiled("animation")
+    def build_action(self, filepath, anim):
+        action = bpy.data.actions.new(os.path.splitext(os.path.basename(filepath))[0])
+        action.use_fake_user = True
+        channelbags = {}
+        animated = set()
+        for track in anim["tracks"]:
+            target = self.targets.get(track["name"])
+            if target is None:
+                self.missing.add(track["name"])
+                continue
+            channels = [track.get(key) for key in ("position", "rotation", "scale")]
+            present = [c for c in channels if c is not None]
+            if not present:
+                continue
+            times = np.unique(np.concatenate([frames for frames, _ in present]))
+            rest_position, rest_rotation, rest_scale = target.rest
+            positions = sample_keys(*channels[0], times) if channels[0] else np.tile(rest_position, (len(times), 1))
+            rotations = sample_rotations(*channels[1], times) if channels[1] else np.tile(rest_rotation, (len(times), 1))
+            scales = sample_keys(*channels[2], times) if channels[2] else np.tile(rest_scale, (len(times), 1))
+            positions, rotations, scales = decompose_matrices(target.pre @ compose_matrices(positions, rotations, scales) @ target.post)
+            
+            if target.obj not in channelbags:
+                channelbags[target.obj] = ensure_channelbag(action, target.obj)
+            _, channelbag = channelbags[target.obj]
+            group = target.bone or target.obj.name
+            for (channel, prop, values) in ((channels[0], "location", positions),
+                                            (channels[1], "rotation_quaternion", rotations),
+                                            (channels[2], "scale", scales)):
+                # Bone axis offsets can carry one channel into another
+                if channel is not None or np.ptp(values, axis=0).max() > 1e-5:
+                    add_fcurves(channelbag, group, target.data_path(prop), times, values)
+            animated.add((target.obj, target.bone))
+        
+        action.use_frame_range = True
+        action.frame_start = 0
+        action.frame_end = max(anim["num_frames"] - 1, 1)
+        self.profiler.count("animated frames", len(animated))
+        return action, {obj: slot for obj, (slot, _) in channelbags.items()}
+
+    def assign(self, action, slots):
+        for obj, slot in slots.items():
+            anim_data = obj.animation_data or obj.animation_data_create()
+            anim_data.action = action
+            anim_data.action_slot = slot
+            if obj.type != "ARMATURE" and obj.rotation_mode != "QUATERNION":
+                rotation = obj.matrix_basis.to_quaternion()
+                obj.rotation_mode = "QUATERNION"
+                obj.rotation_quaternion = rotation
+
+    def import_files(self, filepaths):
+        """Returns (actions, errors). The last action read is assigned."""
+        actions = []
+        errors = []
+        last = None
+        for filepath in filepaths:
+            try:
+                with self.profiler.phase("decode"):
+                    anim = parse_5ds_file(filepath)
+                action, slots = self.build_action(filepath, anim)
+            except (OSError, ValueError, struct.error) as e:
+                errors.append((filepath, str(e)))
+                log.error(f"{filepath}: {e}")
+                continue
+            actions.append(action)
+            last = (action, slots)
+        if last:
+            self.assign(*last)
+        if self.missing:
+            log.warning(f"No frame or bone for tracks: {', '.join(sorted(self.missing))}")
+        return actions, errors
+
+class Import5DS(bpy.types.Operator, ImportHelper, ProfileOptions):
+    """Import .5ds animations onto the frames and bones of an imported model"""
+    bl_idname = "import_anim.5ds"
+    bl_label = "Import 5DS"
+    bl_options = {"REGISTER", "UNDO"}
+    filename_ext = ".5ds"
+    filter_glob: StringProperty(default="*.5ds", options={"HIDDEN"})
+    files: CollectionProperty(type=bpy.types.OperatorFileListElement, options={"HIDDEN", "SKIP_SAVE"})
+    directory: StringProperty(subtype="DIR_PATH", options={"HIDDEN", "SKIP_SAVE"})
+    scope: EnumProperty(
+        name="Animate",
+        items=(
+            ("HIERARCHY", "Active Model", "The hierarchy of the active object"),
+            ("SCENE", "Scene", "Every object in the scene"),
+        ),
+        default="HIERARCHY",
+        description="Objects whose frames and bones the tracks are matched to by name",
+    )
+
+    def draw(self, context):
+        self.layout.prop(self, "scope")
+        self.draw_profile(self.layout)
+
+    def execute(self, context):
+        directory = self.directory or os.path.dirname(self.filepath)
+        names = sorted(f.name for f in self.files if f.name)
+        filepaths = [os.path.join(directory, name) for name in names] if names else [self.filepath]
+        
+        root = context.active_object
+        if self.scope == "HIERARCHY" and root:
+            while root.parent:
+                root = root.parent
+            objects = [root] + list(root.children_recursive)
+        else:
+            objects = list(context.scene.objects)
+        
+        profiler = self.begin_profile()
+        importer = The5DSImporter(objects, profiler=profiler)
+        actions, errors = importer.import_files(filepaths)
+        self.end_profile(filepaths[0])
+        for path, error in errors:
+            self.report({"WARNING"}, f"{os.path.basename(path)}: {error}")
+        if not actions:
+            self.report({"ERROR"}, "No animation imported")
+            return {"CANCELLED"}
+        summary = f"Imported {len(actions)} animations, {actions[-1].name} assigned"
+        if importer.missing:
+            summary += f", {len(importer.missing)} tracks without a frame"
+        self.report({"INFO"}, summary)
+        return {"FINISHED"}
+
 def menu_func_import(self, context):
     self.layout.operator(Import4DS.bl_idname, text="4DS Model File (.4ds)")
+    self.layout.operator(Import5DS.bl_idname, text="5DS Animation (.5ds)")
 
 def menu_func_export(self, context):
     self.layout.operator(Export4DS.bl_idname, text="4DS Model File (.4ds)")
@@ -2563,13 +5947,25 @@ def unregister():
     del bpy.types.Object.mirror_dist
     del bpy.types.Object.bbox_min
     del bpy.types.Object.bbox_max
+    del bpy.types.Scene.ls3d_lod_preview
+
+    if bpy.app.timers.is_registered(lod_preview_tick):
+        bpy.app.timers.unregister(lod_preview_tick)
+    if lod_preview_depsgraph in bpy.app.handlers.depsgraph_update_post:
+        bpy.app.handlers.depsgraph_update_post.remove(lod_preview_depsgraph)
+    if lod_preview_load in bpy.app.handlers.load_post:
+        bpy.app.handlers.load_post.remove(lod_preview_load)
+    LOD_PREVIEW.clear()
 
     # 3. Unregister Classes
     bpy.utils.unregister_class(LS3D_OT_AddEnvSetup)
     bpy.utils.unregister_class(LS3D_OT_AddNode)
     bpy.utils.unregister_class(The4DSPanelMaterial)
     bpy.utils.unregister_class(The4DSPanel)
+    bpy.utils.unregister_class(LS3D_OT_GenerateLODs)
+    bpy.utils.unregister_class(LS3D_OT_GenerateOccluders)
     bpy.utils.unregister_class(Import4DS)
+    bpy.utils.unregister_class(Import5DS)
     bpy.utils.unregister_class(Export4DS)
 
 
@@ -2625,7 +6021,7 @@ def register():
 
     # --- OTHER PARAMS ---
     bpy.types.Object.ls3d_user_props = StringProperty(name="String Parameters", description="Frame properties")
-    bpy.types.Object.ls3d_lod_dist = FloatProperty(name="Fade-in Distance", default=100.0, description="Distance at which this LOD becomes visible")
+    bpy.types.Object.ls3d_lod_dist = FloatProperty(name="Fade-in Distance", default=100.0, description="Distance at which this LOD becomes visible", update=invalidate_lod_preview)
     
     # Portal/Sector
     bpy.types.Object.ls3d_portal_flags = IntProperty(name="Flags", default=4)
@@ -2644,6 +6040,7 @@ def register():
     bpy.types.Object.mirror_dist = FloatProperty(default=100.0, name="Mirror Distance", description="Distance of how far the Mirror will mirror objects")
     bpy.types.Object.bbox_min = FloatVectorProperty(subtype='XYZ')
     bpy.types.Object.bbox_max = FloatVectorProperty(subtype='XYZ')
+    bpy.types.Scene.ls3d_lod_preview = BoolProperty(name="Preview LODs by Distance", default=False, update=update_lod_preview, description="Show only the LOD of each frame the game would draw at the viewport distance")
 
     # --- MATERIAL PROPS ---
     
@@ -2695,7 +6092,10 @@ def register():
     bpy.utils.register_class(LS3D_OT_AddNode)
     bpy.utils.register_class(The4DSPanelMaterial)
     bpy.utils.register_class(The4DSPanel)
+    bpy.utils.register_class(LS3D_OT_GenerateLODs)
+    bpy.utils.register_class(LS3D_OT_GenerateOccluders)
     bpy.utils.register_class(Import4DS)
+    bpy.utils.register_class(Import5DS)
     bpy.utils.register_class(Export4DS)
     
     try:
@@ -2705,5 +6105,1035 @@ def register():
     bpy.types.TOPBAR_MT_file_import.append(menu_func_import)
     bpy.types.TOPBAR_MT_file_export.append(menu_func_export)
     
+    bpy.app.handlers.depsgraph_update_post.append(lod_preview_depsgraph)
+    bpy.app.handlers.load_post.append(lod_preview_load)
+    
+# --- BENCHMARK ---
+# Synthetic but valid Mafia (v29) files, written straight from numpy arrays so
+# that multi-million vertex models take a fraction of a second to generate.
+
+class SyntheticWriter:
+    """Small binary writer for synthetic 4DS files (file space, Y up)."""
+    def __init__(self):
+        self.chunks = []
+        self.size = 0
+
+    def pack(self, fmt, *values):
+        self.write(get_struct(fmt).pack(*values))
+
+    def write(self, data):
+        self.chunks.append(data)
+        self.size += len(data)
+
+    def string(self, text):
+        encoded = text.encode("windows-1250")
+        self.pack("<B", len(encoded))
+        self.write(encoded)
+
+    def frame_header(self, frame_type, parent_id, name, visual_type=0, position=(0.0, 0.0, 0.0)):
+        self.pack("<B", frame_type)
+        if frame_type == FRAME_VISUAL:
+            self.pack("<3B", visual_type, 128, 42)
+        self.pack("<H", parent_id)
+        self.pack("<3f", *position)
+        self.pack("<3f", 1.0, 1.0, 1.0)
+        self.pack("<4f", 1.0, 0.0, 0.0, 0.0)
+        self.pack("<B", 9)
+        self.string(name)
+        self.string("")
+
+    def bounds(self, points):
+        self.pack("<3f", *points.min(axis=0))
+        self.pack("<3f", *points.max(axis=0))
+
+    def geometry(self, vertices, triangles):
+        self.pack("<2I", len(vertices), len(triangles))
+        self.write(vertices.astype("<f4").tobytes())
+        self.write(triangles.astype("<u2").tobytes())
+
+def synthetic_grid(num_vertices, offset=0.0):
+    """Wavy grid with about num_vertices vertices. Returns (LOD_VERTEX_DTYPE array, triangles)."""
+    width = max(2, int(np.sqrt(num_vertices)))
+    height = max(2, num_vertices // width)
+    x, z = np.meshgrid(np.arange(width, dtype=np.float32), np.arange(height, dtype=np.float32))
+    vertices = np.zeros(width * height, dtype=LOD_VERTEX_DTYPE)
+    vertices["pos"][:, 0] = x.ravel() * 0.1 + offset
+    vertices["pos"][:, 1] = np.sin(x.ravel() * 0.3) * np.cos(z.ravel() * 0.3) * 0.2
+    vertices["pos"][:, 2] = z.ravel() * 0.1
+    vertices["norm"][:, 1] = 1.0
+    vertices["uv"][:, 0] = x.ravel() / (width - 1)
+    vertices["uv"][:, 1] = z.ravel() / (height - 1)
+    corner = (np.arange(height - 1)[:, None] * width + np.arange(width - 1)[None, :]).ravel()
+    triangles = np.concatenate([
+        np.stack([corner, corner + width, corner + 1], axis=1),
+        np.stack([corner + 1, corner + width, corner + width + 1], axis=1),
+    ])
+    return vertices, triangles
+
+def write_synthetic_4ds(filepath, materials=4, frames=8, lods=1, vertices=1000, bones=0,
+                        morph_targets=0, sectors=0, portals=0):
+    """
+    Writes a valid v29 file. vertices is the LOD0 vertex count of each object
+    (at most 65535), every further LOD halves it. With bones the first object is
+    a skinned mesh followed by its joint chain, with morph_targets the last
+    object is a morph. Returns counts describing the file.
+    """
+    vertices = min(max(vertices, 4), 65535)
+    materials = max(materials, 1)
+    w = SyntheticWriter()
+    w.write(b"4DS\0")
+    w.pack("<H", VERSION_MAFIA)
+    w.pack("<Q", 0)
+    
+    w.pack("<H", materials)
+    for i in range(materials):
+        w.pack("<I", MTL_DIFFUSETEX | MTL_MIPMAP)
+        w.pack("<3f", 0.5, 0.5, 0.5)
+        w.pack("<3f", (i % 8) / 8.0, 0.5, 1.0 - (i % 8) / 8.0)
+        w.pack("<3f", 0.0, 0.0, 0.0)
+        w.pack("<f", 1.0)
+        w.string("")
+    
+    stats = {"frames": 0, "vertices": 0, "triangles": 0}
+    frame_count = frames + sectors + (bones if frames else 0)
+    w.pack("<H", frame_count)
+    
+    for s in range(sectors):
+        box = np.array([[x, y, z] for x in (0, 10) for y in (0, 5) for z in (0, 10)], dtype=np.float32) + [s * 10, 0, 0]
+        box_tris = np.array([[0, 1, 3], [0, 3, 2], [4, 6, 7], [4, 7, 5], [0, 4, 5], [0, 5, 1],
+                             [2, 3, 7], [2, 7, 6], [0, 2, 6], [0, 6, 4], [1, 5, 7], [1, 7, 3]])
+        w.frame_header(FRAME_SECTOR, 0, f"sector_{s}")
+        w.pack("<2I", 2049, 0)
+        w.geometry(box, box_tris)
+        w.bounds(box)
+        w.pack("<B", portals)
+        for p in range(portals):
+            z = 10.0 * (p + 1) / (portals + 1)
+            quad = np.array([[4, 0, z], [6, 0, z], [6, 3, z], [4, 3, z]], dtype=np.float32) + [s * 10, 0, 0]
+            w.pack("<B", len(quad))
+            w.pack("<Iff", 4, 0.0, 10.0)
+            w.pack("<3f", 0.0, 0.0, 1.0)
+            w.pack("<f", -z)
+            w.write(quad.astype("<f4").tobytes())
+        stats["frames"] += 1
+    
+    first_object = sectors + 1
+    for i in range(frames):
+        visual_type = VISUAL_OBJECT
+        if bones and i == 0:
+            visual_type = VISUAL_SINGLEMESH
+        elif morph_targets and i == frames - 1:
+            visual_type = VISUAL_MORPH
+        w.frame_header(FRAME_VISUAL, 0, f"object_{i}", visual_type, position=(i * 12.0, 0.0, 0.0))
+        w.pack("<H", 0)
+        w.pack("<B", lods)
+        lod_vertices = []
+        for lod in range(lods):
+            lod_verts, lod_tris = synthetic_grid(max(vertices >> lod, 4), offset=0.0)
+            lod_vertices.append(lod_verts)
+            w.pack("<f", 0.0 if lod == 0 else 50.0 * lod)
+            w.pack("<H", len(lod_verts))
+            w.write(lod_verts.tobytes())
+            # Face groups hold at most 65535 triangles, cycle through the materials
+            num_groups = min(255, max(min(materials, 4), -(-len(lod_tris) // 65535)))
+            groups = np.array_split(lod_tris, num_groups)
+            w.pack("<B", len(groups))
+            for g, group in enumerate(groups):
+                w.pack("<H", len(group))
+                w.write(group.astype("<u2").tobytes())
+                w.pack("<H", (i + g) % materials + 1)
+            stats["vertices"] += len(lod_verts)
+            stats["triangles"] += len(lod_tris)
+        
+        if visual_type == VISUAL_SINGLEMESH:
+            for lod_verts in lod_vertices:
+                per_bone = len(lod_verts) // (bones + 1)
+                num_weighted = per_bone // 4
+                w.pack("<B", bones)
+                w.pack("<I", len(lod_verts) - per_bone * bones)
+                w.bounds(lod_verts["pos"])
+                for b in range(bones):
+                    w.pack("<16f", *np.eye(4, dtype=np.float32).ravel())
+                    w.pack("<3I", per_bone - num_weighted, num_weighted, b)
+                    w.bounds(lod_verts["pos"])
+                    w.write(np.full(num_weighted, 0.5, dtype="<f4").tobytes())
+        
+        if visual_type == VISUAL_MORPH:
+            w.pack("<3B", morph_targets, 1, lods)
+            for lod_verts in lod_vertices:
+                indices = np.arange(0, len(lod_verts), 2, dtype="<u2")
+                morph = np.zeros((len(indices), morph_targets, 6), dtype="<f4")
+                morph[:, :, 0:3] = lod_verts["pos"][indices][:, None, :]
+                morph[:, :, 1] += np.arange(1, morph_targets + 1, dtype=np.float32) * 0.1
+                morph[:, :, 4] = 1.0
+                w.pack("<H", len(indices))
+                w.write(morph.tobytes())
+                w.pack("<?", True)
+                w.write(indices.tobytes())
+                w.bounds(lod_verts["pos"])
+                w.pack("<3f", *lod_verts["pos"].mean(axis=0))
+                w.pack("<f", 1.0)
+        stats["frames"] += 1
+        
+        if visual_type == VISUAL_SINGLEMESH:
+            for b in range(bones):
+                w.frame_header(FRAME_JOINT, first_object + b, f"bone_{b}", position=(0.0, 0.5, 0.0))
+                w.pack("<16f", *np.eye(4, dtype=np.float32).ravel())
+                w.pack("<I", b)
+                stats["frames"] += 1
+    
+    w.pack("<?", False)
+    with open(filepath, "wb") as f:
+        f.writelines(w.chunks)
+    stats["bytes"] = w.size
+    return stats
+
+def model_counts(model):
+    """Frame, LOD vertex and triangle totals of a decoded model."""
+    counts = {"frames": len(model["frames"]), "materials": len(model["materials"]), "vertices": 0, "triangles": 0}
+    for rec in model["frames"]:
+        for lod in (rec["data"] or {}).get("lods", ()):
+            counts["vertices"] += len(lod["positions"])
+            counts["triangles"] += sum(len(tris) for tris, _ in lod["groups"])
+    return counts
+
+def source_revision():
+    """Git commit of the addon source, if it lives in a checkout."""
+    try:
+        proc = subprocess.run(
+            ["git", "-C", os.path.dirname(os.path.abspath(__file__)), "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, timeout=10,
+        )
+        return proc.stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+BENCH_STAGES = ("decode", "import", "export", "roundtrip")
+
+def benchmark_file(filepath, stages=BENCH_STAGES, repeat=3):
+    """
+    Times the requested stages on one file. Decode is the best of repeat runs. A
+    failing stage is recorded in result["errors"] and skips the stages after it.
+    """
+    ensure_registered()
+    result = {}
+    errors = {}
+    
+    def run(stage, func):
+        """Times func as stage. Returns (succeeded, value)."""
+        start = time.perf_counter()
+        try:
+            value = func()
+        except Exception as e:
+            errors[stage] = f"{type(e).__name__}: {e}"
+            return False, None
+        result[stage] = time.perf_counter() - start
+        return True, value
+    
+    def skip(failed, *later):
+        for stage in later:
+            if stage in stages:
+                errors[stage] = f"skipped, {failed} failed"
+        return dict(result, errors=errors)
+    
+    if "decode" in stages:
+        times = []
+        for _ in range(repeat):
+            if not run("decode", lambda: The4DSParser(filepath).parse())[0]:
+                break
+            times.append(result["decode"])
+        if times:
+            result["decode"] = min(times)
+    if not {"import", "export", "roundtrip"} & set(stages):
+        return dict(result, errors=errors) if errors else result
+    
+    export_path = os.path.splitext(filepath)[0] + "_export.4ds"
+    try:
+        reset_scene()
+        profiler = Profiler()
+        def import_source():
+            importer = The4DSImporter(filepath, profiler=profiler)
+            importer.build_model(importer.parser.parse())
+        if not run("import", import_source)[0]:
+            return skip("import", "export", "roundtrip")
+        result["import_profile"] = profiler.to_dict()
+        
+        if not {"export", "roundtrip"} & set(stages):
+            return dict(result, errors=errors) if errors else result
+        profiler = Profiler()
+        def export_scene():
+            The4DSExporter(export_path, list(bpy.context.scene.objects), profiler=profiler).serialize_file()
+        if not run("export", export_scene)[0]:
+            return skip("export", "roundtrip")
+        result["export_profile"] = profiler.to_dict()
+        
+        if "roundtrip" in stages:
+            # Decode and import the re-exported file, its geometry has to match the source
+            reset_scene()
+            def import_export():
+                importer = The4DSImporter(export_path)
+                exported = importer.parser.parse()
+                importer.build_model(exported)
+                return exported
+            ok, exported = run("roundtrip", import_export)
+            if ok:
+                source = model_counts(The4DSParser(filepath).parse())
+                copy = model_counts(exported)
+                result["roundtrip_ok"] = source["triangles"] == copy["triangles"]
+    finally:
+        if os.path.exists(export_path):
+            os.remove(export_path)
+    return dict(result, errors=errors) if errors else result
+
+# --- DIFF ---
+# Structural comparison of two decoded models. Geometry is compared as sets of
+# hashed triangles over de-duplicated, quantized corners, so vertex order, vertex
+# splitting and triangle order (which the exporter is free to change) don't count
+# as differences, while moved, missing or re-textured triangles do. Hashing only
+# catches the common case; triangles left without a match are compared again on
+# their float values within the tolerance, so values on either side of a
+# quantization step still match.
+
+def quantize(values, tolerance):
+    return np.round(np.asarray(values, dtype=np.float64) / tolerance).astype(np.int64)
+
+def hash_rows(rows):
+    """
+    64-bit hash of each row of an int array. Sorting and comparing one number per
+    row is far faster than np.unique(axis=0). Collisions are about 2^-64 likely.
+    """
+    rows = np.ascontiguousarray(rows).view(np.uint64).reshape(len(rows), -1)
+    weights = np.random.default_rng(rows.shape[1]).integers(1, 2**63, rows.shape[1], dtype=np.uint64) | np.uint64(1)
+    with np.errstate(over="ignore"):
+        h = (rows * weights).sum(axis=1, dtype=np.uint64)
+        h ^= h >> np.uint64(31)
+        h *= np.uint64(0xBF58476D1CE4E5B9)
+        h ^= h >> np.uint64(29)
+    return h
+
+def distinct(values):
+    values = np.sort(values)
+    return values[np.concatenate([[True], values[1:] != values[:-1]])] if len(values) else values
+
+def close_rows(x, y, tolerance, corners=1, block_pairs=1 << 16):
+    """
+    Which rows of x have a row in y within tolerance (per column) and the other
+    way round. Rows made of corners groups also match any rotation of them.
+    Candidates are the rows of y whose sum, which rotation doesn't change, lies
+    within the summed tolerance of the row of x. They are compared as arrays, in
+    blocks of about block_pairs pairs to bound the memory.
+    """
+    tolerance = np.broadcast_to(np.asarray(tolerance, dtype=np.float64), x.shape[1])
+    match_x = np.zeros(len(x), dtype=bool)
+    match_y = np.zeros(len(y), dtype=bool)
+    if not len(x) or not len(y):
+        return match_x, match_y
+    # Slack for rounding in the sums
+    width = tolerance.sum() * 1.001 + 1e-12
+    key_y = y.sum(axis=1)
+    order = np.argsort(key_y)
+    keys = key_y[order]
+    key_x = x.sum(axis=1)
+    lo = np.searchsorted(keys, key_x - width, side="left")
+    counts = np.searchsorted(keys, key_x + width, side="right") - lo
+    ends = np.cumsum(counts)
+    rotations = [np.roll(y.reshape(len(y), corners, -1), r, axis=1).reshape(len(y), -1) for r in range(corners)]
+    
+    start = 0
+    while start < len(x):
+        done = ends[start - 1] if start else 0
+        stop = max(start + 1, int(np.searchsorted(ends, done + block_pairs, side="right")))
+        rows = np.arange(start, stop)
+        n = counts[rows]
+        pair_x = np.repeat(rows, n)
+        offsets = np.arange(len(pair_x)) - np.repeat(np.cumsum(n) - n, n)
+        pair_y = order[np.repeat(lo[rows], n) + offsets]
+        hit = np.zeros(len(pair_x), dtype=bool)
+        for rotated in rotations:
+            hit |= (np.abs(rotated[pair_y] - x[pair_x]) <= tolerance).all(axis=1)
+        match_x[pair_x[hit]] = True
+        match_y[pair_y[hit]] = True
+        start = stop
+    return match_x, match_y
+
+def rows_only_in(a, b, values_a=None, values_b=None, tolerance=0.0, corners=1):
+    """
+    Numbers of distinct rows that appear only in a and only in b (row hashes).
+    With values (one float row per hash), rows without an equal hash on the
+    other side still match a row within tolerance, see close_rows.
+    """
+    only_a = ~np.isin(a, b)
+    only_b = ~np.isin(b, a)
+    if values_a is not None and only_a.any() and only_b.any():
+        left_a = np.flatnonzero(only_a)
+        left_b = np.flatnonzero(only_b)
+        match_a, match_b = close_rows(values_a[left_a], values_b[left_b], tolerance, corners)
+        only_a[left_a[match_a]] = False
+        only_b[left_b[match_b]] = False
+    return len(distinct(a[only_a])), len(distinct(b[only_b]))
+
+def canonical_triangles(corners, tolerance, tags=None):
+    """
+    corners: (m, 3, k) float attributes per triangle corner, tolerance a scalar or
+    one value per attribute. Returns one hash per triangle, taken after rotating
+    it to start at its smallest corner (winding is kept) and tagged with its material.
+    """
+    m = len(corners)
+    if m == 0:
+        return np.empty(0, dtype=np.uint64)
+    q = quantize(corners, tolerance)
+    corner_hash = hash_rows(q.reshape(m * 3, -1)).reshape(m, 3)
+    start = np.argmin(corner_hash, axis=1)
+    order = (start[:, None] + np.arange(3)[None, :]) % 3
+    rotated = np.take_along_axis(corner_hash, order, axis=1)
+    if tags is None:
+        tags = np.zeros(m, dtype=np.int64)
+    return hash_rows(np.concatenate([rotated.view(np.int64), np.asarray(tags, dtype=np.int64)[:, None]], axis=1))
+
+def triangle_rows(corners, tolerance, tags=None):
+    """
+    Float rows of triangles for rows_only_in: the attributes of each corner
+    followed by the material tag, which has to match exactly. Returns the rows and
+    the tolerance of every column.
+    """
+    m, _, k = corners.shape
+    if tags is None:
+        tags = np.zeros(m, dtype=np.int64)
+    tag_column = np.broadcast_to(np.asarray(tags, dtype=np.float64)[:, None, None], (m, 3, 1))
+    rows = np.concatenate([np.asarray(corners, dtype=np.float64), tag_column], axis=2).reshape(m, -1)
+    column_tolerance = np.tile(np.append(np.broadcast_to(tolerance, k), 0.0), 3)
+    return rows, column_tolerance
+
+def lod_corners(lod):
+    tris = np.concatenate([t for t, _ in lod["groups"]]) if lod["groups"] else np.empty((0, 3), dtype=np.int32)
+    attrs = np.concatenate([lod["positions"], lod["normals"], lod["uvs"]], axis=1)
+    return attrs[tris], tris
+
+class ModelDiff:
+    """Collects the differences between two decoded models."""
+    def __init__(self, a, b, tolerance=1e-4, normal_tolerance=1e-3):
+        self.a = a
+        self.b = b
+        self.tolerance = tolerance
+        self.normal_tolerance = normal_tolerance
+        self.differences = []
+        # Positions and uvs use the position tolerance, normals their own
+        self.corner_tolerance = np.array([tolerance] * 3 + [normal_tolerance] * 3 + [tolerance] * 2)
+        # Materials are compared by content, the exporter may reorder them
+        keys = {}
+        self.material_ids = [
+            [keys.setdefault(self.material_key(m), len(keys)) for m in model["materials"]]
+            for model in (a, b)
+        ]
+
+    def material_key(self, record):
+        return tuple(
+            tuple(np.round(np.asarray(v, dtype=np.float64) / self.normal_tolerance).astype(np.int64)) if isinstance(v, tuple)
+            else round(v / self.normal_tolerance) if isinstance(v, float)
+            else v.lower() if isinstance(v, str)
+            else v
+            for v in material_record_key(record)
+        )
+
+    def add(self, where, text):
+        self.differences.append(f"{where}: {text}")
+
+    def close(self, x, y, tolerance=None):
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        return x.shape == y.shape and bool(np.allclose(x, y, rtol=0.0, atol=tolerance or self.tolerance))
+
+    def run(self):
+        self.compare_materials()
+        frames_a = self.frames_by_key(self.a)
+        frames_b = self.frames_by_key(self.b)
+        for key in sorted(frames_a.keys() - frames_b.keys()):
+            self.add(f"frame '{key[0]}'", "only in the first file")
+        for key in sorted(frames_b.keys() - frames_a.keys()):
+            self.add(f"frame '{key[0]}'", "only in the second file")
+        for key in sorted(frames_a.keys() & frames_b.keys()):
+            self.compare_frame(f"frame '{key[0]}'", frames_a[key], frames_b[key])
+        return self.differences
+
+    def compare_materials(self):
+        used_a = sorted(self.material_ids[0])
+        used_b = sorted(self.material_ids[1])
+        if used_a != used_b:
+            self.add("materials", f"{len(set(used_a) - set(used_b))} only in the first file, "
+                                  f"{len(set(used_b) - set(used_a))} only in the second file")
+
+    def frames_by_key(self, model):
+        # Names can repeat, the n-th frame of a name matches the n-th in the other file
+        seen = {}
+        result = {}
+        for rec in model["frames"]:
+            n = seen.get(rec["name"], 0)
+            seen[rec["name"]] = n + 1
+            result[(rec["name"], n)] = rec
+        return result
+
+    def parent_name(self, model, rec):
+        parent_id = rec["parent_id"]
+        if 0 < parent_id <= len(model["frames"]):
+            return model["frames"][parent_id - 1]["name"]
+        return None
+
+    def compare_frame(self, where, fa, fb):
+        if (fa["type"], fa["visual_type"]) != (fb["type"], fb["visual_type"]):
+            self.add(where, f"type {fa['type']}/{fa['visual_type']} != {fb['type']}/{fb['visual_type']}")
+            return
+        parent_a = self.parent_name(self.a, fa)
+        parent_b = self.parent_name(self.b, fb)
+        if parent_a != parent_b:
+            self.add(where, f"parent '{parent_a}' != '{parent_b}'")
+        if not self.close(fa["position"], fb["position"]):
+            self.add(where, f"position {fa['position']} != {fb['position']}")
+        if not self.close(fa["scale"], fb["scale"]):
+            self.add(where, f"scale {fa['scale']} != {fb['scale']}")
+        # q and -q are the same rotation
+        rot_a = np.asarray(fa["rotation"])
+        rot_b = np.asarray(fb["rotation"])
+        if not (self.close(rot_a, rot_b, self.normal_tolerance) or self.close(rot_a, -rot_b, self.normal_tolerance)):
+            self.add(where, f"rotation {fa['rotation']} != {fb['rotation']}")
+        if fa["culling_flags"] != fb["culling_flags"]:
+            self.add(where, f"culling flags {fa['culling_flags']} != {fb['culling_flags']}")
+        if fa["user_props"] != fb["user_props"]:
+            self.add(where, "user properties differ")
+        if fa["error"] or fb["error"]:
+            self.add(where, f"decode error: {fa['error'] or fb['error']}")
+            return
+        da = fa["data"] or {}
+        db = fb["data"] or {}
+        if "lods" in da:
+            self.compare_lods(where, da, db)
+        if "skin" in da:
+            self.compare_skin(where, da["skin"], db.get("skin") or [])
+        if da.get("morph") or db.get("morph"):
+            self.compare_morph(where, da.get("morph"), db.get("morph"))
+        if "portals" in da:
+            self.compare_geometry(where, da, db)
+            self.compare_portals(where, da["portals"], db["portals"])
+        elif "triangles" in da:
+            self.compare_geometry(where, da, db)
+        for field in ("bbox_min", "bbox_max", "matrix", "billboard", "link_ids", "bone_id", "flags"):
+            if field in da and not self.close(da[field], db.get(field, ()), self.normal_tolerance):
+                self.add(where, f"{field} {da[field]} != {db.get(field)}")
+
+    def compare_lods(self, where, da, db):
+        if len(da["lods"]) != len(db["lods"]):
+            self.add(where, f"{len(da['lods'])} LODs != {len(db['lods'])}")
+        for i, (la, lb) in enumerate(zip(da["lods"], db["lods"])):
+            lod_where = f"{where} LOD{i}"
+            if abs(la["distance"] - lb["distance"]) > self.tolerance:
+                self.add(lod_where, f"distance {la['distance']} != {lb['distance']}")
+            rows = []
+            values = []
+            for side, lod in enumerate((la, lb)):
+                corners, _ = lod_corners(lod)
+                tags = np.concatenate([
+                    np.full(len(t), self.material_tag(side, mat_idx), dtype=np.int64) for t, mat_idx in lod["groups"]
+                ]) if lod["groups"] else np.empty(0, dtype=np.int64)
+                rows.append(canonical_triangles(corners, self.corner_tolerance, tags))
+                values.append(triangle_rows(corners, self.corner_tolerance, tags))
+            column_tolerance = values[0][1]
+            only_a, only_b = rows_only_in(rows[0], rows[1], values[0][0], values[1][0], column_tolerance, corners=3)
+            if only_a or only_b:
+                self.add(lod_where, f"{only_a} of {len(rows[0])} triangles only in the first file, "
+                                    f"{only_b} of {len(rows[1])} only in the second file")
+
+    def material_tag(self, side, mat_idx):
+        ids = self.material_ids[side]
+        return ids[mat_idx - 1] if 0 < mat_idx <= len(ids) else -1
+
+    def compare_geometry(self, where, da, db):
+        corners = [d["vertices"][d["triangles"]] for d in (da, db)]
+        rows = [canonical_triangles(c, self.tolerance) for c in corners]
+        values = [triangle_rows(c, self.tolerance) for c in corners]
+        only_a, only_b = rows_only_in(rows[0], rows[1], values[0][0], values[1][0], values[0][1], corners=3)
+        if only_a or only_b:
+            self.add(where, f"{only_a} triangles only in the first file, {only_b} only in the second file")
+
+    def compare_skin(self, where, skin_a, skin_b):
+        if len(skin_a) != len(skin_b):
+            self.add(where, f"skin of {len(skin_a)} LODs != {len(skin_b)}")
+        for i, (sa, sb) in enumerate(zip(skin_a, skin_b)):
+            lod_where = f"{where} skin LOD{i}"
+            if sa["num_non_weighted"] != sb["num_non_weighted"]:
+                self.add(lod_where, f"{sa['num_non_weighted']} non-weighted vertices != {sb['num_non_weighted']}")
+            bones_a = {bone["bone_id"]: bone for bone in sa["bones"]}
+            bones_b = {bone["bone_id"]: bone for bone in sb["bones"]}
+            if bones_a.keys() != bones_b.keys():
+                self.add(lod_where, f"bones {sorted(bones_a)} != {sorted(bones_b)}")
+            for bone_id in sorted(bones_a.keys() & bones_b.keys()):
+                ba = bones_a[bone_id]
+                bb = bones_b[bone_id]
+                if ba["num_locked"] != bb["num_locked"]:
+                    self.add(lod_where, f"bone {bone_id}: {ba['num_locked']} locked vertices != {bb['num_locked']}")
+                # Vertex order within a bone may change, compare the weight distribution
+                if not self.close(np.sort(ba["weights"]), np.sort(bb["weights"]), self.normal_tolerance):
+                    self.add(lod_where, f"bone {bone_id}: weights differ ({len(ba['weights'])} / {len(bb['weights'])})")
+                if not self.close(ba["inverse_transform"], bb["inverse_transform"], self.normal_tolerance):
+                    self.add(lod_where, f"bone {bone_id}: inverse transform differs")
+
+    def compare_morph(self, where, ma, mb):
+        if not ma or not mb:
+            self.add(where, "morph only in one file")
+            return
+        if (ma["num_targets"], ma["num_channels"], len(ma["lods"])) != (mb["num_targets"], mb["num_channels"], len(mb["lods"])):
+            self.add(where, f"morph layout {ma['num_targets']}x{ma['num_channels']}x{len(ma['lods'])} != "
+                            f"{mb['num_targets']}x{mb['num_channels']}x{len(mb['lods'])}")
+            return
+        for i, (la, lb) in enumerate(zip(ma["lods"], mb["lods"])):
+            for c, (ca, cb) in enumerate(zip(la["channels"], lb["channels"])):
+                if ca is None or cb is None:
+                    if (ca is None) != (cb is None):
+                        self.add(f"{where} morph LOD{i} channel {c}", "empty in one file")
+                    continue
+                # Rows are all target positions of one vertex, independent of vertex order
+                values = [ch["positions"].reshape(len(ch["positions"]), -1).astype(np.float64) for ch in (ca, cb)]
+                rows = [hash_rows(quantize(v, self.tolerance)) for v in values]
+                only_a, only_b = rows_only_in(rows[0], rows[1], values[0], values[1], self.tolerance)
+                if only_a or only_b:
+                    self.add(f"{where} morph LOD{i} channel {c}",
+                             f"{only_a} vertices only in the first file, {only_b} only in the second file")
+
+    def compare_portals(self, where, pa, pb):
+        if len(pa) != len(pb):
+            self.add(where, f"{len(pa)} portals != {len(pb)}")
+        for i, (a, b) in enumerate(zip(pa, pb)):
+            portal_where = f"{where} portal {i}"
+            if a["flags"] != b["flags"]:
+                self.add(portal_where, f"flags {a['flags']} != {b['flags']}")
+            if not self.close((a["near"], a["far"]), (b["near"], b["far"])):
+                self.add(portal_where, f"range {a['near']}-{a['far']} != {b['near']}-{b['far']}")
+            if not self.close(a["normal"] + (a["dot"],), b["normal"] + (b["dot"],), self.normal_tolerance):
+                self.add(portal_where, "plane differs")
+            if not self.close(a["vertices"], b["vertices"]):
+                self.add(portal_where, "vertices differ")
+
+def diff_4ds_files(path_a, path_b, tolerance=1e-4, normal_tolerance=1e-3):
+    """Decodes both files and returns the list of differences."""
+    a = The4DSParser(path_a).parse(threads=1)
+    b = The4DSParser(path_b).parse(threads=1)
+    return ModelDiff(a, b, tolerance, normal_tolerance).run()
+
+def diff_4ds_pair(path_a, path_b, tolerance, normal_tolerance):
+    """Worker entry point for diff. Returns a result dict."""
+    start = time.perf_counter()
+    result = {"path": path_a, "other": path_b, "differences": [], "error": None}
+    try:
+        result["differences"] = diff_4ds_files(path_a, path_b, tolerance, normal_tolerance)
+    except (OSError, ValueError) as e:
+        result["error"] = str(e)
+    result["seconds"] = round(time.perf_counter() - start, 4)
+    return result
+
+def pair_4ds_files(path_a, path_b, recursive=False):
+    """Pairs two files, or the files of two directories by relative path."""
+    if not os.path.isdir(path_a):
+        return [(path_a, path_b)]
+    files_b = {
+        os.path.relpath(path, path_b).lower(): path
+        for path in collect_4ds_files([path_b], recursive)
+    }
+    return [
+        (path, files_b.get(os.path.relpath(path, path_a).lower()))
+        for path in collect_4ds_files([path_a], recursive)
+    ]
+
+# --- COMMAND LINE ---
+# blender --background --factory-startup --python 4ds.py -- <command> [options] files...
+#   import    import every file into an empty scene
+#   export    import and re-export every file (into --output)
+#   validate  decode every file without building Blender data
+#   diff      compare two files (or two directories of files) structurally
+#   synth     write a synthetic test file
+#   bench     time decode/import/export/round-trip over synthetic files of growing size
+# Exit code: 0 all files passed, 1 some failed, 2 usage error.
+
+def validate_model(model):
+    """Returns a list of consistency problems of a decoded model."""
+    problems = []
+    num_materials = len(model["materials"])
+    num_frames = len(model["frames"])
+    for rec in model["frames"]:
+        label = f"frame {rec['index']} '{rec['name']}'"
+        if rec.get("error"):
+            problems.append(f"{label}: {rec['error']}")
+        if rec["parent_id"] > num_frames:
+            problems.append(f"{label}: parent {rec['parent_id']} out of range")
+        data = rec["data"] or {}
+        for lod in data.get("lods", ()):
+            for tris, mat_idx in lod.get("groups", ()):
+                if mat_idx > num_materials:
+                    problems.append(f"{label}: material {mat_idx} out of range")
+    return problems
+
+def reset_scene():
+    """Removes everything a previous import created."""
+    for collection in (bpy.data.objects, bpy.data.meshes, bpy.data.armatures, bpy.data.materials,
+                       bpy.data.images, bpy.data.collections, bpy.data.actions):
+        if len(collection):
+            bpy.data.batch_remove(list(collection))
+
+def cli_process_file(command, filepath, args):
+    """Runs one command on one file in this process. Returns a result dict."""
+    result = {"path": filepath, "ok": False, "error": None}
+    start = time.perf_counter()
+    profiler = Profiler(enabled=args.profile)
+    try:
+        options = {"lod0_only": args.lod0_only, "profiler": profiler}
+        if command == "validate":
+            model = The4DSParser(filepath, **options).parse(threads=1)
+            problems = validate_model(model)
+            result["problems"] = problems
+            if problems:
+                raise ValueError(f"{len(problems)} problems, first: {problems[0]}")
+        else:
+            reset_scene()
+            cache = ModelCache(args.cache, args.cache_size << 20) if args.cache else None
+            importer = The4DSImporter(filepath, threads=1, cache=cache, **options)
+            model = importer.parse_model()
+            importer.build_model(model)
+            if command == "export":
+                out_dir = args.output or os.path.dirname(filepath)
+                out_path = os.path.join(out_dir, os.path.basename(filepath))
+                if os.path.abspath(out_path) == os.path.abspath(filepath):
+                    raise ValueError("Refusing to overwrite the source file, use --output")
+                exporter = The4DSExporter(out_path, list(bpy.context.scene.objects), profiler=profiler,
+                                          optimize_cache=args.optimize_cache,
+                                          # Files already run in parallel workers
+                                          package_textures=args.package_textures, texture_workers=1)
+                exporter.serialize_file()
+                result["output"] = out_path
+                if exporter.cache_summary():
+                    result["vertex_cache"] = exporter.cache_summary()
+                if exporter.texture_summary():
+                    result["textures"] = exporter.texture_summary()
+        result["frames"] = len(model["frames"])
+        result["materials"] = len(model["materials"])
+        result["ok"] = True
+    except Exception as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+    result["seconds"] = round(time.perf_counter() - start, 4)
+    if profiler.enabled:
+        result["profile"] = profiler.to_dict()
+    return result
+
+def cli_worker_args(args):
+    """Options forwarded to Blender worker processes."""
+    forwarded = []
+    if args.lod0_only: forwarded.append("--lod0-only")
+    if args.profile: forwarded.append("--profile")
+    if args.output: forwarded += ["--output", args.output]
+    if args.optimize_cache: forwarded.append("--optimize-cache")
+    if args.package_textures: forwarded.append("--package-textures")
+    if args.cache: forwarded += ["--cache", args.cache, "--cache-size", str(args.cache_size)]
+    return forwarded
+
+def cli_run_chunk(command, chunk, args):
+    """Processes a chunk of files in a separate background Blender."""
+    fd, manifest = tempfile.mkstemp(suffix=".json", prefix="4ds_jobs_")
+    os.close(fd)
+    results_path = manifest + ".out"
+    with open(manifest, "w", encoding="utf-8") as f:
+        json.dump(chunk, f)
+    cmd = [bpy.app.binary_path, "--background", "--factory-startup", "--python", os.path.abspath(__file__),
+           "--", command, "--worker", "--files-from", manifest, "--summary", results_path] + cli_worker_args(args)
+    try:
+        proc = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, timeout=args.timeout or None)
+        if not os.path.exists(results_path):
+            stderr = proc.stderr.decode("utf-8", "replace").strip().splitlines()
+            raise OSError(f"exit code {proc.returncode}" + (f", {stderr[-1]}" if stderr else ""))
+        with open(results_path, encoding="utf-8") as f:
+            return json.load(f)["files"]
+    except (OSError, ValueError, subprocess.TimeoutExpired) as e:
+        # Worker crashed or hung, the whole chunk fails
+        reason = f"Worker failed: {e}"
+        return [{"path": path, "ok": False, "error": reason, "seconds": 0.0} for path in chunk]
+    finally:
+        for path in (manifest, results_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+def cli_schedule(command, filepaths, args):
+    """Runs the files over args.jobs workers and yields results as they finish."""
+    jobs = args.jobs if args.jobs > 0 else (os.cpu_count() or 1)
+    if args.worker or jobs == 1 or len(filepaths) == 1:
+        for path in filepaths:
+            yield cli_process_file(command, path, args)
+        return
+    if command == "validate":
+        # Decoding needs no Blender data, fork this process instead of starting Blenders
+        with create_worker_pool(jobs) as pool:
+            futures = [pool.submit(cli_process_file, command, path, args) for path in filepaths]
+            for future in as_completed(futures):
+                yield future.result()
+        return
+    # Biggest files first, in small chunks, so the workers finish at about the same time
+    filepaths = sorted(filepaths, key=os.path.getsize, reverse=True)
+    chunk_size = args.chunk_size or max(1, len(filepaths) // (jobs * 4))
+    chunks = [filepaths[i:i + chunk_size] for i in range(0, len(filepaths), chunk_size)]
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        futures = [pool.submit(cli_run_chunk, command, chunk, args) for chunk in chunks]
+        for future in as_completed(futures):
+            yield from future.result()
+
+def cli_parser():
+    parser = argparse.ArgumentParser(prog="4ds.py", description="LS3D 4DS command line tools")
+    commands = parser.add_subparsers(dest="command", required=True)
+    for name, text in (
+        ("import", "Import files into an empty scene"),
+        ("export", "Import and re-export files"),
+        ("validate", "Decode files and check their consistency"),
+    ):
+        cmd = commands.add_parser(name, help=text)
+        cmd.add_argument("paths", nargs="*", help=".4ds files or directories")
+        cmd.add_argument("--files-from", help="Text or JSON file listing the files")
+        cmd.add_argument("-r", "--recursive", action="store_true", help="Search directories recursively")
+        cmd.add_argument("-j", "--jobs", type=int, default=0, help="Parallel workers, 0 uses all CPU cores")
+        cmd.add_argument("--chunk-size", type=int, default=0, help="Files per worker process, 0 picks automatically")
+        cmd.add_argument("--timeout", type=float, default=0, help="Seconds before a worker process is killed")
+        cmd.add_argument("--lod0-only", action="store_true", help="Only read LOD0")
+        cmd.add_argument("--profile", action="store_true", help="Record phase times and counters of every file in the summary")
+        cmd.add_argument("-o", "--output", help="Output directory for re-exported files")
+        cmd.add_argument("--optimize-cache", action="store_true", help="Reorder exported triangles and vertices for the vertex cache")
+        cmd.add_argument("--package-textures", action="store_true", help="Convert the textures of exported files into the maps folder next to them")
+        cmd.add_argument("--cache", help="Model cache directory for import and export (off by default)")
+        cmd.add_argument("--cache-size", type=int, default=1024, help="Model cache size limit in MB")
+        cmd.add_argument("--summary", help="Write a JSON summary to this path")
+        cmd.add_argument("-q", "--quiet", action="store_true", help="Only print failures and the totals")
+        cmd.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    
+    cmd = commands.add_parser("diff", help="Compare two files or two directories of files")
+    cmd.add_argument("first", help=".4ds file or directory")
+    cmd.add_argument("second", help=".4ds file or directory")
+    cmd.add_argument("-r", "--recursive", action="store_true", help="Search directories recursively")
+    cmd.add_argument("-j", "--jobs", type=int, default=0, help="Parallel workers, 0 uses all CPU cores")
+    cmd.add_argument("--tolerance", type=float, default=1e-4, help="Tolerance of positions, uvs and distances")
+    cmd.add_argument("--normal-tolerance", type=float, default=1e-3, help="Tolerance of normals, rotations, colors and weights")
+    cmd.add_argument("--max-lines", type=int, default=20, help="Differences printed per file")
+    cmd.add_argument("--summary", help="Write a JSON report to this path")
+    
+    cmd = commands.add_parser("synth", help="Write a synthetic 4DS file")
+    cmd.add_argument("output", help="Path of the .4ds file to write")
+    add_synth_arguments(cmd)
+    cmd.add_argument("--vertices", type=int, default=1000, help="LOD0 vertices per object (max 65535)")
+    
+    cmd = commands.add_parser("bench", help="Benchmark synthetic files of growing size")
+    add_synth_arguments(cmd)
+    cmd.add_argument("--sizes", default="1000,10000,100000,1000000", help="Comma separated total LOD0 vertex counts")
+    cmd.add_argument("--stages", default=",".join(BENCH_STAGES), help="Comma separated stages: " + ", ".join(BENCH_STAGES))
+    cmd.add_argument("--repeat", type=int, default=3, help="Decode runs per size, the best is kept")
+    cmd.add_argument("--results", help="Write the results to this JSON file")
+    cmd.add_argument("--baseline", help="Compare with the results of an earlier run")
+    cmd.add_argument("--keep", help="Keep the synthetic files in this directory")
+    return parser
+
+def add_synth_arguments(cmd):
+    cmd.add_argument("--materials", type=int, default=4)
+    cmd.add_argument("--frames", type=int, default=8, help="Visual objects (bench adds more when a size needs it)")
+    cmd.add_argument("--lods", type=int, default=1)
+    cmd.add_argument("--bones", type=int, default=0, help="Joints of a skinned first object")
+    cmd.add_argument("--morph-targets", type=int, default=0, help="Morph targets of the last object")
+    cmd.add_argument("--sectors", type=int, default=0)
+    cmd.add_argument("--portals", type=int, default=0, help="Portals per sector")
+
+def synth_options(args):
+    return {
+        "materials": args.materials,
+        "frames": args.frames,
+        "lods": args.lods,
+        "bones": args.bones,
+        "morph_targets": args.morph_targets,
+        "sectors": args.sectors,
+        "portals": args.portals,
+    }
+
+def cli_synth(args):
+    stats = write_synthetic_4ds(args.output, vertices=args.vertices, **synth_options(args))
+    print(f"Wrote {args.output}: {stats['frames']} frames, {stats['vertices']} vertices, "
+          f"{stats['triangles']} triangles, {stats['bytes']} bytes")
+    return 0
+
+def cli_diff(args):
+    pairs = pair_4ds_files(args.first, args.second, args.recursive)
+    missing = [a for a, b in pairs if b is None]
+    pairs = [(a, b) for a, b in pairs if b is not None]
+    jobs = args.jobs if args.jobs > 0 else (os.cpu_count() or 1)
+    start = time.perf_counter()
+    results = []
+    with create_worker_pool(max(1, min(jobs, len(pairs)))) as pool:
+        futures = [pool.submit(diff_4ds_pair, a, b, args.tolerance, args.normal_tolerance) for a, b in pairs]
+        for future in as_completed(futures):
+            results.append(future.result())
+    results.sort(key=lambda r: r["path"])
+    
+    different = 0
+    for result in results:
+        if result["error"]:
+            different += 1
+            print(f"ERROR {result['path']}: {result['error']}")
+        elif result["differences"]:
+            different += 1
+            diffs = result["differences"]
+            print(f"DIFF  {result['path']} ({len(diffs)} differences, {result['seconds']:.3f}s)")
+            for line in diffs[:args.max_lines]:
+                print(f"    {line}")
+            if len(diffs) > args.max_lines:
+                print(f"    ... {len(diffs) - args.max_lines} more")
+    for path in missing:
+        different += 1
+        print(f"MISSING {path} has no counterpart in {args.second}")
+    print(f"diff: {len(results) + len(missing) - different}/{len(results) + len(missing)} identical in {time.perf_counter() - start:.2f}s")
+    
+    if args.summary:
+        with open(args.summary, "w", encoding="utf-8") as f:
+            json.dump({"files": results, "missing": missing}, f, indent=1)
+    return 1 if different else 0
+
+def cli_bench(args):
+    sizes = [int(size) for size in args.sizes.split(",") if size.strip()]
+    stages = [stage.strip() for stage in args.stages.split(",") if stage.strip()]
+    unknown = set(stages) - set(BENCH_STAGES)
+    if unknown:
+        print(f"Error: Unknown stages {', '.join(sorted(unknown))}")
+        return 2
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = {run["size"]: run for run in json.load(f)["runs"]}
+    
+    work_dir = args.keep or tempfile.mkdtemp(prefix="4ds_bench_")
+    os.makedirs(work_dir, exist_ok=True)
+    runs = []
+    failed = False
+    print(f"{'vertices':>10} {'MB':>8} " + " ".join(f"{stage:>10}" for stage in stages))
+    try:
+        for size in sizes:
+            options = synth_options(args)
+            # Objects are limited to 65535 vertices, bigger sizes get more of them
+            options["frames"] = max(options["frames"], -(-size // 65535))
+            per_object = -(-size // options["frames"])
+            path = os.path.join(work_dir, f"synthetic_{size}.4ds")
+            stats = write_synthetic_4ds(path, vertices=per_object, **options)
+            run = {"size": size, "file": stats}
+            run.update(benchmark_file(path, stages, args.repeat))
+            runs.append(run)
+            if run.get("roundtrip_ok") is False or run.get("errors"):
+                failed = True
+            line = f"{size:>10} {stats['bytes'] / 1e6:>8.2f} " + " ".join(
+                f"{run[stage]:>9.3f}s" if stage in run else f"{'failed':>10}" for stage in stages)
+            old = baseline.get(size)
+            if old:
+                line += "  vs baseline " + " ".join(
+                    f"{stage} x{run[stage] / old[stage]:.2f}" for stage in stages if old.get(stage) and stage in run)
+            print(line)
+            for stage, error in run.get("errors", {}).items():
+                print(f"    {stage}: {error}")
+            if not args.keep:
+                os.remove(path)
+    finally:
+        if not args.keep:
+            os.rmdir(work_dir)
+    
+    # Slope of time over size on a log-log scale: ~1 is linear, ~2 quadratic
+    for prev, run in zip(runs, runs[1:]):
+        ratio = np.log(run["size"] / prev["size"])
+        run["scaling"] = {
+            stage: round(float(np.log(run[stage] / prev[stage]) / ratio), 3)
+            for stage in stages if prev.get(stage, 0) > 0 and run.get(stage, 0) > 0
+        }
+        slow = [f"{stage} ^{exp:.2f}" for stage, exp in run["scaling"].items() if exp > 1.3]
+        if slow:
+            print(f"Superlinear from {prev['size']} to {run['size']} vertices: {', '.join(slow)}")
+    if any(run.get("roundtrip_ok") is False for run in runs):
+        print("Error: Round-trip changed the triangle count")
+    
+    if args.results:
+        with open(args.results, "w", encoding="utf-8") as f:
+            json.dump({
+                "revision": source_revision(),
+                "date": datetime.now().isoformat(timespec="seconds"),
+                "blender": bpy.app.version_string,
+                "python": sys.version.split()[0],
+                "cpu_count": os.cpu_count(),
+                "options": dict(synth_options(args), stages=stages, repeat=args.repeat),
+                "runs": runs,
+            }, f, indent=1)
+    return 1 if failed else 0
+
+def cli_read_file_list(path):
+    with open(path, encoding="utf-8") as f:
+        text = f.read()
+    if text.lstrip().startswith("["):
+        return json.loads(text)
+    return [line.strip() for line in text.splitlines() if line.strip()]
+
+def ensure_registered():
+    """Registers the addon properties for command line runs, unless the addon is already enabled."""
+    if "visual_type" not in bpy.types.Object.bl_rna.properties:
+        register()
+
+def cli_main(argv):
+    parser = cli_parser()
+    try:
+        args = parser.parse_args(argv)
+    except SystemExit as e:
+        return 2 if e.code else 0
+    if args.command == "synth":
+        return cli_synth(args)
+    if args.command == "diff":
+        configure_logging("ERROR")
+        return cli_diff(args)
+    # Importing and exporting set the addon's object and material properties
+    ensure_registered()
+    if args.command == "bench":
+        configure_logging("ERROR")
+        return cli_bench(args)
+    configure_logging("ERROR" if args.quiet or args.worker else "WARNING")
+    paths = list(args.paths)
+    if args.files_from:
+        paths += cli_read_file_list(args.files_from)
+    filepaths = collect_4ds_files(paths, recursive=args.recursive)
+    if not filepaths:
+        print("Error: No .4ds files found")
+        return 2
+    if args.output:
+        os.makedirs(args.output, exist_ok=True)
+    
+    start = time.perf_counter()
+    results = []
+    for result in cli_schedule(args.command, filepaths, args):
+        results.append(result)
+        if not args.worker and (not result["ok"] or not args.quiet):
+            status = "OK  " if result["ok"] else "FAIL"
+            line = f"[{len(results)}/{len(filepaths)}] {status} {result['seconds']:8.3f}s {result['path']}"
+            if result["error"]:
+                line += f" - {result['error']}"
+            print(line)
+    elapsed = time.perf_counter() - start
+    failed = [r for r in results if not r["ok"]]
+    
+    if args.summary:
+        summary = {
+            "command": args.command,
+            "blender": bpy.app.version_string,
+            "date": datetime.now().isoformat(timespec="seconds"),
+            "jobs": args.jobs,
+            "total": len(results),
+            "passed": len(results) - len(failed),
+            "failed": len(failed),
+            "seconds": round(elapsed, 3),
+            "files": sorted(results, key=lambda r: r["path"]),
+        }
+        with open(args.summary, "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=1)
+    if not args.worker:
+        print(f"{args.command}: {len(results) - len(failed)}/{len(results)} passed in {elapsed:.2f}s")
+    return 1 if failed else 0
+
 if __name__ == "__main__":
+    if "--" in sys.argv:
+        sys.exit(cli_main(sys.argv[sys.argv.index("--") + 1:]))
     register()